@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+准入控制 - 限制同时进行的上游调用数，超出的请求进入有界等待队列；
+配合令牌桶限制调用速率，队列已满或等待超时时快速拒绝（503 + Retry-After），避免堆积到120秒超时；
+对冲的备用请求用try_acquire/release额外占用一个名额，没有空闲名额时不对冲
+同步版本用于Flask(多线程)，异步版本用于Quart(asyncio)
+"""
+
+import os
+import time
+import math
+import asyncio
+import threading
+from contextlib import contextmanager, asynccontextmanager
+
+from shared_backend import call_blocking
+
+ADMISSION_MAX_CONCURRENT = int(os.environ.get('ADMISSION_MAX_CONCURRENT', 8))
+ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', 32))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 10))
+UPSTREAM_RPM = float(os.environ.get('UPSTREAM_RPM', 60))
+UPSTREAM_BURST = float(os.environ.get('UPSTREAM_BURST', 10))
+
+
+class Overloaded(Exception):
+    """服务繁忙，请求被拒绝；retry_after为建议的重试等待秒数"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class TokenBucket:
+    """令牌桶限速：rate为每秒补充的令牌数，burst为桶容量"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """预订一个令牌，返回需要等待的秒数（0表示立即可用）"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def cancel(self):
+        """归还预订但未使用的令牌"""
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1)
+
+
+class _AdmissionStats:
+    """并发数、排队数和拒绝次数等统计"""
+
+    def __init__(self, max_concurrent, max_queue, queue_timeout, bucket):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.bucket = bucket
+        self.in_flight = 0
+        self.queued = 0
+        self.peak_queued = 0
+        self.admitted = 0
+        self.rejected = {'queue_full': 0, 'queue_timeout': 0, 'rate_limited': 0}
+        self.total_wait = 0.0
+        self.extra_admitted = 0
+        self.extra_denied = 0
+
+    def stats(self):
+        return {
+            'in_flight': self.in_flight,
+            'queued': self.queued,
+            'peak_queued': self.peak_queued,
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'admitted': self.admitted,
+            'rejected': dict(self.rejected),
+            'avg_wait_ms': round(self.total_wait / self.admitted * 1000) if self.admitted else 0,
+            'extra_admitted': self.extra_admitted,
+            'extra_denied': self.extra_denied,
+            'rate_per_minute': round(self.bucket.rate * 60, 1)
+        }
+
+    def _reserve(self, remaining):
+        """预订一个令牌并返回需要等待的秒数；超过remaining秒时归还令牌
+        （在同一次调用中归还：SharedTokenBucket按线程记录预订）"""
+        wait = self.bucket.reserve()
+        if wait > remaining:
+            self.bucket.cancel()
+        return wait
+
+    def _reject(self, reason, retry_after):
+        self.rejected[reason] += 1
+        print(f"[ADMISSION] 拒绝请求: {reason} (排队 {self.queued}, 进行中 {self.in_flight})")
+        return Overloaded(reason, retry_after)
+
+
+class AdmissionController(_AdmissionStats):
+    """线程版准入控制
+
+    bucket可替换为其他令牌桶（如shared_backend.SharedTokenBucket，多个进程共用速率预算），
+    此时忽略rpm和burst
+    """
+
+    def __init__(self, max_concurrent=ADMISSION_MAX_CONCURRENT, max_queue=ADMISSION_MAX_QUEUE,
+                 queue_timeout=ADMISSION_QUEUE_TIMEOUT, rpm=UPSTREAM_RPM, burst=UPSTREAM_BURST,
+                 bucket=None):
+        super().__init__(max_concurrent, max_queue, queue_timeout,
+                         bucket or TokenBucket(rpm / 60, burst))
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self):
+        """获取一个上游调用名额，无法在queue_timeout内获得时抛出Overloaded"""
+        start_time = time.monotonic()
+
+        if not self._semaphore.acquire(blocking=False):
+            with self._lock:
+                if self.queued >= self.max_queue:
+                    raise self._reject('queue_full', self.queue_timeout)
+                self.queued += 1
+                self.peak_queued = max(self.peak_queued, self.queued)
+            try:
+                acquired = self._semaphore.acquire(timeout=self.queue_timeout)
+            finally:
+                with self._lock:
+                    self.queued -= 1
+            if not acquired:
+                with self._lock:
+                    raise self._reject('queue_timeout', self.queue_timeout)
+
+        try:
+            remaining = self.queue_timeout - (time.monotonic() - start_time)
+            wait = self._reserve(remaining)
+            if wait > remaining:
+                with self._lock:
+                    raise self._reject('rate_limited', wait)
+            if wait > 0:
+                time.sleep(wait)
+
+            with self._lock:
+                self.in_flight += 1
+                self.admitted += 1
+                self.total_wait += time.monotonic() - start_time
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+        finally:
+            self._semaphore.release()
+
+    def try_acquire(self):
+        """不排队、不等待令牌地获取一个额外名额（对冲的备用请求使用），成功后需调用release()
+
+        有请求在排队、没有空闲名额或需要等待令牌时返回False
+        """
+        with self._lock:
+            if self.queued > 0 or not self._semaphore.acquire(blocking=False):
+                self.extra_denied += 1
+                return False
+        if self._reserve(0) > 0:
+            self._semaphore.release()
+            with self._lock:
+                self.extra_denied += 1
+            return False
+        with self._lock:
+            self.in_flight += 1
+            self.extra_admitted += 1
+        return True
+
+    def release(self):
+        """释放try_acquire()获取的名额"""
+        with self._lock:
+            self.in_flight -= 1
+        self._semaphore.release()
+
+
+class AsyncAdmissionController(_AdmissionStats):
+    """asyncio版准入控制（单线程事件循环内使用，无需加锁）"""
+
+    def __init__(self, max_concurrent=ADMISSION_MAX_CONCURRENT, max_queue=ADMISSION_MAX_QUEUE,
+                 queue_timeout=ADMISSION_QUEUE_TIMEOUT, rpm=UPSTREAM_RPM, burst=UPSTREAM_BURST,
+                 bucket=None):
+        super().__init__(max_concurrent, max_queue, queue_timeout,
+                         bucket or TokenBucket(rpm / 60, burst))
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    @asynccontextmanager
+    async def slot(self):
+        start_time = time.monotonic()
+
+        if self._semaphore.locked():
+            if self.queued >= self.max_queue:
+                raise self._reject('queue_full', self.queue_timeout)
+            self.queued += 1
+            self.peak_queued = max(self.peak_queued, self.queued)
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise self._reject('queue_timeout', self.queue_timeout)
+            finally:
+                self.queued -= 1
+        else:
+            await self._semaphore.acquire()
+
+        try:
+            # 共享令牌桶的预订是网络请求，在线程池中执行
+            remaining = self.queue_timeout - (time.monotonic() - start_time)
+            wait = await call_blocking(self.bucket, self._reserve, remaining)
+            if wait > remaining:
+                raise self._reject('rate_limited', wait)
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            self.in_flight += 1
+            self.admitted += 1
+            self.total_wait += time.monotonic() - start_time
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+        finally:
+            self._semaphore.release()
+
+    async def try_acquire(self):
+        """同AdmissionController.try_acquire"""
+        if self.queued > 0 or self._semaphore.locked():
+            self.extra_denied += 1
+            return False
+        await self._semaphore.acquire()
+        if await call_blocking(self.bucket, self._reserve, 0) > 0:
+            self._semaphore.release()
+            self.extra_denied += 1
+            return False
+        self.in_flight += 1
+        self.extra_admitted += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
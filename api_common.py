@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+API服务器公共部分 - 同步(Flask)与异步(Quart)两种服务模式共用的配置和工具函数
+"""
+
+import os
+import json
+
+from canonicalize import FieldCanonicalizer
+from hedging import HEDGE_ENABLED
+from prompt_templates import PROMPT_FIELDS, PromptTemplateStore
+from recommendation_cache import RecommendationCache
+from recommendation_store import RECOMMEND_STORE_PATH, RecommendationStore
+from recommendation_parser import parse_recommendation
+from admission import ADMISSION_MAX_CONCURRENT, UPSTREAM_BURST, UPSTREAM_RPM
+from shared_backend import SharedRecommendationCache, SharedTokenBucket, create_shared_backend
+
+BASE_URL = "https://open.bigmodel.cn/api/anthropic"
+
+# prompt模板版本号：模板内容变化时修改，使旧缓存自动失效
+PROMPT_TEMPLATE_VERSION = os.environ.get('PROMPT_TEMPLATE_VERSION', 'v1')
+
+# 服务端提示词模板（解析一次，文件修改后自动重新加载）
+prompt_templates = PromptTemplateStore()
+
+# 渲染前规范化地点、天气和时间，使相近的请求共享缓存
+field_canonicalizer = FieldCanonicalizer()
+
+# 多进程部署时共用的缓存、合并锁和上游速率预算（SHARED_BACKEND_URL为空时为None，各进程独立）
+shared_backend = create_shared_backend()
+
+# 批量推荐配置：单次最多条目数、并发上限、整批超时（秒）
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 32))
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', 4))
+BATCH_TIMEOUT = float(os.environ.get('BATCH_TIMEOUT', 120))
+
+MODELS = [
+    {'id': 'glm-4-flash', 'name': 'GLM-4 Flash', 'description': '快速模型'},
+    {'id': 'glm-4.6', 'name': 'GLM-4.6', 'description': '标准模型'},
+    {'id': 'glm-4.7', 'name': 'GLM-4.7', 'description': '高质量模型'}
+]
+
+
+def _attach_store(cache, table):
+    """关联持久化存储：第一次访问缓存时预加载未过期的记录，之后的写入同步保存到磁盘
+
+    RECOMMEND_STORE_PATH设为空字符串时不使用持久化存储
+    """
+    if RECOMMEND_STORE_PATH:
+        cache.attach_store(RecommendationStore(RECOMMEND_STORE_PATH, table=table))
+    return cache
+
+
+def create_recommendation_cache():
+    """按环境变量配置创建推荐结果缓存（配置了共享后端时各进程共用）"""
+    ttl = int(os.environ.get('RECOMMEND_CACHE_TTL', 3600))
+    # 超过软TTL后在硬TTL内先返回过期结果，同时在后台重新生成
+    hard_ttl = int(os.environ.get('RECOMMEND_CACHE_HARD_TTL', 6 * 3600))
+    if shared_backend is not None:
+        return SharedRecommendationCache(shared_backend, 'recommendations', ttl=ttl, hard_ttl=hard_ttl)
+    return _attach_store(RecommendationCache(
+        max_bytes=int(os.environ.get('RECOMMEND_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+        ttl=ttl,
+        hard_ttl=hard_ttl
+    ), 'recommendations')
+
+
+def create_translation_cache():
+    """翻译结果缓存，推荐内容翻译后不会变化，默认保留更久"""
+    ttl = int(os.environ.get('TRANSLATE_CACHE_TTL', 24 * 3600))
+    if shared_backend is not None:
+        return SharedRecommendationCache(shared_backend, 'translations', ttl=ttl)
+    return _attach_store(RecommendationCache(
+        max_bytes=int(os.environ.get('TRANSLATE_CACHE_MAX_BYTES', 16 * 1024 * 1024)),
+        ttl=ttl
+    ), 'translations')
+
+
+def create_upstream_bucket(key_count=1):
+    """上游调用的令牌桶：配置了共享后端时返回全局令牌桶（所有进程合计不超过UPSTREAM_RPM × Key数），
+    否则返回None，由准入控制器使用进程内令牌桶"""
+    if shared_backend is None:
+        return None
+    return SharedTokenBucket(shared_backend, 'upstream', UPSTREAM_RPM * key_count / 60, UPSTREAM_BURST)
+
+
+def upstream_admission_options(key_count):
+    """在线请求准入控制器的参数
+
+    ADMISSION_MAX_CONCURRENT和UPSTREAM_RPM是单个API Key的配额，配置多个Key时按Key数放大
+    """
+    return {
+        'max_concurrent': ADMISSION_MAX_CONCURRENT * key_count,
+        'rpm': UPSTREAM_RPM * key_count,
+        'bucket': create_upstream_bucket(key_count)
+    }
+
+
+def read_recommend_params(data):
+    """从请求体中读取推荐参数（带默认值）
+
+    支持两种方式：
+    1. 直接提供渲染好的prompt
+    2. 提供结构化参数(date, time, mealPeriod, dietType, healthGoal, location,
+       weather, solarTerm, season, language)，由服务端规范化后按模板渲染
+    结构化参数不完整时抛出ValueError
+    """
+    prompt = data.get('prompt')
+    prompt_version = data.get('prompt_version', PROMPT_TEMPLATE_VERSION)
+    fields = None
+
+    if not prompt and any(name in data for name in PROMPT_FIELDS):
+        fields = {name: data.get(name) for name in PROMPT_FIELDS}
+        fields['language'] = data.get('language')
+        fields = field_canonicalizer.canonicalize(fields)
+        prompt, prompt_version = prompt_templates.render_prompt(fields)
+
+    return {
+        'prompt': prompt,
+        'model': data.get('model', 'glm-4-flash'),
+        'max_tokens': data.get('max_tokens', 4096),
+        'temperature': data.get('temperature', 0.7),
+        'prompt_version': prompt_version,
+        'fields': fields,
+        'hedge': bool(data.get('hedge', HEDGE_ENABLED))
+    }
+
+
+def read_batch_request(data):
+    """解析批量推荐请求，返回(各条目参数列表, 并发数, 超时秒数)
+
+    请求体格式: {'items': [{...}, ...], 'concurrency': 4, 'timeout': 120, ...}
+    items之外的字段作为每个条目的默认值；参数不合法时抛出ValueError
+    """
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        raise ValueError('Missing items')
+    if len(items) > BATCH_MAX_ITEMS:
+        raise ValueError(f'Too many items (max {BATCH_MAX_ITEMS})')
+
+    defaults = {k: v for k, v in data.items() if k not in ('items', 'concurrency', 'timeout')}
+    params_list = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f'Item {index} must be an object')
+        try:
+            params_list.append(read_recommend_params({**defaults, **item}))
+        except ValueError as e:
+            raise ValueError(f'Item {index}: {e}')
+
+    concurrency = min(int(data.get('concurrency', BATCH_MAX_CONCURRENCY)), BATCH_MAX_CONCURRENCY)
+    timeout = min(float(data.get('timeout', BATCH_TIMEOUT)), BATCH_TIMEOUT)
+    return params_list, max(concurrency, 1), timeout
+
+
+def batch_item(index, result=None, error=None):
+    """批量推荐中单个条目的结果，result为fetch_recommendation的返回值"""
+    if error is not None or not result or not result['content']:
+        return {'index': index, 'success': False, 'error': error or 'Empty response from API'}
+    return {'index': index, **recommendation_response(result)}
+
+
+def recommendation_response(result):
+    """根据fetch_recommendation的返回值构造成功响应"""
+    content = result['content']
+    return {
+        'success': True,
+        'content': content,
+        **recommendation_fields(content),
+        'model': result['model'],
+        'cached': result['source'] in ('cache', 'stale'),
+        'shared': result['source'] == 'shared',
+        # 超过软TTL的缓存结果（已在后台刷新）或繁忙时的降级结果
+        'stale': result['source'] == 'stale'
+    }
+
+
+def overloaded_payload(error):
+    """服务繁忙时的503响应内容，error为admission.Overloaded"""
+    return {
+        'error': 'Server busy, please retry later',
+        'reason': error.reason,
+        'retry_after': error.retry_after
+    }
+
+
+def batch_response(results):
+    """汇总批量推荐结果，results为按条目顺序排列的单条结果"""
+    succeeded = sum(1 for r in results if r.get('success'))
+    return {
+        'success': True,
+        'results': results,
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded
+    }
+
+
+def recommendation_fields(content):
+    """解析模型输出，返回响应中附带的结构化推荐字段"""
+    recommendation, truncated = parse_recommendation(content)
+    return {'recommendation': recommendation, 'truncated': truncated}
+
+
+def sse_event(event, data):
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def health_payload(service, cache, **extra):
+    """健康检查返回内容，extra为各服务模式附加的统计信息"""
+    payload = {
+        'status': 'ok',
+        'service': service,
+        'sdk': 'Anthropic',
+        'plan': 'GLM Coding Plan (套餐内)',
+        'models': [m['id'] for m in MODELS],
+        'cache': cache.stats()
+    }
+    payload.update(extra)
+    return payload
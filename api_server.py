@@ -3,14 +3,47 @@
 """
 饮食推荐API服务器 - 使用Anthropic SDK
 所有API调用都在GLM Coding Plan套餐内，不会产生额外费用
+
+与Web框架无关的业务逻辑在recommend_service.py中（与api_server_async.py共用），
+本文件只包含Flask路由和按线程执行的上游调用、请求合并和缓存读写
 """
 
 import os
 import sys
-from flask import Flask, request, jsonify
+import time
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, wait
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 from anthropic import Anthropic
 
+from api_common import (
+    BASE_URL, MODELS, batch_item, create_recommendation_cache, create_translation_cache,
+    read_batch_request, read_recommend_params, recommendation_response, shared_backend, sse_event,
+    upstream_admission_options
+)
+from admission import AdmissionController, Overloaded
+from compression import compress_body, is_compressible
+from key_pool import KeyPool, PooledClient, load_api_keys
+from jobs import (
+    FINISHED, JOB_EVENTS_KEEPALIVE, JOB_MAX_PENDING, JobWorkerPool, create_job_store, job_response,
+    job_submitted_response
+)
+from prewarm import PREWARM_ENABLED, PrewarmScheduler, create_budget
+from recommend_service import (
+    RecommendationStream, bad_request, batch_item_error, cached_result, degraded_result, empty_response,
+    error_response, finish_batch, health_report, hedge_policy, job_result, message_kwargs,
+    metrics, metrics_report, missing_prompt_item, print_banner, print_endpoints, read_response,
+    read_single_recommend, read_translation, recommend_cache_key, result_cache_key, retry_policy,
+    translation_result, upstream_result
+)
+from retry_policy import Deadline
+from single_flight import SingleFlight
+from translation import (
+    TRANSLATE_MAX_CONCURRENCY, TRANSLATE_MODEL, TRANSLATE_PROMPT_VERSION, chunk_texts, collect_texts,
+    make_translation_key, read_translate_request, translate_kwargs, translate_response
+)
+
 # 设置Windows控制台编码
 if sys.platform == 'win32':
     try:
@@ -23,106 +56,450 @@ if sys.platform == 'win32':
 app = Flask(__name__)
 CORS(app)  # 允许跨域请求
 
-# 初始化Anthropic客户端（全局复用）
-API_KEY = os.environ.get('ZHIPU_API_KEY')
-if not API_KEY:
+# 初始化Anthropic客户端（全局复用），配置多个API Key时每次调用选择负载最低的Key
+API_KEYS = load_api_keys()
+if not API_KEYS:
     print("ERROR: ZHIPU_API_KEY environment variable not set")
     sys.exit(1)
 
-anthropic_client = Anthropic(
-    api_key=API_KEY,
-    base_url="https://open.bigmodel.cn/api/anthropic"
-)
+key_pool = KeyPool(API_KEYS, partial(Anthropic, base_url=BASE_URL))
+anthropic_client = PooledClient(key_pool, retry_policy)
+
+# 推荐结果缓存（相同参数的请求直接返回，避免重复调用GLM）
+recommendation_cache = create_recommendation_cache()
+
+# 合并相同参数的并发请求，同一时刻只向GLM发起一次调用（配置共享后端时跨进程合并）
+recommendation_flight = SingleFlight(lock_backend=shared_backend)
+
+# 翻译结果缓存（按推荐内容哈希 + 目标语言），切换语言时直接返回
+translation_cache = create_translation_cache()
+translation_flight = SingleFlight(lock_backend=shared_backend)
+
+# 准入控制：限制并发上游调用数和调用速率，排队过长时快速拒绝
+# （上限按API Key数放大；配置共享后端时速率为所有进程合计）
+admission = AdmissionController(**upstream_admission_options(len(key_pool)))
+
+# 预热使用独立的调用预算，不占用在线请求的名额
+prewarm_admission = create_budget(AdmissionController)
+
+print_banner("饮食推荐API服务器启动", key_pool, 'Anthropic', recommendation_cache)
 
-print("=" * 60)
-print("饮食推荐API服务器启动")
-print("=" * 60)
-print(f"API Key已加载 (长度: {len(API_KEY)})")
-print(f"Base URL: https://open.bigmodel.cn/api/anthropic")
-print(f"SDK: Anthropic (套餐内调用)")
-print("=" * 60)
+
+def generate_recommendation_content(params, cache_key, controller=admission, deadline=None):
+    """调用GLM（可选对冲）生成推荐内容并写入缓存，返回(content, 实际使用的模型)
+
+    controller为上游调用的准入控制器，预热时使用独立的预算；deadline为请求的截止时间
+    """
+    # 在合并锁内执行：等锁期间共享后端中的其他进程可能已经写入了新鲜结果
+    if recommendation_cache.is_fresh(cache_key):
+        return recommendation_cache.get(cache_key), params['model']
+
+    model = params['model']
+    kwargs = message_kwargs(params, deadline)
+    with controller.slot():
+        if params['hedge'] and hedge_policy.applies_to(model):
+            content, used_model = hedge_policy.call(anthropic_client, model, admission=controller, **kwargs)
+        else:
+            # 使用Anthropic SDK调用API（在套餐内）
+            start_time = time.time()
+            response = anthropic_client.messages.create(model=model, **kwargs)
+            content = read_response(model, response, time.time() - start_time, params['max_tokens'])
+            used_model = model
+
+    if content:
+        # 在释放合并锁之前写入缓存，后续请求直接命中
+        recommendation_cache.set(result_cache_key(params, cache_key, used_model), content,
+                                 prompt_version=params['prompt_version'])
+    return content, used_model
+
+
+def revalidate_in_background(params, cache_key):
+    """返回过期缓存的同时在后台重新生成，同一key同时只有一个刷新任务"""
+    def refresh():
+        # 排队期间已被其他请求刷新过的不再重复调用
+        if recommendation_cache.is_fresh(cache_key):
+            return None, params['model']
+        return generate_recommendation_content(params, cache_key)
+
+    if recommendation_flight.do_background(cache_key, refresh):
+        print(f"[SWR] 返回过期缓存并在后台刷新 ({cache_key[:12]})")
+
+
+def fetch_recommendation(params, deadline=None):
+    """按参数获取推荐内容：缓存 -> 合并并发请求 -> 调用GLM（可选对冲）
+
+    返回dict: content（上游返回空内容时为None）,
+    source（'cache'、'shared'、'upstream'，超过软TTL或繁忙降级时为'stale'）,
+    model（实际生成内容的模型，对冲时可能是备用模型）
+    """
+    cache_key = recommend_cache_key(params)
+    cached_content, freshness = recommendation_cache.lookup(cache_key)
+    result = cached_result(params, cache_key, cached_content, freshness)
+    if result is not None:
+        if freshness == 'stale':
+            revalidate_in_background(params, cache_key)
+        return result
+
+    try:
+        (content, used_model), shared = recommendation_flight.do(
+            cache_key, lambda: generate_recommendation_content(params, cache_key, deadline=deadline),
+            deadline)
+    except Overloaded:
+        # 繁忙时优先返回已过期但仍保留的缓存结果（降级），没有则由调用方返回503
+        result = degraded_result(params, cache_key,
+                                 recommendation_cache.get(cache_key, allow_expired=True))
+        if result is None:
+            raise
+        return result
+
+    return upstream_result(cache_key, content, used_model, shared)
+
+
+def prewarm_recommendation(data):
+    """预热单个请求：缓存中没有新鲜结果时按预热预算生成，返回是否调用了上游"""
+    params = read_recommend_params(data)
+    cache_key = recommend_cache_key(params)
+    if recommendation_cache.is_fresh(cache_key):
+        return False
+    recommendation_flight.do(
+        cache_key, lambda: generate_recommendation_content(params, cache_key, prewarm_admission))
+    return True
+
+
+# 用餐高峰前预先生成推荐（PREWARM_ENABLED=1时启用）
+prewarm_scheduler = PrewarmScheduler(prewarm_recommendation, admission)
+
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_start = time.time()
+    g.metrics_endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.in_flight.inc(g.metrics_endpoint)
+    # 客户端可以用X-Request-Timeout请求头指定截止时间，重试不会超过它
+    g.deadline = Deadline.from_headers(request.headers)
+
+
+@app.after_request
+def record_request_metrics(response):
+    # 流式接口在此只统计到开始推送为止，完整耗时见上游调用耗时
+    if 'metrics_endpoint' in g:
+        metrics.observe_request(g.metrics_endpoint, g.get('metrics_model'), response.status_code,
+                                time.time() - g.metrics_start)
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    # 超过COMPRESS_MIN_SIZE的JSON等文本响应按Accept-Encoding即时压缩；SSE等流式响应不处理
+    if response.is_streamed or response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    if not is_compressible(response.content_type):
+        return response
+    response.vary.add('Accept-Encoding')
+    body, encoding = compress_body(response.get_data(), response.content_type,
+                                   request.headers.get('Accept-Encoding'))
+    if encoding is not None:
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    # 流式响应结束时请求上下文会再次弹出，只减一次
+    endpoint = g.pop('metrics_endpoint', None)
+    if endpoint is not None:
+        metrics.in_flight.dec(endpoint)
 
 
 @app.route('/api/recommend', methods=['POST'])
 def generate_recommendation():
     """生成饮食推荐 - 使用Anthropic SDK在套餐内调用"""
+    try:
+        params = read_single_recommend(request.json)
+    except ValueError as e:
+        return jsonify(bad_request(e)), 400
+    g.metrics_model = params['model']
+
+    print(f"\n{'='*60}")
+    print(f"收到推荐请求")
+    print(f"模型: {params['model']}")
+    print(f"Prompt长度: {len(params['prompt'])} 字符")
+    print(f"{'='*60}")
 
     try:
-        data = request.json
-        prompt = data.get('prompt')
-        model = data.get('model', 'glm-4-flash')
-        max_tokens = data.get('max_tokens', 4096)
-        temperature = data.get('temperature', 0.7)
-
-        if not prompt:
-            return jsonify({'error': 'Missing prompt'}), 400
-
-        print(f"\n{'='*60}")
-        print(f"收到推荐请求")
-        print(f"模型: {model}")
-        print(f"Prompt长度: {len(prompt)} 字符")
-        print(f"{'='*60}")
-
-        # 使用Anthropic SDK调用API（在套餐内）
-        response = anthropic_client.messages.create(
-            model=model,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
-        )
-
-        if response and response.content:
-            content = response.content[0].text
-            print(f"✓ 推荐生成成功")
-            print(f"返回内容长度: {len(content)} 字符")
-
-            return jsonify({
-                'success': True,
-                'content': content
-            })
-        else:
-            print(f"✗ API返回空内容")
-            return jsonify({'error': 'Empty response from API'}), 500
+        result = fetch_recommendation(params, g.deadline)
+    except Exception as e:
+        payload, status, headers = error_response(e, '生成推荐')
+        return jsonify(payload), status, headers
 
+    if not result['content']:
+        return jsonify(empty_response()), 500
+    print(f"✓ 推荐生成成功 ({result['model']})")
+    print(f"返回内容长度: {len(result['content'])} 字符")
+    return jsonify(recommendation_response(result))
+
+
+def recommend_batch_item(index, params, deadline=None):
+    """批量推荐中的单个条目，出错时返回错误结果而不抛出异常"""
+    if not params['prompt']:
+        return missing_prompt_item(index)
+    try:
+        return batch_item(index, fetch_recommendation(params, deadline))
     except Exception as e:
-        print(f"✗ 生成推荐失败: {e}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+        return batch_item_error(index, e)
+
+
+@app.route('/api/recommend/batch', methods=['POST'])
+def batch_recommendation():
+    """批量生成饮食推荐 - 多组参数并发执行（受并发上限约束），逐条返回结果或错误"""
+    try:
+        params_list, concurrency, timeout = read_batch_request(request.json or {})
+    except (ValueError, TypeError) as e:
+        return jsonify(bad_request(e)), 400
+
+    print(f"\n[BATCH] 收到批量推荐请求: {len(params_list)}条, 并发 {concurrency}, 超时 {timeout:.0f}秒")
+    start_time = time.time()
+
+    # 整批超时和请求截止时间取较早者，条目内的重试也不会超过它
+    deadline = Deadline(min(timeout, g.deadline.remaining()))
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='batch')
+    futures = [executor.submit(recommend_batch_item, i, p, deadline) for i, p in enumerate(params_list)]
+    done, _ = wait(futures, timeout=deadline.timeout)
+    # 超时的条目不再等待；已在执行的上游调用在截止时间内完成时仍会写入缓存
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    items = [future.result() if future in done else None for future in futures]
+    return jsonify(finish_batch(items, deadline, start_time))
+
+
+@app.route('/api/recommend/stream', methods=['POST'])
+def stream_recommendation():
+    """流式生成饮食推荐 - 以SSE逐段推送模型输出，最后推送解析后的JSON（事件见RecommendationStream）"""
+    try:
+        params = read_single_recommend(request.json)
+    except ValueError as e:
+        return jsonify(bad_request(e)), 400
+    model = params['model']
+    g.metrics_model = model
+
+    print(f"\n{'='*60}")
+    print(f"收到流式推荐请求")
+    print(f"模型: {model}")
+    print(f"Prompt长度: {len(params['prompt'])} 字符")
+    print(f"{'='*60}")
+
+    cache_key = recommend_cache_key(params)
+    cached_content, freshness = recommendation_cache.lookup(cache_key)
+    if freshness == 'stale':
+        revalidate_in_background(params, cache_key)
+    deadline = g.deadline
+
+    def generate():
+        stream = RecommendationStream(params, cache_key)
+        if cached_content is not None:
+            yield from stream.cached(cached_content, freshness)
+            return
+
+        try:
+            with admission.slot():
+                with anthropic_client.messages.stream(model=model, **message_kwargs(params, deadline)) as upstream:
+                    for text in upstream.text_stream:
+                        event = stream.delta(text)
+                        if event:
+                            yield event
+                    usage = upstream.get_final_message().usage
+        except Exception as e:
+            yield stream.error(e)
+            return
+
+        content = stream.finish(usage)
+        if not content:
+            yield stream.empty()
+            return
+        recommendation_cache.set(cache_key, content, prompt_version=params['prompt_version'])
+        yield stream.done(content)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # 禁止反向代理缓冲，保证增量及时送达
+        }
+    )
+
+
+def translate_chunk(texts, target_language, deadline=None):
+    """翻译一块文本，返回{原文: 译文}"""
+    kwargs = translate_kwargs(texts, target_language)
+    with admission.slot():
+        start_time = time.time()
+        response = anthropic_client.messages.create(deadline=deadline, **kwargs)
+    return read_translation(texts, response, time.time() - start_time)
+
+
+def fetch_translation(recommendation, target_language, deadline=None):
+    """翻译推荐结果：缓存 -> 合并并发请求 -> 分块并发翻译文本叶子
+
+    返回(result, source)，result为{'recommendation', 'translated', 'total'}，
+    source为'cache'、'shared'或'upstream'；全部文本块都失败时抛出第一个异常
+    """
+    cache_key = make_translation_key(recommendation, target_language)
+    cached_result = translation_cache.get(cache_key)
+    if cached_result is not None:
+        print(f"✓ 命中翻译缓存 ({cache_key[:12]})")
+        return cached_result, 'cache'
+
+    def translate_all():
+        # 在合并锁内执行：等锁期间共享后端中的其他进程可能已经写入了翻译结果
+        if translation_cache.is_fresh(cache_key):
+            return translation_cache.get(cache_key)
+        texts = collect_texts(recommendation)
+        chunks = chunk_texts(texts)
+        outcomes = []
+        if chunks:
+            workers = min(TRANSLATE_MAX_CONCURRENCY, len(chunks))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='translate') as executor:
+                futures = [executor.submit(translate_chunk, chunk, target_language, deadline)
+                           for chunk in chunks]
+                outcomes = [future.exception() or future.result() for future in futures]
+
+        result, complete = translation_result(recommendation, texts, chunks, outcomes)
+        # 部分失败的结果不缓存，下次请求重新翻译
+        if complete:
+            translation_cache.set(cache_key, result, prompt_version=TRANSLATE_PROMPT_VERSION)
+        return result
+
+    result, shared = translation_flight.do(cache_key, translate_all, deadline)
+    return result, 'shared' if shared else 'upstream'
+
+
+@app.route('/api/translate', methods=['POST'])
+def translate_recommendation():
+    """翻译推荐结果 - 只翻译文本内容，JSON结构保持不变"""
+    try:
+        recommendation, target_language = read_translate_request(request.json or {})
+    except ValueError as e:
+        return jsonify(bad_request(e)), 400
+    g.metrics_model = TRANSLATE_MODEL
+
+    try:
+        result, source = fetch_translation(recommendation, target_language, g.deadline)
+    except Exception as e:
+        payload, status, headers = error_response(e, '翻译推荐')
+        return jsonify(payload), status, headers
+
+    return jsonify(translate_response(result, source))
+
+
+def run_recommendation_job(params):
+    """任务工作线程执行的推荐生成，返回与/api/recommend相同的响应内容"""
+    return job_result(fetch_recommendation(params))
+
+
+# 推荐任务队列：提交后立即返回任务id，由工作线程执行（首次提交任务时启动）
+job_store = create_job_store(shared_backend)
+job_workers = JobWorkerPool(job_store, run_recommendation_job)
+
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """提交推荐任务，立即返回任务id（202），参数同/api/recommend"""
+    try:
+        params = read_single_recommend(request.json)
+    except ValueError as e:
+        return jsonify(bad_request(e)), 400
+    g.metrics_model = params['model']
+
+    if job_store.pending() >= JOB_MAX_PENDING:
+        payload, status, headers = error_response(Overloaded('job_queue_full', 5), '提交任务')
+        return jsonify(payload), status, headers
+
+    job_workers.start()
+    job = job_store.create(params)
+    print(f"[JOBS] 新任务 {job['id'][:12]} (模型: {params['model']})")
+    return jsonify(job_submitted_response(job)), 202
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查询任务状态，完成时返回结果"""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_response(job))
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """以SSE推送任务状态
+
+    事件类型:
+      status - 任务状态变化（内容同GET /api/jobs/<id>）
+      done   - 任务完成或失败（内容同GET /api/jobs/<id>），之后连接关闭
+      error  - {'error': 错误信息}
+    """
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    def generate():
+        current = job
+        yield sse_event('status', job_response(current))
+        while current['status'] not in FINISHED:
+            last_status = current['status']
+            current = job_store.wait(job_id, JOB_EVENTS_KEEPALIVE)
+            if current is None:
+                yield sse_event('error', {'error': 'Job not found'})
+                return
+            if current['status'] != last_status and current['status'] not in FINISHED:
+                yield sse_event('status', job_response(current))
+            elif current['status'] not in FINISHED:
+                yield ': keepalive\n\n'
+        yield sse_event('done', job_response(current))
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
 
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """健康检查"""
-    return jsonify({
-        'status': 'ok',
-        'service': '饮食推荐API服务器',
-        'sdk': 'Anthropic',
-        'plan': 'GLM Coding Plan (套餐内)',
-        'models': ['glm-4-flash', 'glm-4.6', 'glm-4.7']
-    })
+    return jsonify(health_report('饮食推荐API服务器', recommendation_cache, translation_cache,
+                                 recommendation_flight, admission, key_pool, prewarm_scheduler,
+                                 job_workers))
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus文本格式的运行指标"""
+    return Response(metrics_report(recommendation_cache, admission, key_pool),
+                    mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/api/models', methods=['GET'])
 def list_models():
     """列出可用模型"""
-    return jsonify({
-        'models': [
-            {'id': 'glm-4-flash', 'name': 'GLM-4 Flash', 'description': '快速模型'},
-            {'id': 'glm-4.6', 'name': 'GLM-4.6', 'description': '标准模型'},
-            {'id': 'glm-4.7', 'name': 'GLM-4.7', 'description': '高质量模型'}
-        ]
-    })
+    return jsonify({'models': MODELS})
 
 
 if __name__ == '__main__':
     PORT = 5000
-    print(f"\n服务器启动在 http://localhost:{PORT}")
-    print(f"健康检查: http://localhost:{PORT}/api/health")
-    print(f"API端点: http://localhost:{PORT}/api/recommend")
-    print(f"{'='*60}\n")
+    print_endpoints(PORT)
+
+    # debug模式下reloader的父进程只负责监视文件变化，预热和任务工作线程只在实际提供服务的子进程中启动
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        if PREWARM_ENABLED:
+            prewarm_scheduler.start()
+        # 使用共享任务存储时，没有收到提交的节点也要领取其他节点提交的任务
+        job_workers.start()
 
     app.run(
         host='localhost',
@@ -0,0 +1,571 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+饮食推荐API服务器 - 异步(ASGI)版本
+使用Quart + AsyncAnthropic，等待GLM返回期间不占用线程，单进程可承载数千个并发请求
+接口与api_server.py保持一致: /api/recommend, /api/recommend/stream, /api/translate, /api/health, /api/models, /metrics
+
+与Web框架无关的业务逻辑在recommend_service.py中（与api_server.py共用），
+本文件只包含Quart路由和以asyncio执行的上游调用、请求合并和缓存读写
+
+启动方式:
+  python api_server_async.py
+  或 hypercorn api_server_async:app --bind localhost:5000
+"""
+
+import os
+import sys
+import time
+import asyncio
+
+import httpx
+from quart import Quart, Response, g, request, jsonify, make_response
+from quart.wrappers.response import DataBody
+from quart_cors import cors
+from anthropic import AsyncAnthropic, DefaultAsyncHttpxClient
+
+from api_common import (
+    BASE_URL, MODELS, batch_item, create_recommendation_cache, create_translation_cache,
+    read_batch_request, read_recommend_params, recommendation_response, shared_backend, sse_event,
+    upstream_admission_options
+)
+from admission import AsyncAdmissionController, Overloaded
+from compression import compress_body, is_compressible
+from key_pool import AsyncPooledClient, KeyPool, load_api_keys
+from jobs import (
+    FINISHED, JOB_EVENTS_KEEPALIVE, JOB_MAX_PENDING, JOB_POLL_INTERVAL, JobWorkerPool,
+    create_job_store, job_response, job_submitted_response
+)
+from prewarm import PREWARM_ENABLED, PrewarmScheduler, create_budget
+from recommend_service import (
+    RecommendationStream, bad_request, batch_item_error, cached_result, degraded_result, empty_response,
+    error_response, finish_batch, health_report, hedge_policy, job_result, message_kwargs,
+    metrics, metrics_report, missing_prompt_item, print_banner, print_endpoints, read_response,
+    read_single_recommend, read_translation, recommend_cache_key, result_cache_key, retry_policy,
+    translation_result, upstream_result
+)
+from retry_policy import Deadline
+from shared_backend import AsyncCache, call_blocking
+from single_flight import AsyncSingleFlight
+from translation import (
+    TRANSLATE_MAX_CONCURRENCY, TRANSLATE_MODEL, TRANSLATE_PROMPT_VERSION, chunk_texts, collect_texts,
+    make_translation_key, read_translate_request, translate_kwargs, translate_response
+)
+
+# 设置Windows控制台编码
+if sys.platform == 'win32':
+    try:
+        import codecs
+        sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
+        sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
+    except:
+        pass
+
+app = Quart(__name__)
+app = cors(app, allow_origin='*')  # 允许跨域请求
+
+API_KEYS = load_api_keys()
+if not API_KEYS:
+    print("ERROR: ZHIPU_API_KEY environment variable not set")
+    sys.exit(1)
+
+# 上游连接池配置：保持长连接，避免每次请求重新握手TLS
+UPSTREAM_MAX_CONNECTIONS = int(os.environ.get('UPSTREAM_MAX_CONNECTIONS', 200))
+UPSTREAM_MAX_KEEPALIVE = int(os.environ.get('UPSTREAM_MAX_KEEPALIVE', 50))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.environ.get('UPSTREAM_KEEPALIVE_EXPIRY', 60))
+UPSTREAM_TIMEOUT = float(os.environ.get('UPSTREAM_TIMEOUT', 120))
+
+
+def create_anthropic_client(**options):
+    """单个API Key的异步Anthropic客户端（各自的连接池）"""
+    return AsyncAnthropic(
+        base_url=BASE_URL,
+        http_client=DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+                keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(UPSTREAM_TIMEOUT, connect=10.0)
+        ),
+        **options
+    )
+
+
+# 初始化异步Anthropic客户端（全局复用连接池），配置多个API Key时每次调用选择负载最低的Key
+key_pool = KeyPool(API_KEYS, create_anthropic_client)
+anthropic_client = AsyncPooledClient(key_pool, retry_policy)
+
+# 推荐结果缓存（相同参数的请求直接返回，避免重复调用GLM）
+# 读写为协程：配置共享后端时在线程池中访问，不阻塞事件循环
+recommendation_cache = AsyncCache(create_recommendation_cache())
+
+# 合并相同参数的并发请求，同一时刻只向GLM发起一次调用（配置共享后端时跨进程合并）
+recommendation_flight = AsyncSingleFlight(lock_backend=shared_backend)
+
+# 翻译结果缓存（按推荐内容哈希 + 目标语言），切换语言时直接返回
+translation_cache = AsyncCache(create_translation_cache())
+translation_flight = AsyncSingleFlight(lock_backend=shared_backend)
+
+# 准入控制：限制并发上游调用数和调用速率，排队过长时快速拒绝
+# （上限按API Key数放大；配置共享后端时速率为所有进程合计）
+admission = AsyncAdmissionController(**upstream_admission_options(len(key_pool)))
+
+# 预热使用独立的调用预算，不占用在线请求的名额
+prewarm_admission = create_budget(AsyncAdmissionController)
+
+print_banner("饮食推荐API服务器启动 (异步模式)", key_pool, 'AsyncAnthropic', recommendation_cache,
+             f"上游连接池: 最大连接 {UPSTREAM_MAX_CONNECTIONS}, 长连接 {UPSTREAM_MAX_KEEPALIVE}")
+
+
+async def generate_recommendation_content(params, cache_key, controller=admission, deadline=None):
+    """调用GLM（可选对冲）生成推荐内容并写入缓存，返回(content, 实际使用的模型)
+
+    controller为上游调用的准入控制器，预热时使用独立的预算；deadline为请求的截止时间
+    """
+    # 在合并锁内执行：等锁期间共享后端中的其他进程可能已经写入了新鲜结果
+    if await recommendation_cache.is_fresh(cache_key):
+        return await recommendation_cache.get(cache_key), params['model']
+
+    model = params['model']
+    kwargs = message_kwargs(params, deadline)
+    async with controller.slot():
+        if params['hedge'] and hedge_policy.applies_to(model):
+            content, used_model = await hedge_policy.acall(anthropic_client, model, admission=controller,
+                                                             **kwargs)
+        else:
+            start_time = time.time()
+            response = await anthropic_client.messages.create(model=model, **kwargs)
+            content = read_response(model, response, time.time() - start_time, params['max_tokens'])
+            used_model = model
+
+    if content:
+        await recommendation_cache.set(result_cache_key(params, cache_key, used_model), content,
+                                       prompt_version=params['prompt_version'])
+    return content, used_model
+
+
+def revalidate_in_background(params, cache_key):
+    """返回过期缓存的同时在后台重新生成，同一key同时只有一个刷新任务"""
+    async def refresh():
+        if await recommendation_cache.is_fresh(cache_key):
+            return None, params['model']
+        return await generate_recommendation_content(params, cache_key)
+
+    if recommendation_flight.do_background(cache_key, refresh):
+        print(f"[SWR] 返回过期缓存并在后台刷新 ({cache_key[:12]})")
+
+
+async def fetch_recommendation(params, deadline=None):
+    """按参数获取推荐内容：缓存 -> 合并并发请求 -> 调用GLM（可选对冲）
+
+    返回值与api_server.fetch_recommendation相同
+    """
+    cache_key = recommend_cache_key(params)
+    cached_content, freshness = await recommendation_cache.lookup(cache_key)
+    result = cached_result(params, cache_key, cached_content, freshness)
+    if result is not None:
+        if freshness == 'stale':
+            revalidate_in_background(params, cache_key)
+        return result
+
+    try:
+        (content, used_model), shared = await recommendation_flight.do(
+            cache_key, lambda: generate_recommendation_content(params, cache_key, deadline=deadline),
+            deadline)
+    except Overloaded:
+        # 繁忙时优先返回已过期但仍保留的缓存结果（降级），没有则由调用方返回503
+        result = degraded_result(params, cache_key,
+                                 await recommendation_cache.get(cache_key, allow_expired=True))
+        if result is None:
+            raise
+        return result
+
+    return upstream_result(cache_key, content, used_model, shared)
+
+
+async def prewarm_recommendation(data):
+    """预热单个请求：缓存中没有新鲜结果时按预热预算生成，返回是否调用了上游"""
+    params = read_recommend_params(data)
+    cache_key = recommend_cache_key(params)
+    if await recommendation_cache.is_fresh(cache_key):
+        return False
+    await recommendation_flight.do(
+        cache_key, lambda: generate_recommendation_content(params, cache_key, prewarm_admission))
+    return True
+
+
+# 服务的事件循环，预热调度线程和任务工作线程通过它执行协程
+serving_loop = None
+
+
+def run_in_serving_loop(coro):
+    """在后台线程中把协程提交到服务的事件循环执行，并等待结果"""
+    return asyncio.run_coroutine_threadsafe(coro, serving_loop).result()
+
+
+# 用餐高峰前预先生成推荐（PREWARM_ENABLED=1时启用）
+prewarm_scheduler = PrewarmScheduler(
+    lambda data: run_in_serving_loop(prewarm_recommendation(data)), admission)
+
+
+@app.before_serving
+async def load_cache_stores():
+    # 持久化存储在第一次访问缓存时打开，启动时先在线程池中预加载，不在事件循环中读取数据库
+    await recommendation_cache.load_store()
+    await translation_cache.load_store()
+
+
+@app.before_serving
+async def start_prewarm():
+    global serving_loop
+    serving_loop = asyncio.get_running_loop()
+    if PREWARM_ENABLED:
+        prewarm_scheduler.start()
+
+
+@app.before_request
+async def start_request_metrics():
+    g.metrics_start = time.time()
+    g.metrics_endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.in_flight.inc(g.metrics_endpoint)
+    # 客户端可以用X-Request-Timeout请求头指定截止时间，重试不会超过它
+    g.deadline = Deadline.from_headers(request.headers)
+
+
+@app.after_request
+async def record_request_metrics(response):
+    # 流式接口在此只统计到开始推送为止，完整耗时见上游调用耗时
+    if 'metrics_endpoint' in g:
+        metrics.observe_request(g.metrics_endpoint, g.get('metrics_model'), response.status_code,
+                                time.time() - g.metrics_start)
+    return response
+
+
+@app.after_request
+async def compress_response(response):
+    # 超过COMPRESS_MIN_SIZE的JSON等文本响应按Accept-Encoding即时压缩；SSE等流式响应不处理
+    if not isinstance(response.response, DataBody) or 'Content-Encoding' in response.headers:
+        return response
+    if not is_compressible(response.content_type):
+        return response
+    response.vary.add('Accept-Encoding')
+    body, encoding = compress_body(await response.get_data(), response.content_type,
+                                   request.headers.get('Accept-Encoding'))
+    if encoding is not None:
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+@app.teardown_request
+async def finish_request_metrics(error=None):
+    # 流式响应结束时请求上下文会再次弹出，只减一次
+    endpoint = g.pop('metrics_endpoint', None)
+    if endpoint is not None:
+        metrics.in_flight.dec(endpoint)
+
+
+@app.route('/api/recommend', methods=['POST'])
+async def generate_recommendation():
+    """生成饮食推荐 - 使用AsyncAnthropic在套餐内调用"""
+    try:
+        params = read_single_recommend(await request.get_json())
+    except ValueError as e:
+        return jsonify(bad_request(e)), 400
+    g.metrics_model = params['model']
+
+    print(f"[ASYNC] 收到推荐请求 模型: {params['model']}, Prompt长度: {len(params['prompt'])} 字符")
+
+    try:
+        result = await fetch_recommendation(params, g.deadline)
+    except Exception as e:
+        payload, status, headers = error_response(e, '生成推荐')
+        return jsonify(payload), status, headers
+
+    if not result['content']:
+        return jsonify(empty_response()), 500
+    print(f"✓ 推荐生成成功 ({result['model']}, {result['source']})，返回内容长度: {len(result['content'])} 字符")
+    return jsonify(recommendation_response(result))
+
+
+async def recommend_batch_item(index, params, deadline=None):
+    """批量推荐中的单个条目，出错时返回错误结果而不抛出异常"""
+    if not params['prompt']:
+        return missing_prompt_item(index)
+    try:
+        return batch_item(index, await fetch_recommendation(params, deadline))
+    except Exception as e:
+        return batch_item_error(index, e)
+
+
+@app.route('/api/recommend/batch', methods=['POST'])
+async def batch_recommendation():
+    """批量生成饮食推荐 - 多组参数并发执行（受并发上限约束），逐条返回结果或错误"""
+    try:
+        params_list, concurrency, timeout = read_batch_request(await request.get_json() or {})
+    except (ValueError, TypeError) as e:
+        return jsonify(bad_request(e)), 400
+
+    print(f"[BATCH] 收到批量推荐请求: {len(params_list)}条, 并发 {concurrency}, 超时 {timeout:.0f}秒")
+    start_time = time.time()
+    semaphore = asyncio.Semaphore(concurrency)
+    # 整批超时和请求截止时间取较早者，条目内的重试也不会超过它
+    deadline = Deadline(min(timeout, g.deadline.remaining()))
+
+    async def run(index, params):
+        async with semaphore:
+            return await recommend_batch_item(index, params, deadline)
+
+    tasks = [asyncio.ensure_future(run(i, p)) for i, p in enumerate(params_list)]
+    done, pending = await asyncio.wait(tasks, timeout=deadline.timeout)
+    # 超时的条目直接取消；合并中的上游调用在独立Task中继续执行，截止时间内完成时写入缓存
+    for task in pending:
+        task.cancel()
+
+    items = [task.result() if task in done else None for task in tasks]
+    return jsonify(finish_batch(items, deadline, start_time))
+
+
+@app.route('/api/recommend/stream', methods=['POST'])
+async def stream_recommendation():
+    """流式生成饮食推荐 - 事件格式与api_server.py相同（见RecommendationStream）"""
+    try:
+        params = read_single_recommend(await request.get_json())
+    except ValueError as e:
+        return jsonify(bad_request(e)), 400
+    model = params['model']
+    g.metrics_model = model
+
+    print(f"[ASYNC] 收到流式推荐请求 模型: {model}, Prompt长度: {len(params['prompt'])} 字符")
+
+    cache_key = recommend_cache_key(params)
+    cached_content, freshness = await recommendation_cache.lookup(cache_key)
+    if freshness == 'stale':
+        revalidate_in_background(params, cache_key)
+    deadline = g.deadline
+
+    async def generate():
+        stream = RecommendationStream(params, cache_key)
+        if cached_content is not None:
+            for event in stream.cached(cached_content, freshness):
+                yield event
+            return
+
+        try:
+            async with admission.slot():
+                async with anthropic_client.messages.stream(
+                        model=model, **message_kwargs(params, deadline)) as upstream:
+                    async for text in upstream.text_stream:
+                        event = stream.delta(text)
+                        if event:
+                            yield event
+                    usage = (await upstream.get_final_message()).usage
+        except Exception as e:
+            yield stream.error(e)
+            return
+
+        content = stream.finish(usage)
+        if not content:
+            yield stream.empty()
+            return
+        await recommendation_cache.set(cache_key, content, prompt_version=params['prompt_version'])
+        yield stream.done(content)
+
+    response = await make_response(generate(), {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    response.timeout = None  # 流式响应不受默认响应超时限制
+    return response
+
+
+async def translate_chunk(texts, target_language, deadline=None):
+    """翻译一块文本，返回{原文: 译文}"""
+    kwargs = translate_kwargs(texts, target_language)
+    async with admission.slot():
+        start_time = time.time()
+        response = await anthropic_client.messages.create(deadline=deadline, **kwargs)
+    return read_translation(texts, response, time.time() - start_time)
+
+
+async def fetch_translation(recommendation, target_language, deadline=None):
+    """翻译推荐结果，返回值与api_server.fetch_translation相同"""
+    cache_key = make_translation_key(recommendation, target_language)
+    cached_result = await translation_cache.get(cache_key)
+    if cached_result is not None:
+        print(f"✓ 命中翻译缓存 ({cache_key[:12]})")
+        return cached_result, 'cache'
+
+    async def translate_all():
+        # 在合并锁内执行：等锁期间共享后端中的其他进程可能已经写入了翻译结果
+        if await translation_cache.is_fresh(cache_key):
+            return await translation_cache.get(cache_key)
+        texts = collect_texts(recommendation)
+        chunks = chunk_texts(texts)
+        semaphore = asyncio.Semaphore(TRANSLATE_MAX_CONCURRENCY)
+
+        async def run(chunk):
+            async with semaphore:
+                return await translate_chunk(chunk, target_language, deadline)
+
+        outcomes = await asyncio.gather(*(run(c) for c in chunks), return_exceptions=True)
+        result, complete = translation_result(recommendation, texts, chunks, outcomes)
+        # 部分失败的结果不缓存，下次请求重新翻译
+        if complete:
+            await translation_cache.set(cache_key, result, prompt_version=TRANSLATE_PROMPT_VERSION)
+        return result
+
+    result, shared = await translation_flight.do(cache_key, translate_all, deadline)
+    return result, 'shared' if shared else 'upstream'
+
+
+@app.route('/api/translate', methods=['POST'])
+async def translate_recommendation():
+    """翻译推荐结果 - 只翻译文本内容，JSON结构保持不变"""
+    try:
+        recommendation, target_language = read_translate_request(await request.get_json() or {})
+    except ValueError as e:
+        return jsonify(bad_request(e)), 400
+    g.metrics_model = TRANSLATE_MODEL
+
+    try:
+        result, source = await fetch_translation(recommendation, target_language, g.deadline)
+    except Exception as e:
+        payload, status, headers = error_response(e, '翻译推荐')
+        return jsonify(payload), status, headers
+
+    return jsonify(translate_response(result, source))
+
+
+async def run_recommendation_job(params):
+    """任务工作线程执行的推荐生成，返回与/api/recommend相同的响应内容"""
+    return job_result(await fetch_recommendation(params))
+
+
+# 推荐任务队列：提交后立即返回任务id，工作线程把任务提交到服务的事件循环执行
+# （SQLite和共享后端中的任务存储在线程池中读写，不阻塞事件循环）
+job_store = create_job_store(shared_backend)
+job_workers = JobWorkerPool(
+    job_store, lambda params: run_in_serving_loop(run_recommendation_job(params)))
+
+
+@app.before_serving
+async def start_job_workers():
+    job_workers.start()
+
+
+@app.route('/api/jobs', methods=['POST'])
+async def submit_job():
+    """提交推荐任务，立即返回任务id（202），参数同/api/recommend"""
+    try:
+        params = read_single_recommend(await request.get_json())
+    except ValueError as e:
+        return jsonify(bad_request(e)), 400
+    g.metrics_model = params['model']
+
+    if await call_blocking(job_store, job_store.pending) >= JOB_MAX_PENDING:
+        payload, status, headers = error_response(Overloaded('job_queue_full', 5), '提交任务')
+        return jsonify(payload), status, headers
+
+    job = await call_blocking(job_store, job_store.create, params)
+    print(f"[JOBS] 新任务 {job['id'][:12]} (模型: {params['model']})")
+    return jsonify(job_submitted_response(job)), 202
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+async def get_job(job_id):
+    """查询任务状态，完成时返回结果"""
+    job = await call_blocking(job_store, job_store.get, job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_response(job))
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+async def job_events(job_id):
+    """以SSE推送任务状态，事件类型同api_server.py（status、done、error）
+
+    事件循环中不阻塞等待，按JOB_POLL_INTERVAL轮询任务状态
+    """
+    job = await call_blocking(job_store, job_store.get, job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    async def generate():
+        current = job
+        yield sse_event('status', job_response(current))
+        last_event = time.time()
+        while current['status'] not in FINISHED:
+            last_status = current['status']
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+            current = await call_blocking(job_store, job_store.get, job_id)
+            if current is None:
+                yield sse_event('error', {'error': 'Job not found'})
+                return
+            if current['status'] != last_status and current['status'] not in FINISHED:
+                yield sse_event('status', job_response(current))
+                last_event = time.time()
+            elif time.time() - last_event >= JOB_EVENTS_KEEPALIVE:
+                yield ': keepalive\n\n'
+                last_event = time.time()
+        yield sse_event('done', job_response(current))
+
+    response = await make_response(generate(), {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    response.timeout = None
+    return response
+
+
+@app.route('/api/health', methods=['GET'])
+async def health_check():
+    """健康检查"""
+    # 任务统计会读取任务存储
+    report = await call_blocking(job_store, health_report, '饮食推荐API服务器 (异步)', recommendation_cache,
+                                 translation_cache, recommendation_flight, admission, key_pool,
+                                 prewarm_scheduler, job_workers)
+    return jsonify(report)
+
+
+@app.route('/metrics', methods=['GET'])
+async def prometheus_metrics():
+    """Prometheus文本格式的运行指标"""
+    return Response(metrics_report(recommendation_cache, admission, key_pool),
+                    mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/models', methods=['GET'])
+async def list_models():
+    """列出可用模型"""
+    return jsonify({'models': MODELS})
+
+
+@app.after_serving
+async def close_upstream():
+    # 调度线程和任务工作线程可能正在等待事件循环中的任务，在线程池中停止以免阻塞事件循环
+    await asyncio.get_running_loop().run_in_executor(None, prewarm_scheduler.stop)
+    await asyncio.get_running_loop().run_in_executor(None, job_workers.stop)
+    await anthropic_client.close()
+
+
+def main():
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    PORT = 5000
+    config = Config()
+    config.bind = [f"localhost:{PORT}"]
+    config.backlog = 2048            # 突发连接的等待队列
+    config.keep_alive_timeout = 75   # 与浏览器保持长连接
+
+    print_endpoints(PORT)
+
+    asyncio.run(serve(app, config))
+
+
+if __name__ == '__main__':
+    main()
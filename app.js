@@ -1058,8 +1058,14 @@ ${JSON.stringify(recommendation, null, 2)}
     setSolarTermBackground(solarTermName, container) {
         if (!container) return;
 
-        // 尝试使用本地图片
-        const imagePath = `images/festival_art/${solarTermName}.png`;
+        // 尝试使用本地图片；通过服务器访问时带上显示宽度，服务器返回合适宽度的WebP/AVIF版本
+        let imagePath = `images/festival_art/${solarTermName}.png`;
+        if (location.protocol.startsWith('http')) {
+            const width = Math.round(container.clientWidth * (window.devicePixelRatio || 1));
+            if (width > 0) {
+                imagePath += `?w=${width}`;
+            }
+        }
 
         // 创建Image对象预加载图片
         const img = new Image();
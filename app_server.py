@@ -5,14 +5,16 @@
 自动支持环境变量和手动输入API Key
 """
 
-import http.server
-import socketserver
 import webbrowser
 import os
 import sys
 import json
 from urllib.parse import urlparse
 
+from api_common import recommendation_fields
+from recommendation_dataset import RecommendationDataset
+from static_server import STATIC_WORKERS, StaticFileHandler, create_server
+
 # 设置Windows控制台编码
 if sys.platform == 'win32':
     try:
@@ -24,21 +26,14 @@ if sys.platform == 'win32':
 
 PORT = 8000
 DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+# POST请求体的大小上限（字节）
+API_MAX_BODY = int(os.environ.get('API_MAX_BODY', 64 * 1024))
 
-class UnifiedHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, directory=DIRECTORY, **kwargs)
-
-    def end_headers(self):
-        # Enable CORS
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        super().end_headers()
+# bulk_generate.py生成的离线推荐数据集，命中时无需调用GLM
+dataset = RecommendationDataset()
 
-    def do_OPTIONS(self):
-        self.send_response(200)
-        self.end_headers()
+class UnifiedHTTPRequestHandler(StaticFileHandler):
+    directory = DIRECTORY
 
     def do_GET(self):
         parsed_path = urlparse(self.path)
@@ -47,41 +42,82 @@ class UnifiedHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         if parsed_path.path == '/api/env-api-key':
             api_key = os.environ.get('ZHIPU_API_KEY', '')
             if api_key:
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json; charset=utf-8')
-                self.end_headers()
-                response = json.dumps({'apiKey': api_key}, ensure_ascii=False)
-                self.wfile.write(response.encode('utf-8'))
+                self.send_json(200, {'apiKey': api_key})
                 print(f"[API] 已提供API Key (长度: {len(api_key)})")
             else:
-                self.send_response(404)
-                self.send_header('Content-Type', 'application/json; charset=utf-8')
-                self.end_headers()
-                response = json.dumps({
+                self.send_json(404, {
                     'error': 'ZHIPU_API_KEY环境变量未设置',
                     'hint': '首次使用会在浏览器中提示输入API Key'
-                }, ensure_ascii=False)
-                self.wfile.write(response.encode('utf-8'))
+                })
                 print("[API] 环境变量未设置，将使用浏览器输入")
         # API endpoint to get prompt file content
         elif parsed_path.path == '/api/get-prompt':
+            # 经静态文件缓存发送：支持304和预压缩的.br/.gz
             prompt_path = os.path.join(DIRECTORY, 'prompts', 'food_recommendation_prompt.txt')
-            if os.path.exists(prompt_path):
-                with open(prompt_path, 'r', encoding='utf-8') as f:
-                    prompt_content = f.read()
-                self.send_response(200)
-                self.send_header('Content-Type', 'text/plain; charset=utf-8')
-                self.end_headers()
-                self.wfile.write(prompt_content.encode('utf-8'))
+            if self.send_file(prompt_path, 'text/plain; charset=utf-8'):
                 print("[API] 已提供prompt文件内容")
             else:
-                self.send_response(404)
-                self.end_headers()
-                self.wfile.write(b'Prompt file not found')
+                self.send_text(404, 'Prompt file not found')
         else:
             # Serve static files
             super().do_GET()
 
+    def content_length(self):
+        """请求体长度；Content-Length不是非负整数或超过API_MAX_BODY时返回None"""
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            return None
+        if not 0 <= length <= API_MAX_BODY:
+            return None
+        return length
+
+    def do_POST(self):
+        parsed_path = urlparse(self.path)
+
+        length = self.content_length()
+        if length is None:
+            # 请求体没有读取，连接上无法解析下一个请求
+            self.close_connection = True
+            self.send_json(400, {'success': False, 'error': 'Invalid Content-Length'})
+            return
+        # 先读掉请求体，长连接上的下一个请求才能正确解析
+        body = self.rfile.read(length)
+
+        # 从离线数据集返回推荐（请求格式同API服务器的/api/recommend结构化参数）
+        if parsed_path.path == '/api/recommend':
+            try:
+                data = json.loads(body or b'{}')
+            except ValueError:
+                self.send_json(400, {'success': False, 'error': 'Invalid JSON'})
+                return
+            if not isinstance(data, dict):
+                self.send_json(400, {'success': False, 'error': 'Request body must be a JSON object'})
+                return
+
+            try:
+                record = dataset.lookup(data)
+            except ValueError as e:
+                # 参数类型不合法（如location不是字符串）
+                self.send_json(400, {'success': False, 'error': str(e)})
+                return
+            if record is None:
+                # 未命中时由前端改为请求API服务器
+                self.send_json(404, {'success': False, 'error': 'Not in dataset'})
+                return
+            self.send_json(200, {
+                'success': True,
+                'content': record['content'],
+                **recommendation_fields(record['content']),
+                'model': record['model'],
+                'cached': True,
+                'source': 'dataset'
+            })
+            print(f"[API] 数据集命中: {record['fields']['solarTerm']} {record['fields']['location']} "
+                  f"{record['fields']['mealPeriod']} {record['fields']['dietType']}")
+        else:
+            self.send_json(404, {'error': 'Not found'})
+
     def log_message(self, format, *args):
         # 简化日志输出
         if args[0] not in ['GET /', 'GET /style.css', 'GET /app.js', 'GET /favicon.ico']:
@@ -118,15 +154,14 @@ def main():
     print("=" * 60)
     print(f"  服务器地址: http://localhost:{PORT}")
     print(f"  工作目录: {DIRECTORY}")
+    print(f"  工作线程: {STATIC_WORKERS}")
     print("=" * 60)
     print()
     print("按 Ctrl+C 停止服务器")
     print()
 
-    # Allow port reuse
-    socketserver.TCPServer.allow_reuse_address = True
-
-    with socketserver.TCPServer(("", PORT), UnifiedHTTPRequestHandler) as httpd:
+    # 线程池并发处理连接（HTTPServer默认允许端口复用）
+    with create_server(("", PORT), UnifiedHTTPRequestHandler) as httpd:
         # Auto-open browser
         try:
             webbrowser.open(f'http://localhost:{PORT}')
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+静态服务器吞吐量测试 - 对比原来的单连接TCPServer(HTTP/1.0)和线程池服务器(HTTP/1.1长连接)，
+以及大文件用sendfile发送和原来的Python读写循环(copyfile)
+服务器在子进程中运行，客户端线程循环请求页面资源，同时有若干慢速客户端缓慢下载大图，
+统计每秒请求数、吞吐量、延迟分位数和服务器进程的CPU时间
+
+用法:
+    python bench_static.py
+    python bench_static.py --clients 32 --duration 10 --slow-clients 4
+    python bench_static.py --modes copy,sendfile --paths /images/festival_art/惊蛰.png --slow-clients 0
+    python bench_static.py --modes idle10,pooled --idle-clients 64 --per-connection 4 --slow-clients 0
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+import http.client
+import http.server
+import multiprocessing
+from urllib.parse import quote
+
+from static_server import STATIC_KEEPALIVE_TIMEOUT, PooledHTTPServer, StaticFileHandler
+
+DEFAULT_PATHS = '/index.html,/app.js,/style.css,/i18n.js'
+DEFAULT_SLOW_PATH = '/images/festival_art/惊蛰.png'
+
+
+class QuietHandler(StaticFileHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class LegacyHandler(QuietHandler):
+    """原来的行为：HTTP/1.0，每个请求一个连接"""
+    protocol_version = 'HTTP/1.0'
+
+
+class IdleHandler(QuietHandler):
+    """空闲长连接保持STATIC_KEEPALIVE_TIMEOUT秒、不限请求数、有连接排队也不让出工作线程"""
+    keepalive_idle = STATIC_KEEPALIVE_TIMEOUT
+    keepalive_max_requests = float('inf')
+
+    def server_busy(self):
+        return False
+
+
+class CopyHandler(QuietHandler):
+    """大文件用SimpleHTTPRequestHandler原来的读写循环发送"""
+    use_sendfile = False
+
+
+def serve(mode, port, ready, done, cpu):
+    """运行服务器直到done被设置，把进程CPU时间（用户+系统）写入cpu"""
+    if mode == 'single':
+        server = http.server.HTTPServer(('127.0.0.1', port), LegacyHandler)
+    elif mode == 'idle10':
+        server = PooledHTTPServer(('127.0.0.1', port), IdleHandler)
+    elif mode == 'copy':
+        server = PooledHTTPServer(('127.0.0.1', port), CopyHandler)
+    else:
+        server = PooledHTTPServer(('127.0.0.1', port), QuietHandler)
+    # 测试结束时慢速客户端断开连接引起的BrokenPipe不输出
+    server.handle_error = lambda request, client_address: None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    ready.set()
+    done.wait()
+    cpu.value = time.process_time()
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def fast_client(port, paths, stop, results, per_connection=0):
+    """循环请求页面资源，复用连接（服务器关闭连接时自动重连）；
+    per_connection > 0时每个连接只发送这么多请求，模拟新用户打开页面"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    latencies = []
+    size = 0
+    errors = 0
+    i = 0
+    while not stop.is_set():
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            size += len(response.read())
+            latencies.append(time.perf_counter() - start)
+            if per_connection and i % per_connection == 0:
+                conn.close()
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+    conn.close()
+    results.append((latencies, size, errors))
+
+
+def slow_client(port, path, stop, chunk=16 * 1024, interval=0.05):
+    """模拟慢速移动网络：每interval秒读取chunk字节"""
+    while not stop.is_set():
+        try:
+            with socket.socket() as sock:
+                # 接收缓冲区很小，服务器的发送会被这个客户端的读取速度拖住
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+                sock.settimeout(30)
+                sock.connect(('127.0.0.1', port))
+                sock.sendall(f'GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n'.encode())
+                while not stop.is_set():
+                    if not sock.recv(chunk):
+                        break
+                    time.sleep(interval)
+        except OSError:
+            time.sleep(interval)
+
+
+def idle_client(port, path, stop):
+    """浏览器式的空闲长连接：请求一次后保持连接不发请求，服务器关闭后重新连接"""
+    while not stop.is_set():
+        try:
+            with socket.socket() as sock:
+                sock.settimeout(0.5)
+                sock.connect(('127.0.0.1', port))
+                sock.sendall(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+                while not stop.is_set():
+                    try:
+                        if not sock.recv(65536):
+                            break
+                    except socket.timeout:
+                        continue
+        except OSError:
+            time.sleep(0.05)
+
+
+def run(mode, args):
+    port = _free_port()
+    ready = multiprocessing.Event()
+    done = multiprocessing.Event()
+    cpu = multiprocessing.Value('d', 0.0)
+    server = multiprocessing.Process(target=serve, args=(mode, port, ready, done, cpu), daemon=True)
+    server.start()
+    ready.wait(10)
+    time.sleep(0.2)
+
+    paths = [quote(p) for p in args.paths.split(',') if p]
+    stop = threading.Event()
+    results = []
+    threads = [threading.Thread(target=slow_client, args=(port, quote(args.slow_path), stop), daemon=True)
+               for _ in range(args.slow_clients)]
+    threads += [threading.Thread(target=idle_client, args=(port, paths[0], stop), daemon=True)
+                for _ in range(args.idle_clients)]
+    for t in threads:
+        t.start()
+    time.sleep(0.2)  # 先让慢速客户端和空闲连接占住连接
+
+    clients = [threading.Thread(target=fast_client, args=(port, paths, stop, results, args.per_connection))
+               for _ in range(args.clients)]
+    start = time.perf_counter()
+    for t in clients:
+        t.start()
+    time.sleep(args.duration)
+    stop.set()
+    for t in clients:
+        t.join(35)
+    elapsed = time.perf_counter() - start
+    done.set()
+    server.join(10)
+    if server.is_alive():
+        server.terminate()
+
+    latencies = [l for r in results for l in r[0]]
+    size = sum(r[1] for r in results)
+    errors = sum(r[2] for r in results)
+    return {
+        'mode': mode,
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / elapsed,
+        'mbps': size / elapsed / 1024 / 1024,
+        'p50_ms': _percentile(latencies, 50) * 1000,
+        'p99_ms': _percentile(latencies, 99) * 1000,
+        'max_ms': max(latencies, default=0.0) * 1000,
+        # 包括启动和慢速客户端的开销，同一组参数下对比各模式
+        'cpu_s': cpu.value,
+        'cpu_ms_per_request': cpu.value * 1000 / len(latencies) if latencies else 0.0
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='静态服务器吞吐量测试')
+    parser.add_argument('--modes', default='single,pooled', help='single(原TCPServer) / pooled(线程池) / idle10(空闲长连接保持10秒) / '
+                             'copy(线程池+读写循环) / sendfile(线程池+sendfile，同pooled)')
+    parser.add_argument('--clients', type=int, default=16, help='并发客户端数')
+    parser.add_argument('--slow-clients', type=int, default=2, help='慢速下载大图的客户端数')
+    parser.add_argument('--idle-clients', type=int, default=0, help='请求一次后保持连接空闲的客户端数')
+    parser.add_argument('--per-connection', type=int, default=0, help='每个连接的请求数（0为一直复用）')
+    parser.add_argument('--duration', type=float, default=5, help='每种模式的测试秒数')
+    parser.add_argument('--paths', default=DEFAULT_PATHS, help='快速客户端请求的路径（逗号分隔）')
+    parser.add_argument('--slow-path', default=DEFAULT_SLOW_PATH)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.chdir(StaticFileHandler.directory)
+    print(f"客户端 {args.clients}, 慢速客户端 {args.slow_clients}, 空闲客户端 {args.idle_clients}, "
+          f"每种模式 {args.duration:g}秒")
+    print(f"{'模式':<10}{'请求数':>8}{'错误':>6}{'请求/秒':>10}{'MB/秒':>9}{'p50(ms)':>10}{'p99(ms)':>10}{'最大(ms)':>10}"
+          f"{'CPU(秒)':>9}{'CPU(ms)/请求':>13}")
+    for mode in args.modes.split(','):
+        r = run(mode, args)
+        print(f"{r['mode']:<10}{r['requests']:>8}{r['errors']:>6}{r['rps']:>10.1f}{r['mbps']:>9.1f}"
+              f"{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['max_ms']:>10.1f}{r['cpu_s']:>9.2f}{r['cpu_ms_per_request']:>13.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
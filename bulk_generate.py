@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+离线批量生成推荐数据集
+按节气分组枚举日期，与餐次、饮食类型、健康目标、城市、天气组合，用服务端提示词模板
+渲染prompt，限速的线程池调用GLM，结果写成分片JSON数据集和索引（格式见recommendation_dataset.py），
+静态服务器(app_server.py)可以直接用数据集回答大部分推荐请求
+
+每完成一条推荐就追加到进度文件，中断后重新运行相同的命令会跳过已完成的条目
+
+用法:
+    python bulk_generate.py --start 2026-01-01 --days 365 --dry-run
+    python bulk_generate.py --start 2026-01-01 --days 365 --cities 北京,上海,广州 --rpm 30
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from functools import partial
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+
+from admission import AdmissionController
+from api_common import BASE_URL, read_recommend_params, recommendation_fields
+from canonicalize import MEAL_PERIOD_TIMES
+from prewarm import DIET_TYPES
+from recommendation_dataset import (
+    CHECKPOINT_FILE, DATASET_DIR, DATASET_VERSION, INDEX_FILE, SHARDS_DIR, dataset_key,
+    group_fields, shard_name, write_json_atomic
+)
+from solar_terms import season_name, solar_term_description
+
+# 设置Windows控制台编码
+if sys.platform == 'win32':
+    try:
+        import codecs
+        sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
+        sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
+    except:
+        pass
+
+# 与index.html中的选项一致
+MEAL_PERIODS = ('早餐', '午餐', '晚餐')
+HEALTH_GOALS = ('健脾', '安神', '清火', '祛湿', '益气', '补血', '润肺', '疏肝', '生津', '滋阴',
+                '温阳', '固表', '美白')
+CITIES = ('北京', '上海', '广州', '深圳', '杭州', '成都', '重庆', '武汉', '西安', '南京', '苏州',
+          '天津', '长沙', '郑州', '济南', '青岛', '大连', '沈阳', '哈尔滨', '昆明', '厦门', '福州',
+          '南宁', '贵阳', '兰州', '太原', '南昌', '合肥', '乌鲁木齐', '拉萨', '海口', '三亚')
+
+
+def date_groups(start, days):
+    """按(节气描述, 季节)分组日期，返回OrderedDict: (节气, 季节) -> [日期, ...]
+
+    节气当天及前后两天的描述（如"明日立春"、"今日立春"）各自成组，其余日期按所处节气归组
+    """
+    groups = OrderedDict()
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        groups.setdefault((solar_term_description(day), season_name(day)), []).append(day)
+    return groups
+
+
+def plan_items(groups, meal_periods, diet_types, health_goals, cities, weathers, language):
+    """枚举所有组合，返回[(数据集键, 请求参数), ...]；规范化后相同的组合只保留一个"""
+    items = OrderedDict()
+    for (solar_term, season), days in groups.items():
+        for meal_period in meal_periods:
+            for diet_type in diet_types:
+                for goal in health_goals:
+                    for city in cities:
+                        for weather in weathers:
+                            fields = {
+                                # 每组用第一天渲染prompt
+                                'date': days[0].isoformat(),
+                                'time': MEAL_PERIOD_TIMES[meal_period],
+                                'mealPeriod': meal_period,
+                                'dietType': diet_type,
+                                'healthGoal': goal,
+                                'location': city,
+                                'weather': weather,
+                                'solarTerm': solar_term,
+                                'season': season,
+                                'language': language
+                            }
+                            items.setdefault(dataset_key(fields), fields)
+    return list(items.items())
+
+
+def load_checkpoint(path):
+    """读取进度文件，返回{数据集键: 记录}；最后一行写了一半时忽略"""
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[record['key']] = record
+    return records
+
+
+class BulkGenerator:
+    """限速线程池批量调用GLM，每条结果追加到进度文件"""
+
+    def __init__(self, client, output_dir, model, workers, rpm):
+        self.client = client
+        self.output_dir = output_dir
+        self.model = model
+        self.workers = workers
+        # 与在线服务相同的准入控制器，只用于限速和限制并发，排队不会超时
+        self.admission = AdmissionController(max_concurrent=workers, max_queue=1000000,
+                                             queue_timeout=24 * 3600, rpm=rpm, burst=1)
+        self.checkpoint_path = os.path.join(output_dir, CHECKPOINT_FILE)
+        self.generated = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def generate_one(self, key, fields):
+        params = read_recommend_params({**fields, 'model': self.model})
+        with self.admission.slot():
+            response = self.client.messages.create(
+                model=params['model'],
+                max_tokens=params['max_tokens'],
+                temperature=params['temperature'],
+                messages=[{"role": "user", "content": params['prompt']}]
+            )
+        content = response.content[0].text if response and response.content else ''
+        if recommendation_fields(content)['recommendation'] is None:
+            raise ValueError('无法解析推荐内容')
+
+        record = {
+            'key': key,
+            'fields': group_fields(fields),
+            'date': fields['date'],
+            'content': content,
+            'model': params['model'],
+            'prompt_version': params['prompt_version'],
+            'generated_at': datetime.now().isoformat(timespec='seconds')
+        }
+        with self._lock:
+            with open(self.checkpoint_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.generated += 1
+        return record
+
+    def run(self, items):
+        """生成items中的全部条目，返回本次成功生成的记录"""
+        records = []
+        total = len(items)
+        start_time = time.time()
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        futures = {executor.submit(self.generate_one, key, fields): fields for key, fields in items}
+        try:
+            for future in as_completed(futures):
+                fields = futures[future]
+                try:
+                    records.append(future.result())
+                except Exception as e:
+                    self.failed += 1
+                    print(f"✗ 生成失败 ({fields['date']} {fields['mealPeriod']} {fields['dietType']} "
+                          f"{fields['healthGoal']} {fields['location']}): {e}")
+                done = self.generated + self.failed
+                if done % 10 == 0 or done == total:
+                    elapsed = time.time() - start_time
+                    print(f"[BULK] {done}/{total} 完成 (失败 {self.failed}), "
+                          f"{done / elapsed * 60:.1f}条/分钟")
+        except KeyboardInterrupt:
+            print("\n[BULK] 已中断，已完成的条目保存在进度文件中，重新运行即可继续")
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown()
+        return records
+
+
+def write_dataset(output_dir, records, groups, options):
+    """把全部记录写成分片JSON和索引（覆盖旧的分片）"""
+    shards = {}
+    for key, record in records.items():
+        shards.setdefault(shard_name(key), {})[key] = record
+
+    shards_dir = os.path.join(output_dir, SHARDS_DIR)
+    os.makedirs(shards_dir, exist_ok=True)
+    for name, shard in shards.items():
+        write_json_atomic(os.path.join(shards_dir, f'{name}.json'), shard)
+
+    index = {
+        'version': DATASET_VERSION,
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'total': len(records),
+        'options': options,
+        'prompt_versions': sorted({r['prompt_version'] for r in records.values()}),
+        'models': sorted({r['model'] for r in records.values()}),
+        'shards': {name: len(shard) for name, shard in sorted(shards.items())},
+        # 节气分组 -> 覆盖的日期，静态服务器据此判断请求日期是否在数据集范围内
+        'solar_terms': [
+            {'solarTerm': solar_term, 'season': season,
+             'dates': [days[0].isoformat(), days[-1].isoformat()], 'days': len(days)}
+            for (solar_term, season), days in groups.items()
+        ]
+    }
+    # 索引最后写入，静态服务器检测到索引变化时分片已经就绪
+    write_json_atomic(os.path.join(output_dir, INDEX_FILE), index)
+    return index
+
+
+def _split(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='离线批量生成推荐数据集')
+    parser.add_argument('--start', default=f'{date.today().year}-01-01', help='起始日期 (YYYY-MM-DD)')
+    parser.add_argument('--days', type=int, default=365, help='枚举的天数')
+    parser.add_argument('--meal-periods', default=','.join(MEAL_PERIODS))
+    parser.add_argument('--diet-types', default=','.join(DIET_TYPES))
+    parser.add_argument('--health-goals', default=','.join(HEALTH_GOALS))
+    parser.add_argument('--cities', default=','.join(CITIES))
+    parser.add_argument('--weathers', default='晴')
+    parser.add_argument('--language', default='zh', help='zh 或 en')
+    parser.add_argument('--model', default='glm-4-flash')
+    parser.add_argument('--workers', type=int, default=4, help='并发调用数')
+    parser.add_argument('--rpm', type=float, default=30, help='每分钟最多调用次数')
+    parser.add_argument('--limit', type=int, default=0, help='本次最多生成的条数（0为不限）')
+    parser.add_argument('--output', default=DATASET_DIR, help='数据集目录')
+    parser.add_argument('--dry-run', action='store_true', help='只统计组合数，不调用API')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    groups = date_groups(date.fromisoformat(args.start), args.days)
+    options = {
+        'start': args.start,
+        'days': args.days,
+        'meal_periods': _split(args.meal_periods),
+        'diet_types': _split(args.diet_types),
+        'health_goals': _split(args.health_goals),
+        'cities': _split(args.cities),
+        'weathers': _split(args.weathers),
+        'language': args.language
+    }
+    items = plan_items(groups, options['meal_periods'], options['diet_types'],
+                       options['health_goals'], options['cities'], options['weathers'],
+                       args.language)
+
+    os.makedirs(args.output, exist_ok=True)
+    records = load_checkpoint(os.path.join(args.output, CHECKPOINT_FILE))
+    planned = {key for key, _ in items}
+    pending = [(key, fields) for key, fields in items if key not in records]
+    if args.limit:
+        pending = pending[:args.limit]
+
+    print("=" * 60)
+    print("离线批量生成推荐数据集")
+    print("=" * 60)
+    print(f"日期: {args.start} 起 {args.days} 天, 节气分组 {len(groups)} 个")
+    print(f"组合: {len(items)} 条, 已完成 {len(planned & records.keys())} 条, 本次生成 {len(pending)} 条")
+    print(f"模型: {args.model}, 并发 {args.workers}, 限速 {args.rpm:g}次/分钟")
+    print(f"输出目录: {args.output}")
+    print("=" * 60)
+    if args.dry_run:
+        if args.rpm:
+            print(f"[DRY RUN] 预计耗时约 {len(pending) / args.rpm / 60:.1f} 小时")
+        return 0
+
+    if pending:
+        from anthropic import Anthropic
+        from key_pool import KeyPool, PooledClient, load_api_keys
+        api_keys = load_api_keys()
+        if not api_keys:
+            print("ERROR: ZHIPU_API_KEY environment variable not set")
+            return 1
+        # 配置多个API Key时轮流使用负载最低的Key（--rpm仍为总速率）
+        client = PooledClient(KeyPool(api_keys, partial(Anthropic, base_url=BASE_URL)))
+
+        generator = BulkGenerator(client, args.output, args.model, args.workers, args.rpm)
+        try:
+            for record in generator.run(pending):
+                records[record['key']] = record
+        except KeyboardInterrupt:
+            return 130
+
+    # 只写入本次计划内的记录，调整参数后旧组合不会残留在数据集中
+    dataset = {key: records[key] for key, _ in items if key in records}
+    index = write_dataset(args.output, dataset, groups, options)
+    print(f"✓ 数据集已写入: {index['total']}/{len(items)} 条, {len(index['shards'])} 个分片")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
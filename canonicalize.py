@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推荐参数规范化 - 渲染prompt、计算缓存键和调用GLM之前统一结构化参数
+地点按本地行政区划表(gazetteer.json)归并到城市或省份，天气归并为前端的8类，
+时间按餐次归并为时段；相近的请求得到相同的prompt，可以共享缓存结果
+"""
+
+import os
+import re
+import json
+import hashlib
+import threading
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gazetteer.json')
+
+CANONICALIZE_ENABLED = os.environ.get('CANONICALIZE_ENABLED', '1') == '1'
+# 地点归并粒度：city（地级市）或 province（省级）
+REGION_GRANULARITY = os.environ.get('REGION_GRANULARITY', 'city')
+
+# 天气类别（与index.html的weatherSelect一致），按顺序匹配关键词
+WEATHER_CATEGORIES = [
+    ('沙尘', ('沙尘', '扬沙', '浮尘', '沙暴', 'dust', 'sand')),
+    ('雪', ('雪', 'snow', 'sleet')),
+    ('雨', ('雨', 'rain', 'drizzle', 'shower')),
+    ('大风', ('风', '雷', 'wind', 'storm', 'thunder', 'gale')),
+    ('雾', ('雾', '霾', 'fog', 'mist', 'haze')),
+    ('阴', ('阴', 'overcast')),
+    ('多云', ('云', 'cloud')),
+    ('晴', ('晴', 'sun', 'clear', 'fair')),
+]
+
+# 餐次对应的时段（与app.js的autoSetMealPeriod一致，22点到次日5点算作晚餐）
+MEAL_PERIOD_HOURS = [('早餐', 5, 10), ('午餐', 10, 16), ('晚餐', 16, 29)]
+MEAL_PERIOD_TIMES = {'早餐': '05:00-10:00', '午餐': '10:00-16:00', '晚餐': '16:00-22:00'}
+
+_ADMIN_SUFFIX = re.compile(r'(特别行政区|维吾尔自治区|壮族自治区|回族自治区|自治区|自治州|地区|省|市|区|县)$')
+_TIME_PATTERN = re.compile(r'^\s*(\d{1,2})(?::(\d{2}))?')
+
+# 规范化统计只记录最近的若干个不同键
+_MAX_TRACKED_KEYS = 10000
+
+# 需要按文本处理的结构化参数
+_TEXT_FIELDS = ('location', 'weather', 'time', 'mealPeriod')
+
+
+def _require_text(name, value):
+    """文本参数须为字符串，否则抛出ValueError（请求体中的数字、列表等返回400）"""
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f'{name} must be a string')
+
+
+def _short_name(name):
+    return _ADMIN_SUFFIX.sub('', name.strip()) or name.strip()
+
+
+def _longest_first(names):
+    # 优先匹配较长的名称，如"石家庄"不会被误判为其他短名称
+    return sorted(names, key=len, reverse=True)
+
+
+class Gazetteer:
+    """行政区划表：省 -> 地级市 -> 下辖区县及英文名"""
+
+    def __init__(self, path=GAZETTEER_PATH):
+        with open(path, 'r', encoding='utf-8') as f:
+            table = json.load(f)
+
+        self.provinces = {}
+        self.cities = {}
+        districts = {}
+        for province, cities in table.items():
+            self.provinces[province] = province
+            for city, aliases in cities.items():
+                self.cities[city] = (province, city)
+                for alias in aliases:
+                    districts.setdefault(alias.lower(), set()).add((province, city))
+
+        # 重名的区县（如多个城市都有"鼓楼"）以及与省、市同名的区县无法确定归属，不参与匹配
+        self.districts = {
+            alias: next(iter(owners)) for alias, owners in districts.items()
+            if len(owners) == 1 and alias not in self.cities and alias not in self.provinces
+        }
+        self._city_names = _longest_first(self.cities)
+        self._district_names = _longest_first(self.districts)
+        self._province_names = _longest_first(self.provinces)
+
+    def lookup(self, location):
+        """返回(省, 市)，只能确定省份时市为None，无法识别时返回None；location不是字符串时抛出ValueError"""
+        _require_text('location', location)
+        text = (location or '').strip()
+        province = next((p for p in self._province_names if text.startswith(p)), None)
+        rest = text[len(province):] if province else text
+        rest = re.sub(r'^(省|市|特别行政区|[^市]*自治区)', '', rest) if province else rest
+
+        short = _short_name(rest).lower() if rest else ''
+        if short in self.cities:
+            return self.cities[short]
+        if short in self.districts:
+            return self.districts[short]
+
+        lowered = rest.lower()
+        for names, index in ((self._city_names, self.cities), (self._district_names, self.districts)):
+            for name in names:
+                if name in lowered:
+                    return index[name]
+        if province:
+            return province, None
+        return None
+
+    def region(self, location, granularity=REGION_GRANULARITY):
+        """按粒度返回地点的规范名称，无法识别时返回None"""
+        found = self.lookup(location)
+        if found is None:
+            return None
+        province, city = found
+        if granularity == 'province' or city is None:
+            return province
+        return city
+
+
+def canonical_weather(weather):
+    """把天气描述归并为8类之一，无法识别时原样返回"""
+    _require_text('weather', weather)
+    text = (weather or '').strip()
+    lowered = text.lower()
+    for category, keywords in WEATHER_CATEGORIES:
+        if any(k in lowered for k in keywords):
+            return category
+    return text
+
+
+def meal_period_for(time_text):
+    """根据HH:MM时间返回餐次，无法解析时返回None"""
+    _require_text('time', time_text)
+    match = _TIME_PATTERN.match(time_text or '')
+    if not match:
+        return None
+    hour = int(match.group(1)) % 24
+    if hour < 5:
+        hour += 24
+    for period, start, end in MEAL_PERIOD_HOURS:
+        if start <= hour < end:
+            return period
+    return None
+
+
+class FieldCanonicalizer:
+    """规范化结构化参数，并统计规范化前后不同参数组合的数量（用于估算减少的上游调用）"""
+
+    def __init__(self, gazetteer=None, granularity=REGION_GRANULARITY, enabled=CANONICALIZE_ENABLED):
+        self.gazetteer = gazetteer or Gazetteer()
+        self.granularity = granularity
+        self.enabled = enabled
+        self.requests = 0
+        self.rewritten = 0
+        self.unknown_locations = 0
+        self._raw_keys = set()
+        self._canonical_keys = set()
+        self._lock = threading.Lock()
+
+    def canonicalize(self, fields):
+        """返回规范化后的参数副本（不修改传入的dict）；文本参数不是字符串时抛出ValueError"""
+        for name in _TEXT_FIELDS:
+            _require_text(name, fields.get(name))
+        if not self.enabled:
+            return fields
+
+        result = dict(fields)
+        unknown_location = False
+        if fields.get('location'):
+            region = self.gazetteer.region(fields['location'], self.granularity)
+            if region is None:
+                unknown_location = True
+            else:
+                result['location'] = region
+        if fields.get('weather'):
+            result['weather'] = canonical_weather(fields['weather'])
+
+        meal_period = fields.get('mealPeriod') or meal_period_for(fields.get('time'))
+        if meal_period in MEAL_PERIOD_TIMES:
+            result['mealPeriod'] = meal_period
+            result['time'] = MEAL_PERIOD_TIMES[meal_period]
+
+        self._record(fields, result, unknown_location)
+        return result
+
+    def _record(self, raw, canonical, unknown_location):
+        raw_key = _fields_hash(raw)
+        canonical_key = _fields_hash(canonical)
+        with self._lock:
+            self.requests += 1
+            if raw_key != canonical_key:
+                self.rewritten += 1
+            if unknown_location:
+                self.unknown_locations += 1
+            if len(self._raw_keys) >= _MAX_TRACKED_KEYS:
+                self._raw_keys.clear()
+                self._canonical_keys.clear()
+            self._raw_keys.add(raw_key)
+            self._canonical_keys.add(canonical_key)
+
+    def stats(self):
+        """distinct_raw/distinct_canonical为规范化前后不同参数组合数，
+        key_reduction为因规范化而可以省去的上游调用比例（缓存未过期时）"""
+        with self._lock:
+            raw = len(self._raw_keys)
+            canonical = len(self._canonical_keys)
+            return {
+                'enabled': self.enabled,
+                'granularity': self.granularity,
+                'requests': self.requests,
+                'rewritten': self.rewritten,
+                'unknown_locations': self.unknown_locations,
+                'distinct_raw': raw,
+                'distinct_canonical': canonical,
+                'key_reduction': round(1 - canonical / raw, 4) if raw else 0.0
+            }
+
+
+def _fields_hash(fields):
+    payload = json.dumps(fields, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+响应压缩 - 静态文本资源预压缩(.gz/.br)和接口JSON动态压缩
+构建步骤为静态文本资源生成同目录的.gz/.br文件，静态服务器按Accept-Encoding直接发送压缩版本；
+API服务器对超过COMPRESS_MIN_SIZE字节的JSON响应即时压缩。
+未安装brotli时只生成和协商gzip
+
+用法:
+    python compression.py              # 为页面、脚本、样式、prompt等文本资源生成.gz/.br
+    python compression.py --force      # 全部重新生成
+"""
+
+import os
+import sys
+import gzip
+import argparse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 小于该字节数的响应不压缩（压缩收益小于CPU开销和额外的响应头）
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+# 即时压缩的级别：兼顾速度；预压缩只做一次，使用最高级别
+COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5))
+
+# 生成预压缩文件的扩展名（图片本身已压缩，不处理）
+PRECOMPRESS_EXTENSIONS = ('.html', '.js', '.css', '.json', '.txt', '.svg')
+# 即时压缩的响应类型
+COMPRESSIBLE_TYPES = ('application/json', 'application/javascript', 'text/')
+
+# 预压缩文件扩展名，按优先顺序
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def supported_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def accepted_encodings(header):
+    """解析Accept-Encoding，返回(接受的编码集合, 明确拒绝(q=0)的编码集合)"""
+    accepted = set()
+    refused = set()
+    for part in (header or '').split(','):
+        name, _, params = part.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(name)
+        else:
+            refused.add(name)
+    return accepted, refused
+
+
+def choose_encoding(header, available=None):
+    """从available中选择客户端接受的编码：优先br，其次gzip；都不接受时返回None
+
+    *只对没有单独列出的编码生效，gzip;q=0, *不会选择gzip（RFC 9110）"""
+    accepted, refused = accepted_encodings(header)
+    if available is None:
+        available = supported_encodings()
+    for encoding in available:
+        if encoding in accepted or ('*' in accepted and encoding not in refused):
+            return encoding
+    return None
+
+
+def compress(data, encoding, precompress=False):
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if precompress else COMPRESS_BROTLI_QUALITY)
+    if encoding == 'gzip':
+        # mtime固定为0，内容相同时压缩结果（以及ETag）不变
+        return gzip.compress(data, compresslevel=9 if precompress else COMPRESS_GZIP_LEVEL, mtime=0)
+    raise ValueError(f'Unsupported encoding: {encoding}')
+
+
+def is_compressible(content_type):
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    return content_type.startswith(COMPRESSIBLE_TYPES) and content_type != 'text/event-stream'
+
+
+def compress_body(body, content_type, accept_encoding):
+    """即时压缩响应：返回(压缩后的内容, 编码)，不需要压缩时返回(body, None)"""
+    if len(body) < COMPRESS_MIN_SIZE or not is_compressible(content_type):
+        return body, None
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None:
+        return body, None
+    compressed = compress(body, encoding)
+    if len(compressed) >= len(body):
+        return body, None
+    return compressed, encoding
+
+
+def precompressed_path(path, encoding):
+    """返回path的预压缩文件路径；不存在或比原文件旧（原文件修改后未重新生成）时返回None"""
+    candidate = path + ENCODING_SUFFIXES[encoding]
+    try:
+        if os.stat(candidate).st_mtime_ns >= os.stat(path).st_mtime_ns:
+            return candidate
+    except OSError:
+        pass
+    return None
+
+
+def precompress_file(path, force=False):
+    """为一个文件生成.gz/.br，返回{编码: 压缩后字节数}；压缩后不变小的不生成"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    written = {}
+    if len(data) < COMPRESS_MIN_SIZE:
+        return written
+    for encoding in supported_encodings():
+        target = path + ENCODING_SUFFIXES[encoding]
+        if not force and precompressed_path(path, encoding):
+            written[encoding] = os.path.getsize(target)
+            continue
+        compressed = compress(data, encoding, precompress=True)
+        if len(compressed) >= len(data):
+            continue
+        with open(target, 'wb') as f:
+            f.write(compressed)
+        written[encoding] = len(compressed)
+    return written
+
+
+def iter_text_assets(root):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.') and d not in ('__pycache__', 'dataset', 'venv')]
+        for filename in sorted(filenames):
+            if filename.endswith(PRECOMPRESS_EXTENSIONS):
+                yield os.path.join(dirpath, filename)
+
+
+def precompress_directory(root, force=False):
+    """为root下的文本资源生成预压缩文件，返回(原始总字节数, {编码: 压缩后总字节数})"""
+    original = 0
+    totals = {encoding: 0 for encoding in supported_encodings()}
+    for path in iter_text_assets(root):
+        size = os.path.getsize(path)
+        written = precompress_file(path, force)
+        if not written:
+            continue
+        original += size
+        for encoding in totals:
+            totals[encoding] += written.get(encoding, size)
+        sizes = ', '.join(f'{encoding} {n / 1024:.1f}KB' for encoding, n in written.items())
+        print(f"  {os.path.relpath(path, root)}: {size / 1024:.1f}KB -> {sizes}")
+    return original, totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='为静态文本资源生成.gz/.br预压缩文件')
+    parser.add_argument('--root', default=os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument('--force', action='store_true', help='忽略已有的预压缩文件，全部重新生成')
+    args = parser.parse_args(argv)
+
+    if brotli is None:
+        print("⚠ 未安装brotli（pip install brotli），只生成.gz")
+    print(f"[COMPRESS] 预压缩 {args.root}")
+    original, totals = precompress_directory(args.root, args.force)
+    if not original:
+        print("没有需要压缩的文件")
+        return 0
+    for encoding, total in totals.items():
+        print(f"✓ {encoding}: {original / 1024:.1f}KB -> {total / 1024:.1f}KB "
+              f"(减少 {100 * (1 - total / original):.0f}%)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
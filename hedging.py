@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+对冲请求(hedged requests) - 优先调用高质量模型，超过按历史延迟分位数计算的等待时间
+仍未收到首字时，再向快速模型发起备用请求，先完成者胜出，另一个请求被取消；
+备用请求与主请求同时进行时需要额外的准入名额（admission.try_acquire），没有空闲名额时不对冲，
+上游的实际并发不会超过准入控制的上限
+同步版本用于Flask(多线程)，异步版本用于Quart(asyncio)
+"""
+
+import os
+import time
+import queue
+import asyncio
+import threading
+from collections import defaultdict, deque
+
+HEDGE_ENABLED = os.environ.get('HEDGE_ENABLED', '0') == '1'
+HEDGE_BACKUP_MODEL = os.environ.get('HEDGE_BACKUP_MODEL', 'glm-4-flash')
+HEDGE_PERCENTILE = float(os.environ.get('HEDGE_PERCENTILE', 90))
+HEDGE_DEFAULT_DELAY = float(os.environ.get('HEDGE_DEFAULT_DELAY', 15))
+HEDGE_MIN_DELAY = float(os.environ.get('HEDGE_MIN_DELAY', 2))
+HEDGE_MAX_DELAY = float(os.environ.get('HEDGE_MAX_DELAY', 30))
+
+# 样本数不足时不使用分位数，改用默认等待时间
+MIN_SAMPLES = 5
+
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class LatencyTracker:
+    """按模型记录最近的首字延迟(ttft)和总耗时(total)，单位秒"""
+
+    def __init__(self, window=200):
+        self._samples = defaultdict(lambda: {
+            'ttft': deque(maxlen=window),
+            'total': deque(maxlen=window)
+        })
+        self._lock = threading.Lock()
+
+    def record(self, model, ttft=None, total=None):
+        with self._lock:
+            samples = self._samples[model]
+            if ttft is not None:
+                samples['ttft'].append(ttft)
+            if total is not None:
+                samples['total'].append(total)
+
+    def percentile(self, model, kind, p):
+        """返回某模型某类延迟的p分位数，样本不足时返回None"""
+        with self._lock:
+            values = list(self._samples[model][kind]) if model in self._samples else []
+        if len(values) < MIN_SAMPLES:
+            return None
+        return _percentile(values, p)
+
+    def stats(self):
+        with self._lock:
+            snapshot = {model: {kind: list(v) for kind, v in s.items()}
+                        for model, s in self._samples.items()}
+
+        result = {}
+        for model, samples in snapshot.items():
+            entry = {'samples': len(samples['total'])}
+            for kind, values in samples.items():
+                if values:
+                    entry[f'{kind}_p50'] = round(_percentile(values, 50), 3)
+                    entry[f'{kind}_p90'] = round(_percentile(values, 90), 3)
+            result[model] = entry
+        return result
+
+
+class HedgePolicy:
+    """对冲策略：等待时间取主模型首字延迟的分位数，并限制在[min_delay, max_delay]内"""
+
+    def __init__(self, tracker, backup_model=HEDGE_BACKUP_MODEL, percentile=HEDGE_PERCENTILE,
+                 default_delay=HEDGE_DEFAULT_DELAY, min_delay=HEDGE_MIN_DELAY,
+                 max_delay=HEDGE_MAX_DELAY, on_upstream=None):
+        self.tracker = tracker
+        # 每次上游调用成功后回调 on_upstream(model, 耗时秒数, usage)，用于统计指标
+        self.on_upstream = on_upstream
+        self.backup_model = backup_model
+        self.percentile = percentile
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.hedged = 0
+        self.skipped = 0
+        self.primary_wins = 0
+        self.backup_wins = 0
+
+    def applies_to(self, model):
+        return model != self.backup_model
+
+    def delay_for(self, model):
+        delay = self.tracker.percentile(model, 'ttft', self.percentile)
+        if delay is None:
+            return self.default_delay
+        return min(self.max_delay, max(self.min_delay, delay))
+
+    def stats(self):
+        return {
+            'backup_model': self.backup_model,
+            'percentile': self.percentile,
+            'hedged': self.hedged,
+            'skipped': self.skipped,
+            'primary_wins': self.primary_wins,
+            'backup_wins': self.backup_wins
+        }
+
+    def _record_win(self, model, primary_model):
+        if model == primary_model:
+            self.primary_wins += 1
+        else:
+            self.backup_wins += 1
+
+    def _record_upstream(self, model, ttft, total, usage):
+        self.tracker.record(model, ttft=ttft, total=total)
+        if self.on_upstream is not None:
+            self.on_upstream(model, total, usage)
+
+    # ---------- 同步版本 ----------
+
+    def _stream_text(self, client, model, handle, on_first_token, kwargs):
+        """流式调用并拼接全文；handle['cancel']被设置后退出并关闭连接，返回None"""
+        start_time = time.time()
+        ttft = None
+        chunks = []
+        with client.messages.stream(model=model, **kwargs) as stream:
+            handle['stream'] = stream
+            for text in stream.text_stream:
+                if handle['cancel'].is_set():
+                    return None
+                if not text:
+                    continue
+                if ttft is None:
+                    ttft = time.time() - start_time
+                    on_first_token()
+                chunks.append(text)
+            usage = stream.get_final_message().usage
+        self._record_upstream(model, ttft, time.time() - start_time, usage)
+        return ''.join(chunks)
+
+    @staticmethod
+    def _cancel(handle):
+        handle['cancel'].set()
+        stream = handle.get('stream')
+        if stream is not None:
+            try:
+                # 关闭底层HTTP响应，让仍在等待数据的线程尽快退出
+                stream.close()
+            except Exception:
+                pass
+
+    def _skip(self, model, delay):
+        self.skipped += 1
+        print(f"[HEDGE] {model} {delay:.1f}秒内未返回首字，没有空闲的准入名额，不发起备用请求")
+
+    def call(self, client, model, admission=None, **kwargs):
+        """对冲调用，返回(content, 实际使用的模型)；全部失败时抛出主模型的异常
+
+        admission为主请求所在的准入控制器（调用方已持有一个名额），备用请求与主请求同时进行时
+        另占一个名额；主请求失败后改用备用模型时沿用调用方的名额
+        """
+        backup_model = self.backup_model
+        delay = self.delay_for(model)
+        results = queue.Queue()
+        primary_signal = threading.Event()  # 主模型收到首字或已结束
+        handles = {}
+
+        def start(m, on_first_token, release=None):
+            handle = handles[m] = {'cancel': threading.Event(), 'stream': None}
+
+            def run():
+                try:
+                    result = (m, self._stream_text(client, m, handle, on_first_token, kwargs), None)
+                except Exception as e:
+                    result = (m, None, e)
+                finally:
+                    # 先释放备用请求的名额再交出结果，调用方返回时名额已归还
+                    if release is not None:
+                        release()
+                    if m == model:
+                        primary_signal.set()
+                results.put(result)
+
+            threading.Thread(target=run, name=f'hedge-{m}', daemon=True).start()
+
+        start(model, primary_signal.set)
+        if not primary_signal.wait(delay):
+            if admission is None or admission.try_acquire():
+                self.hedged += 1
+                print(f"[HEDGE] {model} {delay:.1f}秒内未返回首字，向 {backup_model} 发起备用请求")
+                start(backup_model, lambda: None, admission.release if admission is not None else None)
+            else:
+                self._skip(model, delay)
+
+        errors = []
+        pending = len(handles)
+        while pending:
+            m, content, error = results.get()
+            pending -= 1
+            if content:
+                for other, handle in handles.items():
+                    if other != m:
+                        self._cancel(handle)
+                self._record_win(m, model)
+                return content, m
+
+            errors.append(error)
+            # 主模型在对冲前就失败时，立即改用备用模型
+            if m == model and backup_model not in handles:
+                print(f"[HEDGE] {model} 调用失败，改用 {backup_model}")
+                start(backup_model, lambda: None)
+                pending += 1
+
+        error = next((e for e in errors if e is not None), None)
+        if error is not None:
+            raise error
+        return None, model
+
+    # ---------- 异步版本 ----------
+
+    async def _astream_text(self, client, model, on_first_token, kwargs):
+        start_time = time.time()
+        ttft = None
+        chunks = []
+        async with client.messages.stream(model=model, **kwargs) as stream:
+            async for text in stream.text_stream:
+                if not text:
+                    continue
+                if ttft is None:
+                    ttft = time.time() - start_time
+                    on_first_token()
+                chunks.append(text)
+            usage = (await stream.get_final_message()).usage
+        self._record_upstream(model, ttft, time.time() - start_time, usage)
+        return ''.join(chunks)
+
+    async def acall(self, client, model, admission=None, **kwargs):
+        """对冲调用（asyncio），参数和返回值同call()；落败的请求通过取消Task关闭连接"""
+        backup_model = self.backup_model
+        delay = self.delay_for(model)
+        first_token = asyncio.Event()
+        tasks = {}
+
+        def start(m, on_first_token):
+            tasks[asyncio.ensure_future(self._astream_text(client, m, on_first_token, kwargs))] = m
+
+        start(model, first_token.set)
+        primary = next(iter(tasks))
+        waiter = asyncio.ensure_future(first_token.wait())
+        await asyncio.wait({primary, waiter}, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+
+        if not first_token.is_set() and not primary.done():
+            if admission is None or await admission.try_acquire():
+                self.hedged += 1
+                print(f"[HEDGE] {model} {delay:.1f}秒内未返回首字，向 {backup_model} 发起备用请求")
+                start(backup_model, lambda: None)
+                if admission is not None:
+                    # 备用请求结束（完成、失败或被取消）时释放名额
+                    next(t for t, m in tasks.items() if m == backup_model).add_done_callback(
+                        lambda _: admission.release())
+            else:
+                self._skip(model, delay)
+
+        errors = []
+        started_backup = len(tasks) > 1
+        try:
+            while tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    m = tasks.pop(task)
+                    error = task.exception()
+                    if error is None and task.result():
+                        self._record_win(m, model)
+                        return task.result(), m
+
+                    errors.append(error)
+                    if m == model and not started_backup:
+                        print(f"[HEDGE] {model} 调用失败，改用 {backup_model}")
+                        start(backup_model, lambda: None)
+                        started_backup = True
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        error = next((e for e in errors if e is not None), None)
+        if error is not None:
+            raise error
+        return None, model
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+响应式背景图 - 为images/festival_art（以及download_images.py下载的images/art）中的图片
+生成多种宽度的WebP/AVIF版本，并写入记录尺寸和字节数的清单；
+静态服务器按Accept和宽度提示（?w=或Client Hints）选择最合适的版本，
+手机上不再下载1920px以上的原图
+
+用法:
+    python image_variants.py                 # 生成缺少或已过期的版本（需要Pillow）
+    python image_variants.py --force         # 全部重新生成
+    python image_variants.py --widths 640,1280 --formats webp
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# 源图片目录（相对项目目录），不存在的跳过
+IMAGE_SOURCE_DIRS = [d for d in os.environ.get('IMAGE_SOURCE_DIRS', 'images/festival_art,images/art').split(',') if d]
+IMAGE_VARIANTS_DIR = os.environ.get('IMAGE_VARIANTS_DIR', 'images/variants')
+IMAGE_VARIANTS_MANIFEST = os.path.join(IMAGE_VARIANTS_DIR, 'manifest.json')
+IMAGE_VARIANT_WIDTHS = [int(w) for w in os.environ.get('IMAGE_VARIANT_WIDTHS', '480,768,1080,1440,1920').split(',') if w]
+# 按优先顺序：浏览器同时接受时选择排在前面的格式
+IMAGE_VARIANT_FORMATS = [f for f in os.environ.get('IMAGE_VARIANT_FORMATS', 'avif,webp').split(',') if f]
+IMAGE_WEBP_QUALITY = int(os.environ.get('IMAGE_WEBP_QUALITY', 80))
+IMAGE_AVIF_QUALITY = int(os.environ.get('IMAGE_AVIF_QUALITY', 55))
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 0)) or os.cpu_count() or 1
+
+SOURCE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+FORMAT_TYPES = {'avif': 'image/avif', 'webp': 'image/webp'}
+
+
+def find_sources(root=ROOT, source_dirs=None):
+    """返回源图片的相对路径（/分隔）"""
+    sources = []
+    for source_dir in source_dirs or IMAGE_SOURCE_DIRS:
+        directory = os.path.join(root, source_dir)
+        if not os.path.isdir(directory):
+            continue
+        for filename in sorted(os.listdir(directory)):
+            if filename.lower().endswith(SOURCE_EXTENSIONS):
+                sources.append(f"{source_dir.strip('/')}/{filename}")
+    return sources
+
+
+def variant_path(source, width, fmt):
+    """images/festival_art/惊蛰.png -> images/variants/festival_art/惊蛰-768.webp"""
+    directory, filename = os.path.split(source)
+    stem = os.path.splitext(filename)[0]
+    return f"{IMAGE_VARIANTS_DIR}/{os.path.basename(directory)}/{stem}-{width}.{fmt}"
+
+
+def encode_variant(root, source, width, fmt):
+    """在工作进程中生成一个版本，返回清单中的variant记录"""
+    from PIL import Image
+
+    target = variant_path(source, width, fmt)
+    os.makedirs(os.path.dirname(os.path.join(root, target)), exist_ok=True)
+    with Image.open(os.path.join(root, source)) as image:
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        height = round(image.height * width / image.width)
+        if width != image.width:
+            image = image.resize((width, height), Image.LANCZOS)
+        if fmt == 'webp':
+            image.save(os.path.join(root, target), 'WEBP', quality=IMAGE_WEBP_QUALITY, method=6)
+        else:
+            image.save(os.path.join(root, target), 'AVIF', quality=IMAGE_AVIF_QUALITY)
+    return {
+        'path': target,
+        'format': fmt,
+        'type': FORMAT_TYPES[fmt],
+        'width': width,
+        'height': height,
+        'bytes': os.path.getsize(os.path.join(root, target))
+    }
+
+
+def _available_formats(formats):
+    from PIL import Image
+
+    Image.init()
+    available = []
+    for fmt in formats:
+        if fmt.upper() in Image.SAVE:
+            available.append(fmt)
+        else:
+            print(f"⚠ 当前Pillow不支持保存{fmt}，跳过（升级Pillow: pip install -U pillow）")
+    return available
+
+
+def build_variants(root=ROOT, widths=None, formats=None, force=False, workers=IMAGE_WORKERS):
+    """生成所有源图片的版本并写入清单，返回清单"""
+    widths = sorted(set(widths or IMAGE_VARIANT_WIDTHS))
+    formats = _available_formats(formats or IMAGE_VARIANT_FORMATS)
+    manifest_path = os.path.join(root, IMAGE_VARIANTS_MANIFEST)
+    old = load_manifest(manifest_path).get('images', {})
+
+    from PIL import Image
+
+    images = {}
+    tasks = []
+    for source in find_sources(root):
+        stat = os.stat(os.path.join(root, source))
+        record = old.get(source)
+        if (not force and record and record['mtime_ns'] == stat.st_mtime_ns
+                and record.get('formats') == formats and record.get('widths') == widths
+                and all(os.path.exists(os.path.join(root, v['path'])) for v in record['variants'])):
+            images[source] = record
+            continue
+        with Image.open(os.path.join(root, source)) as image:
+            size = image.size
+        # 不放大：只生成比原图窄的宽度，再加一个原图宽度（不超过最大宽度）的版本
+        source_widths = [w for w in widths if w < size[0]] + [min(size[0], widths[-1])]
+        images[source] = {
+            'width': size[0],
+            'height': size[1],
+            'bytes': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'widths': widths,
+            'formats': formats,
+            'variants': []
+        }
+        tasks.extend((source, w, fmt) for w in sorted(set(source_widths)) for fmt in formats)
+
+    if tasks:
+        print(f"[IMAGES] 生成 {len(tasks)} 个版本，{workers} 个进程")
+        start = time.time()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(encode_variant, root, *task) for task in tasks]
+            for (source, width, fmt), future in zip(tasks, futures):
+                variant = future.result()
+                images[source]['variants'].append(variant)
+                print(f"  {variant['path']}: {variant['width']}x{variant['height']} {variant['bytes'] / 1024:.0f}KB")
+        print(f"✓ 完成，用时 {time.time() - start:.1f}秒")
+
+    manifest = {'version': 1, 'images': images}
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def load_manifest(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def accepted_image_types(header):
+    """Accept中明确列出的类型（q=0的不算）；只看image/avif、image/webp本身，
+    因为浏览器对不支持的格式也会发送image/*"""
+    accepted = set()
+    for part in (header or '').split(','):
+        media_type, *params = part.split(';')
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(media_type.strip().lower())
+    return accepted
+
+
+class ImageVariants:
+    """静态服务器使用的版本清单：清单文件更新后自动重新加载，源图片修改后（未重新生成）不使用旧版本"""
+
+    def __init__(self, root=ROOT, manifest=IMAGE_VARIANTS_MANIFEST):
+        self.root = root
+        self.manifest_path = os.path.join(root, manifest)
+        self.served = 0
+        self._mtime_ns = None
+        self._images = {}
+        self._lock = threading.Lock()
+
+    def _reload(self):
+        try:
+            mtime_ns = os.stat(self.manifest_path).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        with self._lock:
+            if mtime_ns == self._mtime_ns:
+                return self._images
+            images = load_manifest(self.manifest_path).get('images', {}) if mtime_ns else {}
+            self._images = {os.path.normpath(os.path.join(self.root, source)): record
+                            for source, record in images.items()}
+            self._mtime_ns = mtime_ns
+            return self._images
+
+    def covers(self, path):
+        """path是否有生成的版本（响应随Accept变化）"""
+        return os.path.normpath(path) in self._reload()
+
+    def select(self, path, accept, width=None):
+        """按Accept和宽度提示选择版本，返回版本文件的绝对路径；没有合适版本时返回None（使用原图）
+
+        选择浏览器支持的第一种格式中宽度不小于提示的最窄版本；没有宽度提示时使用该格式最宽的版本
+        """
+        record = self._reload().get(os.path.normpath(path))
+        if record is None:
+            return None
+        try:
+            if os.stat(path).st_mtime_ns != record['mtime_ns']:
+                return None
+        except OSError:
+            return None
+
+        accepted = accepted_image_types(accept)
+        for fmt in record['formats']:
+            if FORMAT_TYPES[fmt] not in accepted:
+                continue
+            variants = sorted((v for v in record['variants'] if v['format'] == fmt), key=lambda v: v['width'])
+            if not variants:
+                continue
+            chosen = variants[-1]
+            if width:
+                chosen = next((v for v in variants if v['width'] >= width), variants[-1])
+            self.served += 1
+            return os.path.join(self.root, chosen['path'])
+        return None
+
+    def stats(self):
+        images = self._reload()
+        return {
+            'images': len(images),
+            'variants': sum(len(record['variants']) for record in images.values()),
+            'served': self.served
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='生成响应式背景图版本（WebP/AVIF，多种宽度）')
+    parser.add_argument('--root', default=ROOT)
+    parser.add_argument('--widths', default=','.join(map(str, IMAGE_VARIANT_WIDTHS)), help='宽度列表（逗号分隔）')
+    parser.add_argument('--formats', default=','.join(IMAGE_VARIANT_FORMATS), help='avif,webp')
+    parser.add_argument('--workers', type=int, default=IMAGE_WORKERS, help='进程数')
+    parser.add_argument('--force', action='store_true', help='忽略清单，全部重新生成')
+    args = parser.parse_args(argv)
+
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        print("✗ 需要Pillow: pip install pillow")
+        return 1
+
+    manifest = build_variants(args.root, [int(w) for w in args.widths.split(',') if w],
+                              [f for f in args.formats.split(',') if f], args.force, args.workers)
+    images = manifest['images']
+    if not images:
+        print("没有找到源图片")
+        return 0
+    original = sum(record['bytes'] for record in images.values())
+    print(f"[IMAGES] {len(images)} 张原图共 {original / 1024 / 1024:.1f}MB，清单: {IMAGE_VARIANTS_MANIFEST}")
+    for width in sorted({v['width'] for record in images.values() for v in record['variants']}):
+        sizes = []
+        for fmt in args.formats.split(','):
+            # 每张图取不超过该宽度的最宽版本
+            total = 0
+            for record in images.values():
+                candidates = [v for v in record['variants'] if v['format'] == fmt and v['width'] <= width]
+                total += max(candidates, key=lambda v: v['width'])['bytes'] if candidates else record['bytes']
+            sizes.append(f"{fmt} {total / 1024:.0f}KB ({original / total:.0f}x)")
+        print(f"  {width}px: " + ', '.join(sizes))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -19,7 +19,7 @@ def main():
     print("安装后端依赖包")
     print("=" * 60)
 
-    packages = ['flask', 'flask-cors', 'anthropic']
+    packages = ['flask', 'flask-cors', 'anthropic', 'quart', 'quart-cors', 'hypercorn']
 
     for package in packages:
         print(f"\n正在安装 {package}...")
@@ -30,6 +30,8 @@ def main():
     print("=" * 60)
     print("\n现在可以启动后端服务:")
     print("  python api_server.py")
+    print("\n异步模式（高并发）:")
+    print("  python api_server_async.py")
     print("\n或使用启动脚本:")
     print("  start_with_backend.bat")
 
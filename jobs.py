@@ -0,0 +1,507 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推荐任务队列 - 长时间的生成以任务方式提交，客户端轮询或通过SSE等待结果
+避免120秒的同步请求在代理、移动网络下中断，断线重连也不会重复消耗token
+
+任务存储可替换：默认进程内存储；设置JOB_STORE_PATH时使用SQLite文件，
+同一主机上的多个api_server进程共用同一文件即可共享任务队列；
+配置了共享后端（SHARED_BACKEND_URL，见shared_backend）时使用SharedJobStore，
+多台主机上的节点共享任务队列。任一节点的工作线程都可以领取任务
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from collections import deque
+
+from admission import Overloaded
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+JOB_MAX_PENDING = int(os.environ.get('JOB_MAX_PENDING', 1000))
+# 完成的任务保留时间（秒），过期后查询返回404
+JOB_TTL = float(os.environ.get('JOB_TTL', 3600))
+# 服务繁忙被拒绝时最多重新排队的次数
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+# 共享存储路径，为空时使用进程内存储
+JOB_STORE_PATH = os.environ.get('JOB_STORE_PATH', '')
+# 共享存储中执行超过该时间仍未完成的任务视为所在节点已退出，可被重新领取
+JOB_RUNNING_TIMEOUT = float(os.environ.get('JOB_RUNNING_TIMEOUT', 300))
+# 共享后端中未完成任务的保留时间（秒），排队超过该时间的任务过期后不再执行
+JOB_PENDING_TTL = float(os.environ.get('JOB_PENDING_TTL', 24 * 3600))
+# 共享存储的轮询间隔（秒）
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 0.5))
+# SSE推送任务状态时的心跳间隔（秒），避免代理因空闲断开连接
+JOB_EVENTS_KEEPALIVE = float(os.environ.get('JOB_EVENTS_KEEPALIVE', 15))
+
+FINISHED = ('done', 'failed')
+
+
+def new_job(params):
+    now = time.time()
+    return {
+        'id': uuid.uuid4().hex,
+        'status': 'queued',
+        'params': params,
+        'result': None,
+        'error': None,
+        'attempts': 0,
+        'created_at': now,
+        'available_at': now,
+        'started_at': None,
+        'finished_at': None
+    }
+
+
+class JobStore:
+    """任务存储接口，任务为dict（字段见new_job），返回的都是副本"""
+
+    # 读写是否可能长时间阻塞（文件锁、网络请求）：为真时异步服务器在线程池中调用（见shared_backend.call_blocking）
+    blocking = False
+
+    def create(self, params):
+        """新建排队中的任务并返回"""
+        raise NotImplementedError
+
+    def get(self, job_id):
+        """返回任务，不存在或已过期时返回None"""
+        raise NotImplementedError
+
+    def claim(self, timeout):
+        """领取一个可执行的任务并标记为running，timeout秒内没有任务时返回None"""
+        raise NotImplementedError
+
+    def finish(self, job_id, result=None, error=None):
+        """记录任务结果（error不为None时为失败）"""
+        raise NotImplementedError
+
+    def requeue(self, job_id, delay):
+        """任务重新排队，delay秒后才能再次领取"""
+        raise NotImplementedError
+
+    def _poll_claim(self, timeout):
+        """按JOB_POLL_INTERVAL轮询_claim_once，用于没有跨进程通知的共享存储"""
+        deadline = time.time() + timeout
+        while True:
+            job = self._claim_once()
+            if job is not None or time.time() >= deadline:
+                return job
+            time.sleep(min(JOB_POLL_INTERVAL, max(0.0, deadline - time.time())))
+
+    def wait(self, job_id, timeout):
+        """等待任务完成，最多timeout秒，返回当前的任务"""
+        deadline = time.time() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job['status'] in FINISHED or time.time() >= deadline:
+                return job
+            time.sleep(JOB_POLL_INTERVAL)
+
+    def pending(self):
+        """排队和执行中的任务数"""
+        raise NotImplementedError
+
+    def cleanup(self, ttl=JOB_TTL):
+        """删除完成超过ttl秒的任务"""
+        raise NotImplementedError
+
+
+class MemoryJobStore(JobStore):
+    """进程内任务存储"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._queue = deque()  # 排队中的任务id
+        self._cond = threading.Condition()
+
+    def create(self, params):
+        job = new_job(params)
+        with self._cond:
+            self._jobs[job['id']] = job
+            self._queue.append(job['id'])
+            self._cond.notify_all()
+        return dict(job)
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def claim(self, timeout):
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                now = time.time()
+                next_available = None
+                for job_id in self._queue:
+                    job = self._jobs[job_id]
+                    if job['available_at'] <= now:
+                        self._queue.remove(job_id)
+                        job.update(status='running', started_at=now, attempts=job['attempts'] + 1)
+                        return dict(job)
+                    if next_available is None or job['available_at'] < next_available:
+                        next_available = job['available_at']
+
+                remaining = deadline - now
+                if remaining <= 0:
+                    return None
+                if next_available is not None:
+                    remaining = min(remaining, next_available - now)
+                self._cond.wait(remaining)
+
+    def finish(self, job_id, result=None, error=None):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(status='failed' if error is not None else 'done', result=result, error=error,
+                       finished_at=time.time())
+            self._cond.notify_all()
+
+    def requeue(self, job_id, delay):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(status='queued', available_at=time.time() + delay, started_at=None)
+            self._queue.append(job_id)
+            self._cond.notify_all()
+
+    def wait(self, job_id, timeout):
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._jobs.get(job_id) is None or self._jobs[job_id]['status'] in FINISHED,
+                timeout
+            )
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def pending(self):
+        with self._cond:
+            return sum(1 for job in self._jobs.values() if job['status'] not in FINISHED)
+
+    def cleanup(self, ttl=JOB_TTL):
+        cutoff = time.time() - ttl
+        with self._cond:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job['status'] in FINISHED and job['finished_at'] < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+        return len(expired)
+
+
+class SQLiteJobStore(JobStore):
+    """SQLite共享任务存储，多个进程打开同一文件即共享队列；领取任务在写事务中完成，同一任务只会被一个节点领取"""
+
+    blocking = True
+
+    _COLUMNS = ('id', 'status', 'params', 'result', 'error', 'attempts', 'created_at',
+                'available_at', 'started_at', 'finished_at')
+
+    def __init__(self, path=JOB_STORE_PATH, running_timeout=JOB_RUNNING_TIMEOUT):
+        self.path = path
+        self.running_timeout = running_timeout
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 显式控制事务，领取任务时用BEGIN IMMEDIATE加写锁
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                params TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                available_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, available_at)')
+        self._lock = threading.Lock()
+
+    def _row_to_job(self, row):
+        if row is None:
+            return None
+        job = dict(zip(self._COLUMNS, row))
+        job['params'] = json.loads(job['params'])
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        return job
+
+    def create(self, params):
+        job = new_job(params)
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO jobs (id, status, params, attempts, created_at, available_at) '
+                'VALUES (?, ?, ?, 0, ?, ?)',
+                (job['id'], job['status'], json.dumps(params, ensure_ascii=False),
+                 job['created_at'], job['available_at'])
+            )
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                f'SELECT {", ".join(self._COLUMNS)} FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+        return self._row_to_job(row)
+
+    def _claim_once(self):
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    'SELECT id FROM jobs WHERE (status = ? AND available_at <= ?) '
+                    'OR (status = ? AND started_at < ?) ORDER BY created_at LIMIT 1',
+                    ('queued', now, 'running', now - self.running_timeout)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        'UPDATE jobs SET status = ?, started_at = ?, attempts = attempts + 1 WHERE id = ?',
+                        ('running', now, row[0])
+                    )
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return self.get(row[0]) if row is not None else None
+
+    def claim(self, timeout):
+        return self._poll_claim(timeout)
+
+    def finish(self, job_id, result=None, error=None):
+        with self._lock:
+            self._conn.execute(
+                'UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?',
+                ('failed' if error is not None else 'done',
+                 json.dumps(result, ensure_ascii=False) if result is not None else None,
+                 error, time.time(), job_id)
+            )
+
+    def requeue(self, job_id, delay):
+        with self._lock:
+            self._conn.execute(
+                'UPDATE jobs SET status = ?, available_at = ?, started_at = NULL WHERE id = ?',
+                ('queued', time.time() + delay, job_id)
+            )
+
+    def pending(self):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)', ('queued', 'running')
+            ).fetchone()[0]
+
+    def cleanup(self, ttl=JOB_TTL):
+        with self._lock:
+            cursor = self._conn.execute(
+                'DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?',
+                ('done', 'failed', time.time() - ttl)
+            )
+        return cursor.rowcount
+
+
+class SharedJobStore(JobStore):
+    """共享后端中的任务存储，多台主机上的节点配置同一个Redis即共享任务队列
+
+    任务内容保存为JSON（未完成的保留JOB_PENDING_TTL秒，完成后保留JOB_TTL秒，过期由后端删除），
+    排队和执行中的任务id分别在两个延时队列中；领取由后端的queue_claim一次完成，同一任务只会被一个节点领取，
+    执行超过running_timeout秒仍未完成的任务可被重新领取（与SQLiteJobStore相同）
+    """
+
+    def __init__(self, backend, namespace='jobs', running_timeout=JOB_RUNNING_TIMEOUT):
+        self.backend = backend
+        self.blocking = backend.blocking
+        self.namespace = namespace
+        self.running_timeout = running_timeout
+        # {namespace}使两个队列落在Redis Cluster的同一个slot，可以在一个脚本中访问
+        self._queued = f'{{{namespace}}}:queued'
+        self._running = f'{{{namespace}}}:running'
+
+    def _key(self, job_id):
+        return f'{self.namespace}:{job_id}'
+
+    def _save(self, job):
+        ttl = JOB_TTL if job['status'] in FINISHED else JOB_PENDING_TTL
+        self.backend.set(self._key(job['id']), json.dumps(job, ensure_ascii=False).encode('utf-8'), ttl)
+
+    def create(self, params):
+        job = new_job(params)
+        self._save(job)
+        self.backend.queue_push(self._queued, job['id'], job['available_at'])
+        return job
+
+    def get(self, job_id):
+        blob = self.backend.get(self._key(job_id))
+        return json.loads(blob) if blob is not None else None
+
+    def _claim_once(self):
+        now = time.time()
+        while True:
+            job_id = self.backend.queue_claim(self._queued, self._running, now, now - self.running_timeout)
+            if job_id is None:
+                return None
+            job = self.get(job_id)
+            if job is not None:
+                break
+            # 任务内容已过期
+            self.backend.queue_remove(self._running, job_id)
+        job.update(status='running', started_at=now, attempts=job['attempts'] + 1)
+        self._save(job)
+        return job
+
+    def claim(self, timeout):
+        return self._poll_claim(timeout)
+
+    def finish(self, job_id, result=None, error=None):
+        job = self.get(job_id)
+        if job is not None:
+            job.update(status='failed' if error is not None else 'done', result=result, error=error,
+                       finished_at=time.time())
+            self._save(job)
+        self.backend.queue_remove(self._running, job_id)
+
+    def requeue(self, job_id, delay):
+        job = self.get(job_id)
+        self.backend.queue_remove(self._running, job_id)
+        if job is None:
+            return
+        job.update(status='queued', available_at=time.time() + delay, started_at=None)
+        self._save(job)
+        self.backend.queue_push(self._queued, job_id, job['available_at'])
+
+    def pending(self):
+        return self.backend.queue_size(self._queued) + self.backend.queue_size(self._running)
+
+    def cleanup(self, ttl=JOB_TTL):
+        # 完成的任务由后端按TTL删除；内容已过期的任务id在领取时移除
+        return 0
+
+
+def create_job_store(shared_backend=None):
+    """按环境变量创建任务存储：JOB_STORE_PATH不为空时使用SQLite文件，
+    否则配置了共享后端时使用SharedJobStore，都没有时使用进程内存储"""
+    if JOB_STORE_PATH:
+        print(f"[JOBS] 使用共享任务存储: {JOB_STORE_PATH}")
+        return SQLiteJobStore(JOB_STORE_PATH)
+    if shared_backend is not None:
+        print("[JOBS] 使用共享后端中的任务存储")
+        return SharedJobStore(shared_backend)
+    return MemoryJobStore()
+
+
+class JobWorkerPool:
+    """工作线程从任务存储领取任务并执行
+
+    handler(params)返回任务结果（响应内容dict），抛出异常时任务失败；
+    抛出Overloaded时按retry_after重新排队，超过JOB_MAX_ATTEMPTS次后失败
+    """
+
+    def __init__(self, store, handler, workers=JOB_WORKERS):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.completed = 0
+        self.failed = 0
+        self.requeued = 0
+        self._threads = []
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """启动工作线程（重复调用无效果）"""
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._loop, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        print(f"[JOBS] 任务工作线程已启动: {self.workers} 个")
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+
+    def _loop(self):
+        next_cleanup = time.time() + 60
+        while not self._stop.is_set():
+            job = self.store.claim(timeout=1)
+            if time.time() >= next_cleanup:
+                self.store.cleanup()
+                next_cleanup = time.time() + 60
+            if job is not None:
+                self._run(job)
+
+    def _run(self, job):
+        job_id = job['id']
+        try:
+            result = self.handler(job['params'])
+        except Overloaded as e:
+            if job['attempts'] < JOB_MAX_ATTEMPTS:
+                self.store.requeue(job_id, e.retry_after)
+                with self._lock:
+                    self.requeued += 1
+                print(f"[JOBS] 服务繁忙，任务 {job_id[:12]} {e.retry_after}秒后重试")
+                return
+            error = f'Server busy ({e.reason})'
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        else:
+            self.store.finish(job_id, result=result)
+            with self._lock:
+                self.completed += 1
+            return
+
+        print(f"✗ 任务 {job_id[:12]} 失败: {error}")
+        self.store.finish(job_id, error=error)
+        with self._lock:
+            self.failed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': len(self._threads),
+                'pending': self.store.pending(),
+                'completed': self.completed,
+                'failed': self.failed,
+                'requeued': self.requeued,
+                'backend': type(self.store).__name__
+            }
+
+
+def job_response(job):
+    """任务状态响应：完成时附带result，失败时附带error"""
+    payload = {
+        'success': True,
+        'job_id': job['id'],
+        'status': job['status'],
+        'attempts': job['attempts'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at']
+    }
+    if job['status'] == 'done':
+        payload['result'] = job['result']
+    elif job['status'] == 'failed':
+        payload['error'] = job['error']
+    return payload
+
+
+def job_submitted_response(job):
+    """提交任务后的202响应内容"""
+    return {
+        'success': True,
+        'job_id': job['id'],
+        'status': job['status'],
+        'status_url': f"/api/jobs/{job['id']}",
+        'events_url': f"/api/jobs/{job['id']}/events"
+    }
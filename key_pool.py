@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上游API Key池 - 配置多个智谱API Key，每个Key有独立的客户端、并发数和每分钟调用数统计，
+收到429后按Retry-After冷却；每次调用选择负载最低的可用Key，总吞吐随Key数量线性增加
+PooledClient / AsyncPooledClient提供与Anthropic客户端相同的messages.create和messages.stream，
+调用方无需区分单Key和多Key
+
+Key的来源（按顺序合并，去重）:
+    ZHIPU_API_KEY           单个Key（原有配置）
+    ZHIPU_API_KEYS          逗号分隔的多个Key
+    ZHIPU_API_KEY_2, _3...  按编号的多个Key
+    ZHIPU_API_KEY_FILE      文件，每行一个Key，#开头为注释
+"""
+
+import os
+import re
+import time
+import asyncio
+import threading
+from collections import deque
+
+import anthropic
+
+from admission import ADMISSION_MAX_CONCURRENT, UPSTREAM_RPM
+from retry_policy import DeadlineExceeded, RetryPolicy, is_retryable, retry_after_seconds
+
+# 每个Key的并发和速率上限（默认与单Key时的准入控制相同），0为不限
+KEY_MAX_CONCURRENT = int(os.environ.get('KEY_MAX_CONCURRENT', ADMISSION_MAX_CONCURRENT))
+KEY_RPM = float(os.environ.get('KEY_RPM', UPSTREAM_RPM))
+# 429未带Retry-After时的冷却秒数；401/403（Key失效或无权限）时的冷却秒数
+KEY_COOLDOWN = float(os.environ.get('KEY_COOLDOWN', 30))
+KEY_AUTH_COOLDOWN = float(os.environ.get('KEY_AUTH_COOLDOWN', 600))
+
+# 统计每分钟调用数的窗口（秒）
+RPM_WINDOW = 60
+
+_NUMBERED_KEY = re.compile(r'^ZHIPU_API_KEY_(\d+)$')
+
+
+def load_api_keys(environ=None):
+    """按模块说明中的顺序读取全部API Key，返回去重后的列表"""
+    environ = os.environ if environ is None else environ
+    keys = [environ.get('ZHIPU_API_KEY', '')]
+    keys += environ.get('ZHIPU_API_KEYS', '').split(',')
+    numbered = sorted((int(m.group(1)), value) for name, value in environ.items()
+                      for m in [_NUMBERED_KEY.match(name)] if m)
+    keys += [value for _, value in numbered]
+
+    path = environ.get('ZHIPU_API_KEY_FILE')
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            keys += [line for line in f if not line.strip().startswith('#')]
+
+    result = []
+    for key in keys:
+        key = key.strip()
+        if key and key not in result:
+            result.append(key)
+    return result
+
+
+def is_failover_error(error):
+    """换一个Key可能成功的错误：可重试的临时错误，以及Key失效或无权限(401/403)"""
+    return is_retryable(error) or isinstance(
+        error, (anthropic.AuthenticationError, anthropic.PermissionDeniedError))
+
+
+class UpstreamKey:
+    """单个API Key的客户端和负载统计（计数由KeyPool在锁内修改）"""
+
+    def __init__(self, index, api_key, client, max_concurrent, rpm):
+        self.name = f'key{index}-{api_key[-4:]}'
+        self.client = client
+        self.max_concurrent = max_concurrent
+        self.rpm = rpm
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.cooldown_until = 0.0
+        self._recent = deque()
+
+    def recent_requests(self, now):
+        """最近RPM_WINDOW秒内发起的调用数"""
+        while self._recent and self._recent[0] <= now - RPM_WINDOW:
+            self._recent.popleft()
+        return len(self._recent)
+
+    def load(self, now):
+        """负载：并发和每分钟调用数占各自上限的比例中较大者"""
+        load = 0.0
+        if self.max_concurrent:
+            load = self.in_flight / self.max_concurrent
+        if self.rpm:
+            load = max(load, self.recent_requests(now) / self.rpm)
+        return load
+
+    def available(self, now):
+        if self.cooldown_until > now:
+            return False
+        if self.max_concurrent and self.in_flight >= self.max_concurrent:
+            return False
+        return not (self.rpm and self.recent_requests(now) >= self.rpm)
+
+    def stats(self, now):
+        return {
+            'key': self.name,
+            'in_flight': self.in_flight,
+            'max_concurrent': self.max_concurrent,
+            'requests': self.requests,
+            'requests_last_minute': self.recent_requests(now),
+            'rpm_limit': self.rpm,
+            'errors': self.errors,
+            'rate_limited': self.rate_limited,
+            'cooldown_remaining': round(max(0.0, self.cooldown_until - now), 1),
+            'available': self.available(now)
+        }
+
+
+class KeyPool:
+    """API Key池
+
+    client_factory(api_key=..., **options)创建单个Key的客户端（如functools.partial(Anthropic,
+    base_url=BASE_URL)）；SDK自带的重试被关闭，由PooledClient按重试策略换Key或退避后重试
+    """
+
+    def __init__(self, api_keys, client_factory, max_concurrent=KEY_MAX_CONCURRENT, rpm=KEY_RPM,
+                 cooldown=KEY_COOLDOWN, auth_cooldown=KEY_AUTH_COOLDOWN):
+        if not api_keys:
+            raise ValueError('至少需要一个API Key')
+        self.keys = [UpstreamKey(i, api_key, client_factory(api_key=api_key, max_retries=0),
+                                 max_concurrent, rpm)
+                     for i, api_key in enumerate(api_keys, 1)]
+        self.cooldown = cooldown
+        self.auth_cooldown = auth_cooldown
+        self.failovers = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def acquire(self, exclude=()):
+        """选择负载最低的可用Key并计入一次调用
+
+        没有可用Key时（都在冷却或已满）仍然选择一个：准入控制器已经限制了总并发和总速率，
+        这里不再排队；优先选不在冷却中的Key，否则选最早结束冷却的Key
+        """
+        with self._lock:
+            now = time.monotonic()
+            candidates = [k for k in self.keys if k not in exclude] or self.keys
+            available = [k for k in candidates if k.available(now)]
+            if available:
+                key = min(available, key=lambda k: (k.load(now), k.requests))
+            else:
+                key = min(candidates, key=lambda k: (max(k.cooldown_until, now), k.load(now)))
+            key.in_flight += 1
+            key.requests += 1
+            key._recent.append(now)
+            return key
+
+    def release(self, key, error=None):
+        """调用结束；error为上游错误时更新错误数和冷却状态"""
+        with self._lock:
+            key.in_flight -= 1
+            if error is None:
+                return
+            key.errors += 1
+            if isinstance(error, anthropic.RateLimitError):
+                key.rate_limited += 1
+                cooldown = retry_after_seconds(error, self.cooldown)
+            elif isinstance(error, (anthropic.AuthenticationError, anthropic.PermissionDeniedError)):
+                cooldown = self.auth_cooldown
+            else:
+                return
+            key.cooldown_until = max(key.cooldown_until, time.monotonic() + cooldown)
+        print(f"[KEYS] {key.name} {type(error).__name__}，冷却 {cooldown:.0f}秒")
+
+    def fail(self, key, error, tried):
+        """调用出错：释放Key并记入tried，返回是否有未试过的可用Key可以立即换用
+
+        error也可能是取消（asyncio.CancelledError等），此时只释放Key
+        """
+        upstream_error = error if isinstance(error, Exception) else None
+        self.release(key, upstream_error)
+        tried.add(key)
+        if upstream_error is None or not is_failover_error(upstream_error):
+            return False
+        with self._lock:
+            now = time.monotonic()
+            return any(k not in tried and k.cooldown_until <= now for k in self.keys)
+
+    def count_failover(self):
+        with self._lock:
+            self.failovers += 1
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            keys = [k.stats(now) for k in self.keys]
+            failovers = self.failovers
+        return {
+            'total': len(keys),
+            'available': sum(1 for k in keys if k['available']),
+            'failovers': failovers,
+            'keys': keys
+        }
+
+
+class _PooledCall:
+    """一次上游调用（含换Key和重试）的状态
+
+    调用参数中的deadline（retry_policy.Deadline）不传给SDK：每次尝试前检查是否已过期，
+    并把剩余时间作为该次尝试的超时
+    """
+
+    def __init__(self, pool, retry_policy, kwargs):
+        self.pool = pool
+        self.retry_policy = retry_policy
+        self.deadline = kwargs.pop('deadline', None)
+        self.model = kwargs.get('model')
+        self.kwargs = kwargs
+        self.attempt = 0
+        self.tried = set()
+
+    def start(self):
+        """开始一次尝试，返回选中的Key"""
+        if self.deadline is not None:
+            if self.deadline.expired():
+                raise DeadlineExceeded(f'Deadline exceeded ({self.deadline.timeout:g}s)')
+            self.kwargs['timeout'] = self.deadline.remaining()
+        self.attempt += 1
+        return self.pool.acquire(self.tried)
+
+    def retry_delay(self, key, error):
+        """尝试失败：释放Key，返回重试前的等待秒数；不再重试时返回None，由调用方重新抛出error
+
+        截止时间已过时抛出DeadlineExceeded
+        """
+        failover = self.pool.fail(key, error, self.tried)
+        if not isinstance(error, Exception):
+            return None
+        if not (failover or is_retryable(error)):
+            return None
+        delay = self.retry_policy.next_delay(error, self.attempt, self.deadline, self.model,
+                                             immediate=failover)
+        if delay is None:
+            if self.deadline is not None and self.deadline.expired():
+                raise DeadlineExceeded(f'Deadline exceeded ({self.deadline.timeout:g}s)') from error
+            return None
+        if failover:
+            self.pool.count_failover()
+        else:
+            # 退避之后所有Key重新参与选择
+            self.tried.clear()
+        return delay
+
+
+class _PooledStream:
+    """messages.stream()的同步包装：进入时选Key建立流式连接（失败时重试），退出时释放Key；
+    已经开始推送内容后出错不再重试"""
+
+    def __init__(self, call):
+        self._call = call
+        self._key = None
+        self._manager = None
+
+    def __enter__(self):
+        call = self._call
+        while True:
+            key = call.start()
+            manager = key.client.messages.stream(**call.kwargs)
+            try:
+                stream = manager.__enter__()
+            except BaseException as e:
+                delay = call.retry_delay(key, e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self._key, self._manager = key, manager
+            return stream
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            return self._manager.__exit__(exc_type, exc, tb)
+        finally:
+            self._call.pool.release(self._key, exc if isinstance(exc, anthropic.APIError) else None)
+
+
+class _PooledMessages:
+    def __init__(self, pool, retry_policy):
+        self._pool = pool
+        self._retry_policy = retry_policy
+
+    def create(self, **kwargs):
+        call = _PooledCall(self._pool, self._retry_policy, kwargs)
+        while True:
+            key = call.start()
+            try:
+                response = key.client.messages.create(**call.kwargs)
+            except BaseException as e:
+                delay = call.retry_delay(key, e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self._pool.release(key)
+            return response
+
+    def stream(self, **kwargs):
+        return _PooledStream(_PooledCall(self._pool, self._retry_policy, kwargs))
+
+
+class PooledClient:
+    """同步客户端（Flask和离线批量生成使用），retry_policy默认为RetryPolicy()"""
+
+    def __init__(self, pool, retry_policy=None):
+        self.pool = pool
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.messages = _PooledMessages(pool, self.retry_policy)
+
+    def close(self):
+        for key in self.pool.keys:
+            key.client.close()
+
+
+class _AsyncPooledStream:
+    """messages.stream()的asyncio包装"""
+
+    def __init__(self, call):
+        self._call = call
+        self._key = None
+        self._manager = None
+
+    async def __aenter__(self):
+        call = self._call
+        while True:
+            key = call.start()
+            manager = key.client.messages.stream(**call.kwargs)
+            try:
+                stream = await manager.__aenter__()
+            except BaseException as e:
+                delay = call.retry_delay(key, e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self._key, self._manager = key, manager
+            return stream
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            return await self._manager.__aexit__(exc_type, exc, tb)
+        finally:
+            self._call.pool.release(self._key, exc if isinstance(exc, anthropic.APIError) else None)
+
+
+class _AsyncPooledMessages:
+    def __init__(self, pool, retry_policy):
+        self._pool = pool
+        self._retry_policy = retry_policy
+
+    async def create(self, **kwargs):
+        call = _PooledCall(self._pool, self._retry_policy, kwargs)
+        while True:
+            key = call.start()
+            try:
+                response = await key.client.messages.create(**call.kwargs)
+            except BaseException as e:
+                delay = call.retry_delay(key, e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self._pool.release(key)
+            return response
+
+    def stream(self, **kwargs):
+        return _AsyncPooledStream(_PooledCall(self._pool, self._retry_policy, kwargs))
+
+
+class AsyncPooledClient:
+    """asyncio客户端（Quart使用），retry_policy默认为RetryPolicy()"""
+
+    def __init__(self, pool, retry_policy=None):
+        self.pool = pool
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.messages = _AsyncPooledMessages(pool, self.retry_policy)
+
+    async def close(self):
+        await asyncio.gather(*(key.client.close() for key in self.pool.keys))
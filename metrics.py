@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运行指标 - 以Prometheus文本格式输出(/metrics)
+包括按接口和模型统计的延迟直方图、上游token用量、按类型统计的错误数、进行中请求数和缓存命中率
+不依赖prometheus_client，只实现本项目用到的Counter/Gauge/Histogram
+"""
+
+import time
+import threading
+
+from admission import Overloaded
+
+# 延迟直方图的分桶（秒），覆盖缓存命中的毫秒级到上游调用的分钟级
+LATENCY_BUCKETS = (0.005, 0.025, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def error_type(error):
+    """错误类型标签：繁忙拒绝按原因区分，其余使用异常类名（如RateLimitError、APITimeoutError）"""
+    if isinstance(error, Overloaded):
+        return f'overloaded_{error.reason}'
+    return type(error).__name__
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}')
+        return lines
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, *labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, *labels, value):
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = {'counts': [0] * len(self.buckets), 'sum': 0.0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][i] += 1
+                    break
+            state['sum'] += value
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            for labels, state in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, state['counts']):
+                    cumulative += count
+                    label_text = _format_labels(self.labelnames, labels, ('le', _format_value(bound)))
+                    lines.append(f'{self.name}_bucket{label_text} {cumulative}')
+                label_text = _format_labels(self.labelnames, labels)
+                lines.append(f'{self.name}_sum{label_text} {_format_value(state["sum"])}')
+                lines.append(f'{self.name}_count{label_text} {cumulative}')
+        return lines
+
+
+class RecommendMetrics:
+    """推荐API服务器的全部指标"""
+
+    def __init__(self, prefix='food'):
+        self.request_latency = Histogram(
+            f'{prefix}_request_duration_seconds', '接口请求耗时', ('endpoint', 'model'))
+        self.requests = Counter(
+            f'{prefix}_requests_total', '接口请求数', ('endpoint', 'status'))
+        self.in_flight = Gauge(
+            f'{prefix}_requests_in_flight', '正在处理的接口请求数', ('endpoint',))
+        self.upstream_latency = Histogram(
+            f'{prefix}_upstream_duration_seconds', 'GLM上游调用耗时', ('model',))
+        self.upstream_tokens = Counter(
+            f'{prefix}_upstream_tokens_total', 'GLM上游token用量', ('model', 'direction'))
+        self.errors = Counter(
+            f'{prefix}_errors_total', '按类型统计的错误数', ('type',))
+        self._prefix = prefix
+        self._started = time.time()
+
+    def observe_request(self, endpoint, model, status, seconds):
+        self.request_latency.observe(endpoint, model or '', value=seconds)
+        self.requests.inc(endpoint, str(status))
+
+    def observe_upstream(self, model, seconds, usage=None):
+        """记录一次上游调用，usage为SDK返回的response.usage"""
+        self.upstream_latency.observe(model, value=seconds)
+        if usage is not None:
+            self.upstream_tokens.inc(model, 'input', amount=getattr(usage, 'input_tokens', 0) or 0)
+            self.upstream_tokens.inc(model, 'output', amount=getattr(usage, 'output_tokens', 0) or 0)
+
+    def count_error(self, error_type):
+        self.errors.inc(error_type)
+
+    def render(self, cache_stats=None, admission_stats=None, canonical_stats=None, key_stats=None):
+        """输出Prometheus文本格式；缓存、准入控制和API Key池的数值在输出时读取"""
+        lines = []
+        for metric in (self.request_latency, self.requests, self.in_flight,
+                       self.upstream_latency, self.upstream_tokens, self.errors):
+            lines.extend(metric.render())
+
+        p = self._prefix
+        snapshot = []
+        if cache_stats is not None:
+            snapshot += [
+                (f'{p}_cache_hits_total', 'counter', '推荐缓存命中次数', cache_stats['hits']),
+                (f'{p}_cache_misses_total', 'counter', '推荐缓存未命中次数', cache_stats['misses']),
+                (f'{p}_cache_hit_ratio', 'gauge', '推荐缓存命中率', cache_stats['hit_ratio']),
+            ]
+            # 共享缓存没有本进程的容量信息
+            if 'bytes' in cache_stats:
+                snapshot += [
+                    (f'{p}_cache_bytes', 'gauge', '推荐缓存占用字节数', cache_stats['bytes']),
+                    (f'{p}_cache_entries', 'gauge', '推荐缓存条目数', cache_stats['entries']),
+                ]
+        if admission_stats is not None:
+            snapshot += [
+                (f'{p}_upstream_in_flight', 'gauge', '进行中的上游调用数', admission_stats['in_flight']),
+                (f'{p}_upstream_queued', 'gauge', '等待上游调用名额的请求数', admission_stats['queued']),
+            ]
+        if canonical_stats is not None:
+            snapshot += [
+                (f'{p}_canonical_requests_total', 'counter', '经过参数规范化的请求数', canonical_stats['requests']),
+                (f'{p}_canonical_rewritten_total', 'counter', '参数被规范化改写的请求数', canonical_stats['rewritten']),
+                (f'{p}_canonical_key_reduction', 'gauge', '规范化减少的不同参数组合比例', canonical_stats['key_reduction']),
+            ]
+        snapshot.append((f'{p}_uptime_seconds', 'gauge', '服务运行时间', round(time.time() - self._started, 3)))
+
+        for name, kind, documentation, value in snapshot:
+            lines += [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}',
+                      f'{name} {_format_value(value)}']
+
+        if key_stats is not None:
+            # 每个API Key一组带key标签的指标
+            for field, kind, documentation in (
+                    ('in_flight', 'gauge', '该Key进行中的上游调用数'),
+                    ('requests_last_minute', 'gauge', '该Key最近一分钟的上游调用数'),
+                    ('requests', 'counter', '该Key的上游调用总数'),
+                    ('errors', 'counter', '该Key的上游调用错误数'),
+                    ('rate_limited', 'counter', '该Key收到429的次数'),
+                    ('cooldown_remaining', 'gauge', '该Key剩余冷却秒数')):
+                name = f'{p}_upstream_key_{field}' + ('_total' if kind == 'counter' else '')
+                lines += [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}']
+                lines += [f'{name}{_format_labels(("key",), (k["key"],))} {_format_value(k[field])}'
+                          for k in key_stats['keys']]
+        return '\n'.join(lines) + '\n'
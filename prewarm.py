@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推荐预热 - 在用餐高峰前为即将到来的餐次预先生成并缓存推荐
+覆盖配置的前N个城市 × 全部饮食类型（× 配置的健康目标、天气、模型），参数与前端请求一致，
+高峰时的请求直接命中缓存；日期变化后节气描述随之变化，新节气的推荐也会在第一个高峰前生成
+
+预热使用独立的上游调用预算（并发数和速率），不占用在线请求的准入名额；
+在线请求出现排队时暂停预热，优先保证在线流量
+"""
+
+import os
+import time
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from solar_terms import season_name, solar_term_description
+
+PREWARM_ENABLED = os.environ.get('PREWARM_ENABLED', '0') == '1'
+# 城市按热度排列（默认与index.html的locationSelect顺序一致），只预热前PREWARM_TOP_N个
+PREWARM_CITIES = os.environ.get('PREWARM_CITIES', '北京,上海,广州,深圳,杭州,成都,重庆,武汉,西安,南京')
+PREWARM_TOP_N = int(os.environ.get('PREWARM_TOP_N', 5))
+PREWARM_HEALTH_GOALS = os.environ.get('PREWARM_HEALTH_GOALS', '健脾')
+PREWARM_WEATHERS = os.environ.get('PREWARM_WEATHERS', '晴')
+PREWARM_MODELS = os.environ.get('PREWARM_MODELS', 'glm-4-flash')
+# 各餐次的需求高峰时间，提前PREWARM_LEAD_MINUTES分钟开始预热
+PREWARM_PEAKS = os.environ.get('PREWARM_PEAKS', '早餐=07:00,午餐=11:30,晚餐=17:30')
+PREWARM_LEAD_MINUTES = float(os.environ.get('PREWARM_LEAD_MINUTES', 30))
+# 预热专用的上游调用预算，与在线请求的ADMISSION_*/UPSTREAM_*相互独立
+PREWARM_CONCURRENCY = int(os.environ.get('PREWARM_CONCURRENCY', 2))
+PREWARM_RPM = float(os.environ.get('PREWARM_RPM', 10))
+
+# 与index.html的dietType选项一致
+DIET_TYPES = ('日常饮食', '药膳饮食', '茶饮推荐')
+
+# 在线请求排队时，预热每次暂停的秒数
+_YIELD_INTERVAL = 1.0
+
+
+def _split(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def parse_peaks(spec=PREWARM_PEAKS):
+    """解析"早餐=07:00,午餐=11:30"格式的高峰配置，返回[(餐次, 时, 分), ...]"""
+    peaks = []
+    for item in _split(spec):
+        period, _, clock = item.partition('=')
+        hour, _, minute = clock.strip().partition(':')
+        peaks.append((period.strip(), int(hour), int(minute or 0)))
+    return peaks
+
+
+def next_warmup(now, peaks, lead_minutes=PREWARM_LEAD_MINUTES, after=None):
+    """返回下一次预热(开始时间, 餐次, 高峰时间)
+
+    只考虑晚于now和after（上次已预热的高峰）的高峰；已处于提前量窗口内时开始时间为now
+    """
+    candidates = []
+    for day_offset in (0, 1):
+        day = now.date() + timedelta(days=day_offset)
+        for period, hour, minute in peaks:
+            peak = datetime(day.year, day.month, day.day, hour, minute)
+            if peak <= now or (after is not None and peak <= after):
+                continue
+            start = max(peak - timedelta(minutes=lead_minutes), now)
+            candidates.append((start, period, peak))
+    return min(candidates, key=lambda c: c[0]) if candidates else None
+
+
+def plan_requests(meal_period, peak, cities=None, health_goals=None, weathers=None, models=None):
+    """生成一个餐次高峰需要预热的请求参数列表（格式同/api/recommend的请求体）"""
+    cities = cities if cities is not None else _split(PREWARM_CITIES)[:PREWARM_TOP_N]
+    health_goals = health_goals if health_goals is not None else _split(PREWARM_HEALTH_GOALS)
+    weathers = weathers if weathers is not None else _split(PREWARM_WEATHERS)
+    models = models if models is not None else _split(PREWARM_MODELS)
+
+    date = peak.date()
+    common = {
+        'date': date.isoformat(),
+        'time': peak.strftime('%H:%M'),
+        'mealPeriod': meal_period,
+        'solarTerm': solar_term_description(date),
+        'season': season_name(date)
+    }
+    return [
+        {**common, 'dietType': diet_type, 'healthGoal': goal, 'location': city,
+         'weather': weather, 'model': model}
+        for city in cities
+        for diet_type in DIET_TYPES
+        for goal in health_goals
+        for weather in weathers
+        for model in models
+    ]
+
+
+def create_budget(controller_class):
+    """创建预热专用的准入控制器（AdmissionController或AsyncAdmissionController）
+
+    预热任务可以等待较长时间，只受速率和并发限制，不会因排队超时被拒绝
+    """
+    return controller_class(max_concurrent=PREWARM_CONCURRENCY, max_queue=1000000,
+                            queue_timeout=3600, rpm=PREWARM_RPM, burst=1)
+
+
+class PrewarmScheduler:
+    """后台线程按餐次高峰调度预热
+
+    warm_one(request_data)负责生成并缓存单个请求的推荐，返回是否调用了上游
+    （缓存中已有新鲜结果时返回False）；live_admission为在线请求的准入控制器，
+    其有请求排队时暂停预热
+    """
+
+    def __init__(self, warm_one, live_admission, peaks=None, lead_minutes=PREWARM_LEAD_MINUTES,
+                 concurrency=PREWARM_CONCURRENCY):
+        self.warm_one = warm_one
+        self.live_admission = live_admission
+        self.peaks = peaks if peaks is not None else parse_peaks()
+        self.lead_minutes = lead_minutes
+        self.concurrency = concurrency
+        self.runs = 0
+        self.generated = 0
+        self.fresh = 0
+        self.failed = 0
+        self.yielded = 0
+        self.last_run = None
+        self.next_run = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name='prewarm', daemon=True)
+        self._thread.start()
+        cities = _split(PREWARM_CITIES)[:PREWARM_TOP_N]
+        print(f"[PREWARM] 预热已启用: {', '.join(cities)}, 提前 {self.lead_minutes:g} 分钟, "
+              f"预算 {PREWARM_RPM:g}次/分钟 并发 {self.concurrency}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _loop(self):
+        last_peak = None
+        while not self._stop.is_set():
+            upcoming = next_warmup(datetime.now(), self.peaks, self.lead_minutes, after=last_peak)
+            if upcoming is None:
+                return
+            start, meal_period, peak = upcoming
+            self.next_run = {'meal_period': meal_period, 'peak': peak.isoformat(),
+                             'start': start.isoformat()}
+            if self._stop.wait(max(0.0, (start - datetime.now()).total_seconds())):
+                return
+            self.run(meal_period, peak)
+            last_peak = peak
+
+    def run(self, meal_period, peak):
+        """预热一个餐次高峰，返回本次统计"""
+        requests = plan_requests(meal_period, peak)
+        run = {'meal_period': meal_period, 'peak': peak.isoformat(),
+               'started': datetime.now().isoformat(timespec='seconds'),
+               'planned': len(requests), 'generated': 0, 'fresh': 0, 'failed': 0}
+        print(f"[PREWARM] 开始预热 {peak:%m-%d} {meal_period}: {len(requests)} 个请求")
+        start_time = time.time()
+
+        # 同时提交的任务不超过并发数，每次提交前都检查在线请求是否在排队
+        slots = threading.Semaphore(self.concurrency)
+
+        def warm(data):
+            try:
+                outcome = 'generated' if self.warm_one(data) else 'fresh'
+            except Exception as e:
+                print(f"✗ 预热失败 ({data['location']} {data['dietType']}): {e}")
+                outcome = 'failed'
+            finally:
+                slots.release()
+            with self._lock:
+                run[outcome] += 1
+                setattr(self, outcome, getattr(self, outcome) + 1)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for data in requests:
+                slots.acquire()
+                if self._stop.is_set():
+                    break
+                self._yield_to_live_traffic()
+                executor.submit(warm, data)
+
+        run['seconds'] = round(time.time() - start_time, 1)
+        with self._lock:
+            self.runs += 1
+            self.last_run = run
+        print(f"[PREWARM] 完成 {meal_period}: 生成 {run['generated']}, 已有缓存 {run['fresh']}, "
+              f"失败 {run['failed']}, 耗时 {run['seconds']}秒")
+        return run
+
+    def _yield_to_live_traffic(self):
+        # 在线请求在排队说明上游名额已用满，预热等待队列清空后再继续提交
+        while self.live_admission.queued > 0 and not self._stop.is_set():
+            self.yielded += 1
+            self._stop.wait(_YIELD_INTERVAL)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self._thread is not None,
+                'runs': self.runs,
+                'generated': self.generated,
+                'fresh': self.fresh,
+                'failed': self.failed,
+                'yielded': self.yielded,
+                'last_run': self.last_run,
+                'next_run': self.next_run
+            }
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+提示词模板 - 服务端根据结构化参数渲染prompt
+模板只解析一次，拆分为文本片段和占位符；文件修改时间变化后自动重新加载
+"""
+
+import os
+import re
+import hashlib
+import threading
+
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts')
+
+FOOD_TEMPLATE = 'food_recommendation_prompt.txt'
+TEA_TEMPLATE = 'tea_recommendation_prompt.txt'
+
+# 渲染所需的结构化参数（language可选，默认中文）
+PROMPT_FIELDS = [
+    'date', 'time', 'mealPeriod', 'dietType', 'healthGoal',
+    'location', 'weather', 'solarTerm', 'season'
+]
+
+# 只匹配{标识符}形式，模板中JSON示例的大括号不会被当作占位符
+PLACEHOLDER_PATTERN = re.compile(r'\{([A-Za-z_][A-Za-z0-9_]*)\}')
+
+
+def language_name(language):
+    """前端语言代码转换为prompt中的语言名称（与app.js的buildPrompt一致）"""
+    if language in ('en', '英语'):
+        return '英语'
+    return '中文'
+
+
+def template_for_diet(diet_type):
+    """根据饮食类型选择模板文件（与app.js的fetchPromptTemplate一致）"""
+    if diet_type == '茶饮推荐':
+        return TEA_TEMPLATE
+    return FOOD_TEMPLATE
+
+
+class PromptTemplate:
+    """预解析的模板：segments中str为原文，(name,)为占位符"""
+
+    def __init__(self, text):
+        self.version = hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]
+        self.segments = []
+        self.placeholders = set()
+
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(text):
+            if match.start() > position:
+                self.segments.append(text[position:match.start()])
+            name = match.group(1)
+            self.segments.append((name,))
+            self.placeholders.add(name)
+            position = match.end()
+        if position < len(text):
+            self.segments.append(text[position:])
+
+    def render(self, values):
+        """用values替换占位符，未提供的占位符保持原样"""
+        parts = []
+        for segment in self.segments:
+            if isinstance(segment, tuple):
+                name = segment[0]
+                parts.append(str(values[name]) if name in values else '{' + name + '}')
+            else:
+                parts.append(segment)
+        return ''.join(parts)
+
+
+class PromptTemplateStore:
+    """按文件名缓存已解析的模板，每次获取时检查mtime，文件变化后重新解析"""
+
+    def __init__(self, directory=PROMPTS_DIR):
+        self.directory = directory
+        self._templates = {}  # 文件名 -> (mtime, PromptTemplate)
+        self._lock = threading.Lock()
+
+    def get(self, filename):
+        path = os.path.join(self.directory, filename)
+        mtime = os.stat(path).st_mtime_ns
+
+        cached = self._templates.get(filename)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        with self._lock:
+            cached = self._templates.get(filename)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+
+            with open(path, 'r', encoding='utf-8') as f:
+                template = PromptTemplate(f.read())
+            self._templates[filename] = (mtime, template)
+            print(f"[PROMPT] 已加载模板 {filename} (版本 {template.version})")
+            return template
+
+    def render_prompt(self, fields):
+        """根据结构化参数渲染prompt，返回(prompt, 模板版本)
+
+        缺少必需参数时抛出ValueError
+        """
+        missing = [name for name in PROMPT_FIELDS if not fields.get(name)]
+        if missing:
+            raise ValueError(f"Missing prompt fields: {', '.join(missing)}")
+
+        filename = template_for_diet(fields['dietType'])
+        template = self.get(filename)
+        values = {name: fields[name] for name in PROMPT_FIELDS}
+        values['language'] = language_name(fields.get('language'))
+        return template.render(values), f"{filename}:{template.version}"
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推荐服务 - 同步(api_server.py)与异步(api_server_async.py)两种服务模式共用的业务逻辑
+包括运行指标、延迟统计、对冲和重试策略，缓存命中与降级的判断，上游响应的记录，
+流式推送的事件，批量、翻译和任务结果的汇总，错误响应，以及健康检查和/metrics的内容
+
+本模块不依赖Web框架，也不直接调用上游或读写缓存；各服务器只保留路由、请求解析，
+以及按线程或asyncio执行上游调用、合并请求和读写缓存的部分
+"""
+
+import time
+import traceback
+
+from api_common import (
+    BASE_URL, batch_item, batch_response, field_canonicalizer, health_payload, overloaded_payload,
+    read_recommend_params, recommendation_fields, recommendation_response, shared_backend, sse_event
+)
+from admission import Overloaded
+from hedging import HedgePolicy, LatencyTracker
+from metrics import RecommendMetrics, error_type
+from recommendation_cache import make_cache_key
+from recommendation_parser import RecommendationJSONScanner
+from retry_policy import DeadlineExceeded, RetryPolicy
+from translation import TRANSLATE_MODEL, apply_translations, parse_translation
+
+# 运行指标（/metrics）
+metrics = RecommendMetrics()
+
+# 按模型统计延迟，用于对冲请求的等待时间
+latency_tracker = LatencyTracker()
+hedge_policy = HedgePolicy(latency_tracker, on_upstream=metrics.observe_upstream)
+
+# 上游临时错误按指数退避重试，预计无法在请求截止时间前完成时不再重试
+retry_policy = RetryPolicy(estimate=lambda model: latency_tracker.percentile(model, 'total', 50))
+
+ENDPOINTS = [
+    ('健康检查', '/api/health'),
+    ('API端点', '/api/recommend'),
+    ('流式端点', '/api/recommend/stream'),
+    ('批量端点', '/api/recommend/batch'),
+    ('翻译端点', '/api/translate'),
+    ('任务端点', '/api/jobs'),
+    ('运行指标', '/metrics')
+]
+
+
+def print_banner(title, key_pool, sdk, recommendation_cache, *details):
+    """服务器启动时的配置摘要，details为各服务模式附加的行"""
+    print("=" * 60)
+    print(title)
+    print("=" * 60)
+    print(f"API Key已加载: {len(key_pool)} 个 ({', '.join(k.name for k in key_pool.keys)})")
+    print(f"Base URL: {BASE_URL}")
+    print(f"SDK: {sdk} (套餐内调用)")
+    for line in details:
+        print(line)
+    print(f"推荐缓存: {recommendation_cache.describe()}")
+    print("=" * 60)
+
+
+def print_endpoints(port):
+    print(f"\n服务器启动在 http://localhost:{port}")
+    for name, path in ENDPOINTS:
+        print(f"{name}: http://localhost:{port}{path}")
+    print(f"{'='*60}\n")
+
+
+def bad_request(message):
+    """请求参数错误，返回400响应内容并计入错误指标"""
+    metrics.count_error('bad_request')
+    return {'error': str(message)}
+
+
+def read_single_recommend(data):
+    """/api/recommend、/api/recommend/stream和/api/jobs的请求参数，缺少prompt或参数不合法时抛出ValueError"""
+    params = read_recommend_params(data or {})
+    if not params['prompt']:
+        raise ValueError('Missing prompt')
+    return params
+
+
+def error_response(error, action):
+    """接口调用失败时的(响应内容, 状态码, 响应头)，并计入错误指标
+
+    Overloaded返回503和Retry-After，DeadlineExceeded返回504，其他异常返回500；action用于日志，如'生成推荐'
+    """
+    metrics.count_error(error_type(error))
+    if isinstance(error, Overloaded):
+        return overloaded_payload(error), 503, {'Retry-After': str(error.retry_after)}
+    if isinstance(error, DeadlineExceeded):
+        print(f"✗ {action}超过截止时间: {error}")
+        return {'error': str(error)}, 504, {}
+    print(f"✗ {action}失败: {error}")
+    traceback.print_exc()
+    return {'error': str(error)}, 500, {}
+
+
+def empty_response():
+    """上游返回空内容时的500响应内容"""
+    print(f"✗ API返回空内容")
+    metrics.count_error('empty_response')
+    return {'error': 'Empty response from API'}
+
+
+# ---------- 推荐 ----------
+
+def recommend_cache_key(params, model=None):
+    """推荐参数对应的缓存key；model为对冲时实际生成内容的备用模型"""
+    return make_cache_key(params['prompt'], model or params['model'], params['temperature'],
+                          params['prompt_version'], params['max_tokens'])
+
+
+def message_kwargs(params, deadline=None):
+    """messages.create/stream的参数（model除外）"""
+    return {
+        'max_tokens': params['max_tokens'],
+        'temperature': params['temperature'],
+        'messages': [
+            {"role": "user", "content": params['prompt']}
+        ],
+        'deadline': deadline
+    }
+
+
+def read_response(model, response, elapsed, max_tokens):
+    """记录一次（非对冲）上游调用的延迟和用量，返回输出文本，空响应时返回None"""
+    latency_tracker.record(model, total=elapsed)
+    metrics.observe_upstream(model, elapsed, getattr(response, 'usage', None))
+    if not (response and response.content):
+        return None
+    if response.stop_reason == 'max_tokens':
+        print(f"⚠ 输出达到max_tokens({max_tokens})被截断，将尝试补全JSON")
+    return response.content[0].text
+
+
+def result_cache_key(params, cache_key, used_model):
+    """生成结果写入缓存的key：备用模型的结果只缓存在备用模型名下"""
+    return cache_key if used_model == params['model'] else recommend_cache_key(params, used_model)
+
+
+def cached_result(params, cache_key, content, freshness):
+    """按缓存查找结果返回fetch_recommendation的返回值：新鲜命中为'cache'，
+    超过软TTL为'stale'（调用方需在后台刷新），未命中返回None"""
+    if freshness == 'fresh':
+        print(f"✓ 命中推荐缓存 ({cache_key[:12]})")
+        return {'content': content, 'source': 'cache', 'model': params['model']}
+    if freshness == 'stale':
+        return {'content': content, 'source': 'stale', 'model': params['model']}
+    return None
+
+
+def degraded_result(params, cache_key, stale_content):
+    """繁忙时的降级结果：返回已过期但仍保留的缓存，没有时返回None（由调用方重新抛出Overloaded）"""
+    if stale_content is None:
+        return None
+    print(f"⚠ 服务繁忙，返回过期缓存 ({cache_key[:12]})")
+    return {'content': stale_content, 'source': 'stale', 'model': params['model']}
+
+
+def upstream_result(cache_key, content, used_model, shared):
+    """上游生成（或共享了并发请求）的结果"""
+    if shared:
+        print(f"✓ 共享并发请求的结果 ({cache_key[:12]})")
+    return {'content': content, 'source': 'shared' if shared else 'upstream', 'model': used_model}
+
+
+class RecommendationStream:
+    """一次流式推荐的SSE事件
+
+    事件类型:
+      delta - {'text': 增量文本}
+      done  - {'success', 'content', 'recommendation', 'truncated', 'cached', 'stale', 'ttft_ms', 'total_ms'}
+      error - {'error': 错误信息}
+    """
+
+    def __init__(self, params, cache_key):
+        self.model = params['model']
+        self.cache_key = cache_key
+        self.start_time = time.time()
+        self.first_token_time = None
+        self.chunks = []
+        self.scanner = RecommendationJSONScanner()  # 边接收边扫描，结束时无需重新解析全文
+        self.ttft_ms = None
+        self.total_ms = None
+
+    def cached(self, content, freshness):
+        """缓存命中时的事件：一次推送全文"""
+        print(f"✓ 命中推荐缓存 ({self.cache_key[:12]}, {freshness})")
+        return [
+            sse_event('delta', {'text': content}),
+            sse_event('done', {
+                'success': True,
+                'content': content,
+                **recommendation_fields(content),
+                'cached': True,
+                'stale': freshness == 'stale',
+                'ttft_ms': 0,
+                'total_ms': 0
+            })
+        ]
+
+    def delta(self, text):
+        """上游输出的一段文本，返回delta事件（空文本返回None）"""
+        if not text:
+            return None
+        if self.first_token_time is None:
+            self.first_token_time = time.time()
+            print(f"[STREAM] 首字延迟(TTFT): {(self.first_token_time - self.start_time) * 1000:.0f}ms")
+        self.chunks.append(text)
+        self.scanner.feed(text)
+        return sse_event('delta', {'text': text})
+
+    def error(self, error):
+        """上游调用失败时的error事件"""
+        metrics.count_error(error_type(error))
+        if isinstance(error, Overloaded):
+            return sse_event('error', overloaded_payload(error))
+        print(f"✗ 流式生成推荐失败: {error}")
+        traceback.print_exc()
+        return sse_event('error', {'error': str(error)})
+
+    def finish(self, usage):
+        """上游输出结束：记录延迟和用量，返回完整内容"""
+        self.total_ms = (time.time() - self.start_time) * 1000
+        if self.first_token_time:
+            self.ttft_ms = (self.first_token_time - self.start_time) * 1000
+        latency_tracker.record(
+            self.model,
+            ttft=self.ttft_ms / 1000 if self.ttft_ms is not None else None,
+            total=self.total_ms / 1000
+        )
+        metrics.observe_upstream(self.model, self.total_ms / 1000, usage)
+        content = ''.join(self.chunks)
+        print(f"[STREAM] 总耗时: {self.total_ms:.0f}ms, 返回内容长度: {len(content)} 字符")
+        return content
+
+    def empty(self):
+        return sse_event('error', empty_response())
+
+    def done(self, content):
+        recommendation, truncated = self.scanner.finish_recommendation()
+        return sse_event('done', {
+            'success': True,
+            'content': content,
+            'recommendation': recommendation,
+            'truncated': truncated,
+            'cached': False,
+            'stale': False,
+            'ttft_ms': round(self.ttft_ms) if self.ttft_ms is not None else None,
+            'total_ms': round(self.total_ms)
+        })
+
+
+# ---------- 批量推荐 ----------
+
+def batch_item_error(index, error):
+    """批量推荐中单个条目失败时的结果"""
+    metrics.count_error(error_type(error))
+    if isinstance(error, Overloaded):
+        return batch_item(index, error=f'Server busy ({error.reason}), retry after {error.retry_after}s')
+    print(f"✗ 批量推荐第{index}条失败: {error}")
+    return batch_item(index, error=str(error))
+
+
+def missing_prompt_item(index):
+    metrics.count_error('bad_request')
+    return batch_item(index, error='Missing prompt')
+
+
+def finish_batch(items, deadline, start_time):
+    """汇总批量推荐，items为按条目顺序的结果，截止时间前未完成的为None"""
+    results = []
+    for index, item in enumerate(items):
+        if item is None:
+            metrics.count_error('batch_timeout')
+            item = batch_item(index, error=f'Timeout after {deadline.timeout:g}s')
+        results.append(item)
+
+    payload = batch_response(results)
+    print(f"[BATCH] 完成: 成功 {payload['succeeded']}, 失败 {payload['failed']}, "
+          f"耗时 {time.time() - start_time:.2f}秒")
+    return payload
+
+
+# ---------- 翻译 ----------
+
+def read_translation(texts, response, elapsed):
+    """记录一次翻译调用的用量，返回{原文: 译文}"""
+    metrics.observe_upstream(TRANSLATE_MODEL, elapsed, getattr(response, 'usage', None))
+    content = response.content[0].text if response and response.content else None
+    return parse_translation(content, texts)
+
+
+def translation_result(recommendation, texts, chunks, outcomes):
+    """合并各文本块的翻译，outcomes为各块的{原文: 译文}或异常；全部失败时抛出第一个异常
+
+    返回(result, 是否完整)，result为{'recommendation', 'translated', 'total'}；部分失败的结果不应缓存
+    """
+    translations = {}
+    errors = []
+    for outcome in outcomes:
+        if isinstance(outcome, Exception):
+            print(f"✗ 翻译文本块失败: {outcome}")
+            errors.append(outcome)
+        else:
+            translations.update(outcome)
+    if errors and not translations:
+        raise errors[0]
+
+    result = {
+        'recommendation': apply_translations(recommendation, translations),
+        'translated': len(translations),
+        'total': len(texts)
+    }
+    print(f"[TRANSLATE] {len(chunks)}块, 已翻译 {len(translations)}/{len(texts)} 条文本")
+    return result, len(translations) == len(texts)
+
+
+# ---------- 任务 ----------
+
+def job_result(result):
+    """任务工作线程执行的推荐结果，返回与/api/recommend相同的响应内容"""
+    if not result['content']:
+        metrics.count_error('empty_response')
+        raise ValueError('Empty response from API')
+    return recommendation_response(result)
+
+
+# ---------- 健康检查和指标 ----------
+
+def health_report(service, recommendation_cache, translation_cache, recommendation_flight, admission,
+                  key_pool, prewarm_scheduler, job_workers):
+    """/api/health的返回内容"""
+    return health_payload(
+        service, recommendation_cache,
+        translation_cache=translation_cache.stats(),
+        canonicalization=field_canonicalizer.stats(),
+        single_flight=recommendation_flight.stats(),
+        hedging=hedge_policy.stats(),
+        admission=admission.stats(),
+        api_keys=key_pool.stats(),
+        retry=retry_policy.stats(),
+        prewarm=prewarm_scheduler.stats(),
+        jobs=job_workers.stats(),
+        shared_backend=shared_backend.stats() if shared_backend is not None else None,
+        latency=latency_tracker.stats()
+    )
+
+
+def metrics_report(recommendation_cache, admission, key_pool):
+    """/metrics的返回内容（Prometheus文本格式）"""
+    return metrics.render(recommendation_cache.stats(), admission.stats(), field_canonicalizer.stats(),
+                          key_pool.stats())
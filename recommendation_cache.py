@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推荐结果缓存 - TTL过期 + LRU淘汰，按字节数限制总容量
+相同的prompt、模型、温度和模板版本直接返回缓存结果，不再重复调用GLM
+支持stale-while-revalidate：超过软TTL、未超过硬TTL的条目仍可返回（标记为过期），同时在后台刷新
+可关联持久化存储(recommendation_store)，写入时同步保存到磁盘；第一次访问缓存时才打开数据库并预加载
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_cache_key(prompt, model, temperature, prompt_version, max_tokens=None):
+    """根据渲染后的prompt和调用参数生成规范化的缓存键（sha256）"""
+    # 统一换行符并去掉首尾空白，避免同一prompt因格式差异产生不同的键
+    normalized_prompt = prompt.replace('\r\n', '\n').strip()
+    payload = json.dumps({
+        'prompt': normalized_prompt,
+        'model': model,
+        'temperature': round(float(temperature), 3),
+        'max_tokens': max_tokens,
+        'prompt_version': prompt_version
+    }, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _sizeof(value):
+    """估算缓存值占用的字节数（按UTF-8编码后的长度）"""
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    return len(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+
+
+class RecommendationCache:
+    """线程安全的TTL + LRU缓存，总字节数超过上限时淘汰最久未使用的条目
+
+    ttl为软TTL（新鲜期），hard_ttl为硬TTL（可作为过期结果返回的期限），默认与ttl相同
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, ttl=3600, hard_ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hard_ttl = max(ttl, hard_ttl or ttl)
+        self._entries = OrderedDict()  # key -> (value, size, fresh_until, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_hits = 0
+        # 持久化存储：attach_store()只记录，第一次访问缓存时预加载完成后再关联
+        self.store = None
+        self._pending_store = None
+        self._store_lock = threading.Lock()
+
+    def attach_store(self, store):
+        """关联持久化存储，数据库在第一次访问缓存（或调用load_store()）时才打开"""
+        self._pending_store = store
+
+    def load_store(self):
+        """打开attach_store()关联的存储，把未过期的记录按写入顺序加载到缓存，返回加载条数"""
+        with self._store_lock:
+            store = self._pending_store
+            if store is None:
+                return 0
+            now = time.time()
+            loaded = 0
+            for key, value, fresh_until, expires_at in store.records():
+                size = _sizeof(value)
+                if size <= self.max_bytes:
+                    with self._lock:
+                        self._insert(key, value, size, fresh_until, expires_at)
+                    loaded += 1
+            # 预加载完成后再关联，加载的记录不会写回数据库
+            self.store = store
+            self._pending_store = None
+        print(f"[STORE] 从 {store.path} 预加载 {store.table} {loaded} 条 ({time.time() - now:.2f}秒)")
+        return loaded
+
+    def get(self, key, allow_expired=False):
+        """读取缓存，未命中或已过期返回None
+
+        过期条目会保留到被LRU淘汰或覆盖为止，allow_expired=True时仍可读取（用于降级返回）
+        """
+        if self._pending_store is not None:
+            self.load_store()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, size, fresh_until, _ = entry
+            expired = fresh_until <= time.time()
+            if expired and not allow_expired:
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            if expired:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+            return value
+
+    def lookup(self, key):
+        """stale-while-revalidate读取，返回(value, 'fresh'|'stale')，未命中或超过硬TTL返回(None, None)"""
+        if self._pending_store is not None:
+            self.load_store()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, None
+
+            value, _, fresh_until, expires_at = entry
+            now = time.time()
+            if expires_at <= now:
+                self.expirations += 1
+                self.misses += 1
+                return None, None
+
+            self._entries.move_to_end(key)
+            if fresh_until <= now:
+                self.stale_hits += 1
+                return value, 'stale'
+            self.hits += 1
+            return value, 'fresh'
+
+    def is_fresh(self, key):
+        """条目是否仍在软TTL内（不计入命中统计）"""
+        if self._pending_store is not None:
+            self.load_store()
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[2] > time.time()
+
+    def set(self, key, value, ttl=None, prompt_version=None, hard_ttl=None):
+        """写入缓存，单个条目超过容量上限时不缓存；prompt_version随记录保存到持久化存储"""
+        size = _sizeof(value)
+        if size > self.max_bytes:
+            return False
+        if self._pending_store is not None:
+            self.load_store()
+
+        now = time.time()
+        fresh_until = now + (self.ttl if ttl is None else ttl)
+        expires_at = max(fresh_until, now + (self.hard_ttl if hard_ttl is None else hard_ttl))
+        with self._lock:
+            self._insert(key, value, size, fresh_until, expires_at)
+
+        if self.store is not None:
+            self.store.put(key, value, fresh_until, expires_at, prompt_version)
+        return True
+
+    def delete(self, key):
+        if self._pending_store is not None:
+            self.load_store()
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+        if self.store is not None:
+            self.store.delete(key)
+
+    def describe(self):
+        """启动日志中的缓存配置说明"""
+        return f"软TTL {self.ttl}秒, 硬TTL {self.hard_ttl}秒, 上限 {self.max_bytes // 1024 // 1024}MB"
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """返回缓存统计信息（用于/api/health）"""
+        store = self.store if self.store is not None else self._pending_store
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hard_ttl': self.hard_ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'stale_hits': self.stale_hits,
+                'store': store.stats() if store is not None else None
+            }
+
+    def _insert(self, key, value, size, fresh_until, expires_at):
+        # 调用方需持有锁；超过字节上限时从最久未使用的一端开始淘汰
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (value, size, fresh_until, expires_at)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def _remove(self, key):
+        # 调用方需持有锁
+        size = self._entries.pop(key)[1]
+        self._bytes -= size
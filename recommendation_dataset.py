@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+离线推荐数据集 - bulk_generate.py批量生成，静态服务器直接查询，无需调用GLM
+
+同一节气区间内的日期（节气描述和季节相同）共用一条推荐，数据集键由规范化后的
+节气、季节、餐次、饮食类型、健康目标、地点、天气和语言计算，不含具体日期和时间
+
+目录结构:
+    index.json       数据集索引（生成参数、日期 -> 节气分组、各分片条数）
+    shards/<xx>.json 按键前两位分片，每个分片为 {键: 记录}
+    checkpoint.jsonl 生成进度，每完成一条追加一行，中断后从这里继续
+"""
+
+import os
+import json
+import hashlib
+import threading
+from datetime import date
+
+from canonicalize import FieldCanonicalizer
+from prompt_templates import language_name
+from solar_terms import season_name, solar_term_description
+
+DATASET_DIR = os.environ.get(
+    'DATASET_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dataset')
+)
+
+INDEX_FILE = 'index.json'
+SHARDS_DIR = 'shards'
+CHECKPOINT_FILE = 'checkpoint.jsonl'
+
+# 数据集格式版本，键的计算方式变化时修改
+DATASET_VERSION = 1
+
+# 参与键计算的字段（日期和时间不参与：同一节气分组、同一餐次共用推荐）
+KEY_FIELDS = ['solarTerm', 'season', 'mealPeriod', 'dietType', 'healthGoal', 'location', 'weather']
+
+_canonicalizer = FieldCanonicalizer()
+
+
+def group_fields(fields):
+    """返回用于计算数据集键的规范化字段；缺少节气或季节时按日期推算；
+    文本参数不是字符串时抛出ValueError"""
+    fields = dict(fields)
+    if fields.get('date') and not (fields.get('solarTerm') and fields.get('season')):
+        if not isinstance(fields['date'], str):
+            raise ValueError('date must be a string')
+        try:
+            day = date.fromisoformat(fields['date'])
+        except ValueError:
+            day = None
+        if day is not None:
+            fields.setdefault('solarTerm', solar_term_description(day))
+            fields.setdefault('season', season_name(day))
+    canonical = _canonicalizer.canonicalize(fields)
+    grouped = {name: canonical.get(name) for name in KEY_FIELDS}
+    grouped['language'] = language_name(fields.get('language'))
+    return grouped
+
+
+def dataset_key(fields):
+    """数据集键（sha1），fields格式同/api/recommend的结构化参数"""
+    payload = json.dumps(group_fields(fields), ensure_ascii=False, sort_keys=True,
+                         separators=(',', ':'))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def shard_name(key):
+    return key[:2]
+
+
+def write_json_atomic(path, data):
+    """先写临时文件再替换，读取方不会看到写了一半的文件"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+class RecommendationDataset:
+    """只读访问数据集：索引和分片在首次查询时加载，index.json更新后自动重新加载"""
+
+    def __init__(self, directory=DATASET_DIR):
+        self.directory = directory
+        self.index = None
+        self.hits = 0
+        self.misses = 0
+        self._index_mtime = None
+        self._shards = {}
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        path = os.path.join(self.directory, INDEX_FILE)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            self.index = None
+            self._shards = {}
+            return False
+        if mtime != self._index_mtime:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+            self._index_mtime = mtime
+            self._shards = {}
+            print(f"[DATASET] 已加载数据集索引: {self.index.get('total', 0)} 条推荐")
+        return True
+
+    def _shard(self, name):
+        shard = self._shards.get(name)
+        if shard is None:
+            path = os.path.join(self.directory, SHARDS_DIR, f'{name}.json')
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    shard = json.load(f)
+            except OSError:
+                shard = {}
+            self._shards[name] = shard
+        return shard
+
+    def lookup(self, fields):
+        """按结构化参数查询，返回记录（content、model、fields等）或None；参数类型不合法时抛出ValueError"""
+        key = dataset_key(fields)
+        with self._lock:
+            if not self._refresh():
+                return None
+            record = self._shard(shard_name(key)).get(key)
+            if record is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return record
+
+    def stats(self):
+        with self._lock:
+            return {
+                'directory': self.directory,
+                'available': self.index is not None,
+                'total': self.index.get('total', 0) if self.index else 0,
+                'loaded_shards': len(self._shards),
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推荐结果解析 - app.js中parseRecommendation的Python版本
+单次扫描模型输出，提取```json代码块中的对象，没有代码块时提取最外层对象；
+输出因max_tokens被截断时，补全未闭合的数组和对象，保留已完整生成的菜品
+"""
+
+import re
+import json
+
+# 字符串外需要关注的结构字符
+_STRUCTURAL = re.compile(r'[{}\[\],"]')
+# 字符串内需要关注的字符（结束引号和转义符）
+_STRING_SPECIAL = re.compile(r'["\\]')
+# 代码块标记：输出中有```json时使用代码块中的对象（与app.js一致）
+_FENCE = '```json'
+
+# 截断补全时保留的候选截断点数量
+_MAX_CHECKPOINTS = 16
+
+
+class RecommendationJSONScanner:
+    """增量JSON扫描器，可逐段feed流式输出，结束时调用finish()得到解析结果
+
+    输出中出现```json时从代码块中的第一个{开始扫描，否则从第一个{开始；
+    代码块出现在已扫描的对象之后时（对象前后还有说明文字）改用代码块中的对象。
+    每段文本只扫描一次，位置按整个输出计算，文本段在finish()时才拼接。
+
+    扫描过程中记录"安全截断点"：逗号之前、数组开始之后、容器闭合之后。
+    只在没有处于数组元素对象内部时记录，截断时不会留下半个菜品。
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._length = 0
+        self._fenced = False
+        self._tail = ''           # 上一段末尾，用于查找跨段的代码块标记
+        self._reset()
+
+    def _reset(self):
+        self._start = -1
+        self._end = -1
+        self._stack = []          # 未闭合容器对应的闭合字符
+        self._in_string = False
+        self._escaped = False     # 上一段以字符串中的转义符结尾
+        self._checkpoints = []    # (截断位置, 需要补上的闭合字符)
+
+    @property
+    def complete(self):
+        """是否已扫描到最外层对象的结尾"""
+        return self._end != -1
+
+    def feed(self, chunk):
+        """追加一段文本并继续扫描，返回是否已找到完整对象"""
+        if chunk:
+            base = self._length
+            self._chunks.append(chunk)
+            self._length += len(chunk)
+            self._scan(chunk, base)
+        return self._end != -1
+
+    def finish(self):
+        """返回(解析出的对象, 是否为截断补全结果)，无法解析时返回(None, False)"""
+        if self._start == -1:
+            return None, False
+
+        text = ''.join(self._chunks)
+        self._chunks = [text]
+        if self._end != -1:
+            try:
+                return json.loads(text[self._start:self._end]), False
+            except json.JSONDecodeError:
+                return None, False
+
+        for index, closers in reversed(self._checkpoints):
+            try:
+                return json.loads(text[self._start:index] + closers), True
+            except json.JSONDecodeError:
+                continue
+        return None, False
+
+    def finish_recommendation(self):
+        """finish()并校验推荐结构，返回值同parse_recommendation"""
+        return _finish_recommendation(*self.finish())
+
+    def _scan(self, text, base):
+        """扫描新的一段文本，base为其在整个输出中的起始位置"""
+        if not self._fenced:
+            window = self._tail + text
+            fence = window.find(_FENCE)
+            if fence != -1:
+                # 从代码块标记之后重新开始（丢弃代码块之前的对象）
+                self._fenced = True
+                self._reset()
+                text = window[fence + len(_FENCE):]
+                base += fence + len(_FENCE) - len(self._tail)
+            else:
+                self._tail = window[-(len(_FENCE) - 1):]
+        if self._end != -1:
+            return
+
+        pos = 0
+        stack = self._stack
+        if self._start == -1:
+            pos = text.find('{')
+            if pos == -1:
+                return
+            self._start = base + pos
+        elif self._escaped:
+            self._escaped = False
+            pos = 1
+
+        while pos < len(text):
+            if self._in_string:
+                match = _STRING_SPECIAL.search(text, pos)
+                if match is None:
+                    return
+                if match.group() == '\\':
+                    if match.end() >= len(text):
+                        # 转义符落在当前文本末尾，跳过下一段的第一个字符
+                        self._escaped = True
+                        return
+                    pos = match.end() + 1
+                    continue
+                self._in_string = False
+                pos = match.end()
+                continue
+
+            match = _STRUCTURAL.search(text, pos)
+            if match is None:
+                return
+
+            char = match.group()
+            pos = match.end()
+            if char == '"':
+                self._in_string = True
+            elif char == '{' or char == '[':
+                stack.append('}' if char == '{' else ']')
+                if char == '[' or len(stack) == 1:
+                    self._checkpoint(base + pos)
+            elif char == '}' or char == ']':
+                if stack:
+                    stack.pop()
+                if not stack:
+                    self._end = base + pos
+                    return
+                self._checkpoint(base + pos)
+            else:  # ','
+                self._checkpoint(base + match.start())
+
+    def _checkpoint(self, index):
+        # 数组中的对象尚未闭合时不记录，避免补全出残缺的菜品
+        in_array = False
+        for closer in self._stack:
+            if closer == ']':
+                in_array = True
+            elif in_array:
+                return
+
+        self._checkpoints.append((index, ''.join(reversed(self._stack))))
+        if len(self._checkpoints) > _MAX_CHECKPOINTS:
+            del self._checkpoints[0]
+
+
+def normalize_recommendation(recommendation):
+    """校验dishes/teas字段并统一为items（与app.js一致），不合法时返回None"""
+    if not isinstance(recommendation, dict):
+        return None
+
+    dishes = recommendation.get('dishes')
+    teas = recommendation.get('teas')
+    if isinstance(dishes, list):
+        recommendation['items'] = dishes
+    elif isinstance(teas, list):
+        recommendation['items'] = teas
+    else:
+        return None
+    return recommendation
+
+
+def parse_recommendation(content):
+    """解析模型输出，返回(推荐结果, 是否为截断补全结果)，解析失败返回(None, False)"""
+    scanner = RecommendationJSONScanner()
+    scanner.feed(content)
+    recommendation, truncated = scanner.finish()
+    return _finish_recommendation(recommendation, truncated)
+
+
+def _finish_recommendation(recommendation, truncated):
+    recommendation = normalize_recommendation(recommendation)
+    # 截断补全后一道完整菜品都没有时视为解析失败
+    if recommendation is None or (truncated and not recommendation['items']):
+        return None, False
+    return recommendation, truncated
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推荐结果持久化 - SQLite存储，服务重启后缓存内容不丢失
+每条记录按缓存键（参数哈希）保存，同时记录prompt模板版本和软/硬过期时间；值为zlib压缩的紧凑JSON
+写入由后台线程批量提交，不阻塞请求；同一线程定期清理过期记录
+数据库在第一次使用时才打开（导入模块和创建对象时不访问磁盘），未过期的记录由内存缓存在第一次访问时预加载
+"""
+
+import os
+import json
+import time
+import zlib
+import queue
+import atexit
+import sqlite3
+import threading
+
+# 运行时数据目录（持久化存储等），默认在项目目录下的data/
+DATA_DIR = os.environ.get('DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+RECOMMEND_STORE_PATH = os.environ.get('RECOMMEND_STORE_PATH', os.path.join(DATA_DIR, 'recommendation_store.db'))
+RECOMMEND_STORE_COMPACT_INTERVAL = float(os.environ.get('RECOMMEND_STORE_COMPACT_INTERVAL', 600))
+
+# 每次提交最多合并的写入条数
+_WRITE_BATCH = 200
+_STOP = object()
+
+
+def encode_value(value):
+    """缓存值 -> 压缩字节（字符串和dict统一按紧凑JSON编码）"""
+    raw = json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return zlib.compress(raw, 6)
+
+
+def decode_value(blob):
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+
+class RecommendationStore:
+    """SQLite持久化存储，一个数据库文件可按table区分推荐结果和翻译结果"""
+
+    def __init__(self, path=RECOMMEND_STORE_PATH, table='recommendations',
+                 compact_interval=RECOMMEND_STORE_COMPACT_INTERVAL):
+        self.path = path
+        self.table = table
+        self.compact_interval = compact_interval
+        self.writes = 0
+        self.compacted = 0
+        self.loaded = 0
+        self._queue = queue.Queue()
+        self._conn = None
+        self._thread = None
+        self._open_lock = threading.Lock()
+
+    def _connect(self):
+        """第一次使用时打开数据库（不存在时创建目录和表）"""
+        with self._open_lock:
+            if self._conn is not None:
+                return self._conn
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    key TEXT PRIMARY KEY,
+                    prompt_version TEXT,
+                    value BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    fresh_until REAL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            columns = [row[1] for row in conn.execute(f'PRAGMA table_info({self.table})')]
+            if 'fresh_until' not in columns:
+                # 早期版本的数据库没有软TTL，旧记录视为在硬TTL前一直新鲜
+                conn.execute(f'ALTER TABLE {self.table} ADD COLUMN fresh_until REAL')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_expires ON {self.table} (expires_at)')
+            conn.commit()
+            self._conn = conn
+            return conn
+
+    def _start_writer(self):
+        """第一次写入时启动后台写入线程"""
+        if self._thread is not None:
+            return
+        self._connect()
+        with self._open_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f'store-{self.table}', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def put(self, key, value, fresh_until, expires_at, prompt_version=None):
+        """异步写入一条记录（由后台线程提交）"""
+        self._start_writer()
+        self._queue.put(('put', key, value, fresh_until, expires_at, prompt_version))
+
+    def delete(self, key):
+        self._start_writer()
+        self._queue.put(('delete', key))
+
+    def records(self):
+        """按写入顺序返回未过期的记录列表[(key, value, fresh_until, expires_at)]，无法解码的记录跳过"""
+        rows = self._connect().execute(
+            f'SELECT key, value, fresh_until, expires_at FROM {self.table} '
+            f'WHERE expires_at > ? ORDER BY created_at',
+            (time.time(),)
+        ).fetchall()
+        records = []
+        for key, blob, fresh_until, expires_at in rows:
+            try:
+                value = decode_value(blob)
+            except (zlib.error, ValueError):
+                continue
+            records.append((key, value, expires_at if fresh_until is None else fresh_until, expires_at))
+        self.loaded += len(records)
+        return records
+
+    def _compact(self):
+        """删除过期记录，返回删除条数"""
+        cursor = self._conn.execute(f'DELETE FROM {self.table} WHERE expires_at <= ?', (time.time(),))
+        self._conn.commit()
+        if cursor.rowcount:
+            self._conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.compacted += cursor.rowcount
+        return cursor.rowcount
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'loaded': self.loaded,
+            'writes': self.writes,
+            'pending': self._queue.qsize(),
+            'compacted': self.compacted
+        }
+
+    def close(self):
+        """提交剩余的写入并停止后台线程"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout=10)
+
+    def _run(self):
+        # 数据库连接只在本线程中写入（records()在缓存关联存储前的预加载阶段调用）
+        next_compact = time.time() + self.compact_interval
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=max(0.1, next_compact - time.time())))
+                while len(batch) < _WRITE_BATCH:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if _STOP in batch:
+                batch = batch[:batch.index(_STOP)]
+                stopping = True
+
+            try:
+                if batch:
+                    self._write(batch)
+                if time.time() >= next_compact:
+                    removed = self._compact()
+                    if removed:
+                        print(f"[STORE] {self.table}: 清理过期记录 {removed} 条")
+                    next_compact = time.time() + self.compact_interval
+            except sqlite3.Error as e:
+                print(f"✗ 持久化存储写入失败: {e}")
+        self._conn.close()
+
+    def _write(self, batch):
+        now = time.time()
+        for op in batch:
+            if op[0] == 'put':
+                _, key, value, fresh_until, expires_at, prompt_version = op
+                self._conn.execute(
+                    f'INSERT OR REPLACE INTO {self.table} '
+                    f'(key, prompt_version, value, created_at, fresh_until, expires_at) '
+                    f'VALUES (?, ?, ?, ?, ?, ?)',
+                    (key, prompt_version, encode_value(value), now, fresh_until, expires_at)
+                )
+            else:
+                self._conn.execute(f'DELETE FROM {self.table} WHERE key = ?', (op[1],))
+        self._conn.commit()
+        self.writes += len(batch)
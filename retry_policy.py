@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上游调用重试 - 连接中断、超时、429和5xx等临时错误按带抖动的指数退避重试，
+上游返回Retry-After时至少等待该时长；客户端可以用X-Request-Timeout请求头给出截止时间（秒），
+剩余时间不足以等待并完成一次调用时不再重试，避免请求在浏览器已经放弃后仍然占用上游配额
+"""
+
+import os
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+
+import anthropic
+
+RETRY_MAX_ATTEMPTS = int(os.environ.get('RETRY_MAX_ATTEMPTS', 3))
+RETRY_BASE_DELAY = float(os.environ.get('RETRY_BASE_DELAY', 0.5))
+RETRY_MAX_DELAY = float(os.environ.get('RETRY_MAX_DELAY', 10))
+
+# 截止时间：客户端未指定时使用默认值（略短于前端的120秒超时），客户端指定的值不超过上限
+DEADLINE_HEADER = 'X-Request-Timeout'
+REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', 110))
+REQUEST_DEADLINE_MAX = float(os.environ.get('REQUEST_DEADLINE_MAX', 600))
+
+
+class DeadlineExceeded(Exception):
+    """请求的截止时间已过，不再调用上游（返回504）"""
+
+
+class Deadline:
+    """请求的截止时间（单调时钟）"""
+
+    def __init__(self, seconds):
+        self.timeout = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def from_headers(cls, headers):
+        """按请求头创建截止时间，请求头缺失或无效时使用REQUEST_DEADLINE"""
+        try:
+            seconds = float(headers.get(DEADLINE_HEADER) or REQUEST_DEADLINE)
+        except ValueError:
+            seconds = REQUEST_DEADLINE
+        if not seconds > 0:
+            seconds = REQUEST_DEADLINE
+        return cls(min(seconds, REQUEST_DEADLINE_MAX))
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+
+def is_retryable(error):
+    """可以重试的临时错误：连接失败/超时、408、409、429和5xx（与SDK自带重试的判断一致）"""
+    if isinstance(error, anthropic.APIConnectionError):
+        return True
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def retry_after_seconds(error, default=None):
+    """从上游错误响应的retry-after-ms / Retry-After头读取建议的等待秒数，没有时返回default"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return default
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return default
+
+
+class RetryPolicy:
+    """重试策略
+
+    estimate(model)返回该模型一次调用的预计耗时（秒，未知时为None），
+    等待时间加预计耗时超过截止时间的剩余时间时放弃重试
+    """
+
+    def __init__(self, estimate=None, max_attempts=RETRY_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY,
+                 max_delay=RETRY_MAX_DELAY):
+        self.estimate = estimate
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self.exhausted = 0
+        self.deadline_skipped = 0
+        self._lock = threading.Lock()
+
+    def backoff(self, attempt, error=None):
+        """第attempt次调用失败后的等待时间：全抖动指数退避，不短于上游给出的Retry-After"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        return max(delay, retry_after_seconds(error, 0.0))
+
+    def next_delay(self, error, attempt, deadline=None, model=None, immediate=False):
+        """第attempt次调用失败后，返回重试前的等待秒数；不应重试时返回None
+
+        immediate为True表示可以立即换一个API Key重试，不需要退避
+        """
+        if attempt >= self.max_attempts:
+            with self._lock:
+                self.exhausted += 1
+            return None
+        delay = 0.0 if immediate else self.backoff(attempt, error)
+        if deadline is not None:
+            estimate = (self.estimate(model) if self.estimate and model else None) or 0.0
+            if delay + estimate >= deadline.remaining():
+                with self._lock:
+                    self.deadline_skipped += 1
+                print(f"[RETRY] 剩余 {deadline.remaining():.1f}秒 不足以完成重试 "
+                      f"(等待 {delay:.1f}秒 + 预计 {estimate:.1f}秒)，放弃")
+                return None
+        with self._lock:
+            self.retries += 1
+        if immediate:
+            print(f"[RETRY] 第{attempt}次调用失败({type(error).__name__})，换一个API Key重试")
+        else:
+            print(f"[RETRY] 第{attempt}次调用失败({type(error).__name__})，{delay:.1f}秒后重试")
+        return delay
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_attempts': self.max_attempts,
+                'retries': self.retries,
+                'exhausted': self.exhausted,
+                'deadline_skipped': self.deadline_skipped
+            }
@@ -5,16 +5,15 @@ Food Recommendation App - Server with Environment Variable Support
 支持从环境变量读取API Key的HTTP服务器
 """
 
-import http.server
-import socketserver
 import webbrowser
 import os
 import sys
-import json
 from urllib.parse import urlparse, parse_qs
 from pathlib import Path
 import _thread as thread
 
+from static_server import StaticFileHandler, create_server
+
 # 设置Windows控制台编码
 if sys.platform == 'win32':
     try:
@@ -39,20 +38,8 @@ if env_file.exists():
                 os.environ[key.strip()] = value.strip()
                 print(f"[OK] {key} = {value[:10]}...{value[-4:]}")
 
-class APIKeyHandler(http.server.SimpleHTTPRequestHandler):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, directory=DIRECTORY, **kwargs)
-
-    def end_headers(self):
-        # Enable CORS
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        super().end_headers()
-
-    def do_OPTIONS(self):
-        self.send_response(200)
-        self.end_headers()
+class APIKeyHandler(StaticFileHandler):
+    directory = DIRECTORY
 
     def do_GET(self):
         parsed_path = urlparse(self.path)
@@ -61,18 +48,10 @@ class APIKeyHandler(http.server.SimpleHTTPRequestHandler):
         if parsed_path.path == '/api/env-api-key':
             api_key = os.environ.get('ZHIPU_API_KEY', '')
             if api_key:
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json; charset=utf-8')
-                self.end_headers()
-                response = json.dumps({'apiKey': api_key}, ensure_ascii=False)
-                self.wfile.write(response.encode('utf-8'))
+                self.send_json(200, {'apiKey': api_key})
                 print('[SUCCESS] API Key已从环境变量读取并发送给客户端')
             else:
-                self.send_response(404)
-                self.send_header('Content-Type', 'application/json; charset=utf-8')
-                self.end_headers()
-                response = json.dumps({'error': 'ZHIPU_API_KEY环境变量未设置'}, ensure_ascii=False)
-                self.wfile.write(response.encode('utf-8'))
+                self.send_json(404, {'error': 'ZHIPU_API_KEY环境变量未设置'})
                 print('[WARNING] ZHIPU_API_KEY环境变量未设置')
         else:
             # Serve static files
@@ -105,7 +84,8 @@ def start_server():
         print("   export ZHIPU_API_KEY=\"your-api-key-here\"")
         print("=" * 60)
 
-    with socketserver.TCPServer(("", PORT), APIKeyHandler) as httpd:
+    # 线程池并发处理连接
+    with create_server(("", PORT), APIKeyHandler) as httpd:
         print()
         print("[INFO] 服务器启动成功!")
         print("=" * 60)
@@ -0,0 +1,628 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共享后端 - 多个api_server进程部署在负载均衡后时，共用同一份推荐缓存、请求合并锁和上游调用速率预算
+
+SharedBackend定义后端接口（键值读写、互斥锁、计数器、令牌桶、延时队列），有两种实现：
+- LocalBackend: 进程内实现，单进程部署或测试时使用
+- RedisBackend: Redis协议实现，client可以是redis-py的Redis、fakeredis的FakeRedis，
+  未安装redis包时使用本模块的RespClient（仅实现用到的少量命令）；
+  释放锁、计数和令牌桶的补充与预订都用一条EVAL（Lua脚本）完成，进程在两条命令之间退出也不会留下不一致的状态
+
+在此之上：
+- SharedRecommendationCache: 与RecommendationCache接口相同的共享缓存
+- SharedTokenBucket: 与admission.TokenBucket接口相同的全局令牌桶（令牌数和补充时间保存在后端，每次预订一次往返）
+- 请求合并锁见single_flight.SingleFlight的lock_backend参数，共享任务队列见jobs.SharedJobStore
+- AsyncCache: 异步服务器使用的缓存包装，共享缓存的读写在线程池中执行，不阻塞事件循环
+
+SHARED_BACKEND_URL为空时（默认）各进程使用原有的进程内缓存、合并和限速
+"""
+
+import os
+import time
+import uuid
+import socket
+import asyncio
+import threading
+from urllib.parse import urlparse
+
+from recommendation_store import decode_value, encode_value
+
+SHARED_BACKEND_URL = os.environ.get('SHARED_BACKEND_URL', '')
+# 所有键的前缀，多个应用共用一个Redis时区分
+SHARED_KEY_PREFIX = os.environ.get('SHARED_KEY_PREFIX', 'food:')
+# 请求合并锁的过期时间，需长于上游调用超时（120秒），持有锁的进程退出后自动释放
+SHARED_LOCK_TTL = float(os.environ.get('SHARED_LOCK_TTL', 150))
+# 等待其他进程释放合并锁时的轮询间隔（秒）
+SHARED_LOCK_POLL = float(os.environ.get('SHARED_LOCK_POLL', 0.2))
+
+# 令牌桶最多向后预订的秒数，需要等待更久时不预订
+_MAX_RESERVE_AHEAD = 60
+
+# 比较令牌后删除锁：锁已过期并被其他进程获取时不删除
+UNLOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# 计数器加一，新建时设置过期时间（ARGV[1]毫秒）
+INCR_SCRIPT = """
+local value = redis.call('INCR', KEYS[1])
+if value == 1 then
+    redis.call('PEXPIRE', KEYS[1], ARGV[1])
+end
+return value
+"""
+
+# 令牌桶：KEYS[1]为保存tokens和updated的hash，ARGV为rate（每秒令牌数）、burst、now（秒）、
+# cost（预订为1，归还为-1）和max_wait（秒）；先按经过的时间补充令牌（不超过burst），
+# 需要等待的时间不超过max_wait时扣除令牌（可以为负，即预订之后的令牌）。
+# 返回{是否扣除, 需要等待的毫秒数}；桶补满之后键自动过期，再次访问时按满桶处理
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+if now > updated then
+    tokens = math.min(burst, tokens + (now - updated) * rate)
+    updated = now
+end
+local wait = math.max(0, (cost - tokens) / rate)
+if cost > 0 and wait > tonumber(ARGV[5]) then
+    return {0, math.ceil(wait * 1000)}
+end
+tokens = math.min(burst, tokens - cost)
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(updated))
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+return {1, math.ceil(wait * 1000)}
+"""
+# 延时队列领取：KEYS[1]为排队的有序集合（score为可以领取的时间），KEYS[2]为执行中的有序集合
+# （score为领取时间）；先重新领取KEYS[2]中早于ARGV[2]的成员（领取的节点已退出），
+# 否则取出KEYS[1]中score不大于ARGV[1]的第一个成员；领取的成员以ARGV[1]为score加入KEYS[2]
+QUEUE_CLAIM_SCRIPT = """
+local members = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', '(' .. ARGV[2], 'LIMIT', 0, 1)
+if #members == 0 then
+    members = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 1)
+    if #members == 0 then
+        return false
+    end
+    redis.call('ZREM', KEYS[1], members[1])
+end
+redis.call('ZADD', KEYS[2], ARGV[1], members[1])
+return members[1]
+"""
+
+
+class SharedBackend:
+    """共享后端接口，值为bytes，ttl单位为秒"""
+
+    # 读写是否为阻塞的网络请求：为真时异步服务器在线程池中调用（见call_blocking）
+    blocking = True
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def try_lock(self, key, ttl):
+        """尝试获取互斥锁，成功时返回令牌（用于释放），已被占用时返回None"""
+        raise NotImplementedError
+
+    def unlock(self, key, token):
+        """释放由token持有的锁（锁已过期并被他人获取时不释放）"""
+        raise NotImplementedError
+
+    def incr(self, key, ttl):
+        """计数器加一并返回新值，新建的计数器ttl秒后过期"""
+        raise NotImplementedError
+
+    def take_tokens(self, key, rate, burst, cost, max_wait, now):
+        """令牌桶（见TOKEN_BUCKET_SCRIPT）：按now补充令牌后扣除cost个，返回(是否扣除, 需要等待的秒数)；
+        需要等待超过max_wait秒时不扣除。cost为负时归还令牌"""
+        raise NotImplementedError
+
+    def decr(self, key):
+        raise NotImplementedError
+
+    def queue_push(self, key, member, score):
+        """把member加入有序队列key（score为可以领取的时间），已存在时更新score"""
+        raise NotImplementedError
+
+    def queue_claim(self, key, running_key, now, stale_before):
+        """领取一个成员（见QUEUE_CLAIM_SCRIPT）并返回，没有可领取的成员时返回None"""
+        raise NotImplementedError
+
+    def queue_remove(self, key, member):
+        raise NotImplementedError
+
+    def queue_size(self, key):
+        raise NotImplementedError
+
+    def stats(self):
+        return {'backend': type(self).__name__}
+
+
+class LocalBackend(SharedBackend):
+    """进程内实现"""
+
+    blocking = False
+
+    def __init__(self):
+        self._data = {}  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        # 调用方需持有锁
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.time():
+            del self._data[key]
+            return None
+        return entry[0]
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def try_lock(self, key, ttl):
+        token = uuid.uuid4().hex
+        with self._lock:
+            if self._get(key) is not None:
+                return None
+            self._data[key] = (token, time.time() + ttl)
+        return token
+
+    def unlock(self, key, token):
+        with self._lock:
+            if self._get(key) == token:
+                del self._data[key]
+
+    def incr(self, key, ttl):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= time.time():
+                entry = (0, time.time() + ttl)
+            value = entry[0] + 1
+            self._data[key] = (value, entry[1])
+            return value
+
+    def take_tokens(self, key, rate, burst, cost, max_wait, now):
+        with self._lock:
+            entry = self._get(key)
+            tokens, updated = entry if entry is not None else (burst, now)
+            if now > updated:
+                tokens = min(burst, tokens + (now - updated) * rate)
+                updated = now
+            wait = max(0.0, (cost - tokens) / rate)
+            if cost > 0 and wait > max_wait:
+                return False, wait
+            tokens = min(burst, tokens - cost)
+            self._data[key] = ((tokens, updated), time.time() + (burst - tokens) / rate + 1)
+            return True, wait
+
+    def decr(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data[key] = (entry[0] - 1, entry[1])
+
+    def _queue(self, key):
+        # 调用方需持有锁；队列不过期
+        entry = self._data.get(key)
+        if entry is None:
+            entry = self._data[key] = ({}, float('inf'))
+        return entry[0]
+
+    def queue_push(self, key, member, score):
+        with self._lock:
+            self._queue(key)[member] = score
+
+    def queue_claim(self, key, running_key, now, stale_before):
+        with self._lock:
+            queue, running = self._queue(key), self._queue(running_key)
+            stale = [m for m, score in running.items() if score < stale_before]
+            if stale:
+                member = min(stale, key=running.get)
+            else:
+                ready = [m for m, score in queue.items() if score <= now]
+                if not ready:
+                    return None
+                member = min(ready, key=queue.get)
+                del queue[member]
+            running[member] = now
+            return member
+
+    def queue_remove(self, key, member):
+        with self._lock:
+            self._queue(key).pop(member, None)
+
+    def queue_size(self, key):
+        with self._lock:
+            return len(self._queue(key))
+
+    def stats(self):
+        with self._lock:
+            return {'backend': type(self).__name__, 'keys': len(self._data)}
+
+
+class RedisBackend(SharedBackend):
+    """Redis协议实现，client需提供get、set(px, nx)、delete、decr、zadd、zrem、zcard、eval（与redis-py相同）"""
+
+    def __init__(self, client, prefix=SHARED_KEY_PREFIX):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, value, px=max(1, int(ttl * 1000)))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def try_lock(self, key, ttl):
+        token = uuid.uuid4().hex
+        if self.client.set(self.prefix + key, token, px=max(1, int(ttl * 1000)), nx=True):
+            return token
+        return None
+
+    def unlock(self, key, token):
+        self.client.eval(UNLOCK_SCRIPT, 1, self.prefix + key, token)
+
+    def incr(self, key, ttl):
+        return int(self.client.eval(INCR_SCRIPT, 1, self.prefix + key, max(1, int(ttl * 1000))))
+
+    def take_tokens(self, key, rate, burst, cost, max_wait, now):
+        taken, wait_ms = self.client.eval(TOKEN_BUCKET_SCRIPT, 1, self.prefix + key,
+                                          repr(rate), repr(burst), f'{now:.6f}', cost, repr(max_wait))
+        return bool(taken), int(wait_ms) / 1000
+
+    def decr(self, key):
+        self.client.decr(self.prefix + key)
+
+    def queue_push(self, key, member, score):
+        self.client.zadd(self.prefix + key, {member: score})
+
+    def queue_claim(self, key, running_key, now, stale_before):
+        member = self.client.eval(QUEUE_CLAIM_SCRIPT, 2, self.prefix + key, self.prefix + running_key,
+                                  f'{now:.6f}', f'{stale_before:.6f}')
+        return member.decode('utf-8') if member is not None else None
+
+    def queue_remove(self, key, member):
+        self.client.zrem(self.prefix + key, member)
+
+    def queue_size(self, key):
+        return int(self.client.zcard(self.prefix + key))
+
+    def stats(self):
+        return {'backend': type(self).__name__, 'client': type(self.client).__name__,
+                'prefix': self.prefix}
+
+
+class RespError(Exception):
+    """Redis返回的错误"""
+
+
+# 共享后端不可用时的异常：调用方按未命中/不加锁处理，不影响正常生成
+BACKEND_ERRORS = (OSError, ConnectionError, RespError)
+try:
+    from redis import RedisError
+    BACKEND_ERRORS += (RedisError,)
+except ImportError:
+    pass
+
+
+class RespClient:
+    """最小的Redis协议(RESP)客户端，只实现RedisBackend用到的命令；每个线程一个连接"""
+
+    def __init__(self, host='localhost', port=6379, db=0, password=None, timeout=5):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @classmethod
+    def from_url(cls, url):
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip('/') or 0)
+        return cls(parsed.hostname or 'localhost', parsed.port or 6379, db, parsed.password)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            conn = (sock, sock.makefile('rb'))
+            self._local.conn = conn
+            if self.password:
+                self._call(conn, 'AUTH', self.password)
+            if self.db:
+                self._call(conn, 'SELECT', self.db)
+        return conn
+
+    def execute(self, *args):
+        conn = self._connection()
+        try:
+            return self._call(conn, *args)
+        except (OSError, ConnectionError):
+            # 连接断开时丢弃，下次调用重新连接
+            self._local.conn = None
+            conn[0].close()
+            raise
+
+    def _call(self, conn, *args):
+        sock, reader = conn
+        parts = [f'*{len(args)}\r\n'.encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        sock.sendall(b''.join(parts))
+        return self._read(reader)
+
+    def _read(self, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError('Redis连接已关闭')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode('utf-8')
+        if kind == b'-':
+            raise RespError(rest.decode('utf-8'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(rest)
+            if length < 0:
+                return None
+            return [self._read(reader) for _ in range(length)]
+        raise RespError(f'无法解析的响应: {line!r}')
+
+    def get(self, key):
+        return self.execute('GET', key)
+
+    def set(self, key, value, px=None, nx=False):
+        args = ['SET', key, value]
+        if px is not None:
+            args += ['PX', px]
+        if nx:
+            args.append('NX')
+        return self.execute(*args) == 'OK'
+
+    def delete(self, key):
+        return self.execute('DEL', key)
+
+    def decr(self, key):
+        return self.execute('DECR', key)
+
+    def zadd(self, key, mapping):
+        args = ['ZADD', key]
+        for member, score in mapping.items():
+            args += [repr(score), member]
+        return self.execute(*args)
+
+    def zrem(self, key, *members):
+        return self.execute('ZREM', key, *members)
+
+    def zcard(self, key):
+        return self.execute('ZCARD', key)
+
+    def eval(self, script, numkeys, *keys_and_args):
+        return self.execute('EVAL', script, numkeys, *keys_and_args)
+
+
+def create_shared_backend(url=SHARED_BACKEND_URL):
+    """按SHARED_BACKEND_URL创建共享后端：为空时返回None（使用进程内组件），
+    local://使用LocalBackend，redis://host:port/db使用RedisBackend"""
+    if not url:
+        return None
+    if url.startswith('local://'):
+        return LocalBackend()
+    try:
+        import redis
+        client = redis.Redis.from_url(url)
+    except ImportError:
+        client = RespClient.from_url(url)
+    print(f"[SHARED] 使用共享后端: {urlparse(url).hostname}:{urlparse(url).port or 6379} "
+          f"({type(client).__module__}.{type(client).__name__})")
+    return RedisBackend(client)
+
+
+class SharedRecommendationCache:
+    """保存在共享后端中的推荐缓存，接口与RecommendationCache相同
+
+    条目在硬TTL后由后端自动删除；容量由后端管理（如Redis的maxmemory策略），
+    命中统计只记录本进程的访问
+    """
+
+    def __init__(self, backend, namespace, ttl=3600, hard_ttl=None):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+        self.hard_ttl = max(ttl, hard_ttl or ttl)
+        self.blocking = backend.blocking
+        self.store = None
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.writes = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def _key(self, key):
+        return f'{self.namespace}:{key}'
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _read(self, key):
+        """返回(value, fresh_until, expires_at)，不存在或后端不可用时返回None"""
+        try:
+            blob = self.backend.get(self._key(key))
+        except BACKEND_ERRORS as e:
+            # 后端不可用时按未命中处理，不影响正常生成
+            self._count('errors')
+            print(f"⚠ 共享缓存读取失败: {e}")
+            return None
+        if blob is None:
+            return None
+        value, fresh_until, expires_at = decode_value(blob)
+        if expires_at <= time.time():
+            return None
+        return value, fresh_until, expires_at
+
+    def get(self, key, allow_expired=False):
+        entry = self._read(key)
+        if entry is None or (entry[1] <= time.time() and not allow_expired):
+            self._count('misses')
+            return None
+        self._count('hits' if entry[1] > time.time() else 'stale_hits')
+        return entry[0]
+
+    def lookup(self, key):
+        entry = self._read(key)
+        if entry is None:
+            self._count('misses')
+            return None, None
+        if entry[1] <= time.time():
+            self._count('stale_hits')
+            return entry[0], 'stale'
+        self._count('hits')
+        return entry[0], 'fresh'
+
+    def is_fresh(self, key):
+        entry = self._read(key)
+        return entry is not None and entry[1] > time.time()
+
+    def set(self, key, value, ttl=None, prompt_version=None, hard_ttl=None):
+        now = time.time()
+        fresh_until = now + (self.ttl if ttl is None else ttl)
+        expires_at = max(fresh_until, now + (self.hard_ttl if hard_ttl is None else hard_ttl))
+        try:
+            self.backend.set(self._key(key), encode_value([value, fresh_until, expires_at]),
+                             expires_at - now)
+        except BACKEND_ERRORS as e:
+            self._count('errors')
+            print(f"⚠ 共享缓存写入失败: {e}")
+            return False
+        self._count('writes')
+        return True
+
+    def delete(self, key):
+        self.backend.delete(self._key(key))
+
+    def describe(self):
+        return f"共享后端({self.namespace}), 软TTL {self.ttl}秒, 硬TTL {self.hard_ttl}秒"
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'shared': True,
+                'namespace': self.namespace,
+                'ttl': self.ttl,
+                'hard_ttl': self.hard_ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'stale_hits': self.stale_hits,
+                'writes': self.writes,
+                'errors': self.errors,
+                'backend': self.backend.stats()
+            }
+
+
+class SharedTokenBucket:
+    """全局令牌桶，接口与admission.TokenBucket相同
+
+    令牌数和上次补充的时间保存在后端，补充和预订由take_tokens一次完成（Redis中为一个Lua脚本），
+    所有进程合计的速率不超过rate，任意时刻最多突发burst次；
+    时间使用各进程的time.time()，各节点的时钟需同步（如NTP）。
+    需要等待超过_MAX_RESERVE_AHEAD秒时不预订，直接返回需要等待的秒数
+    """
+
+    def __init__(self, backend, name, rate, burst):
+        self.backend = backend
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.key = f'rate:{name}'
+        self.blocking = backend.blocking
+        # 按线程记录是否预订了令牌，reserve和对应的cancel需在同一线程中调用
+        self._reserved = threading.local()
+
+    def reserve(self):
+        reserved, wait = self.backend.take_tokens(self.key, self.rate, self.burst, 1,
+                                                  _MAX_RESERVE_AHEAD, time.time())
+        self._reserved.value = reserved
+        return wait
+
+    def cancel(self):
+        if getattr(self._reserved, 'value', False):
+            self.backend.take_tokens(self.key, self.rate, self.burst, -1, 0, time.time())
+            self._reserved.value = False
+
+
+async def call_blocking(target, fn, *args, **kwargs):
+    """在事件循环中调用共享后端上的组件：target.blocking为真（网络请求）时在线程池中执行fn，
+    进程内实现（没有blocking属性或为假）直接调用"""
+    if getattr(target, 'blocking', False):
+        return await asyncio.to_thread(fn, *args, **kwargs)
+    return fn(*args, **kwargs)
+
+
+class AsyncCache:
+    """异步服务器使用的缓存包装：get、lookup、is_fresh、set为协程，
+    cache为SharedRecommendationCache时在线程池中读写，进程内的RecommendationCache直接调用"""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    async def get(self, key, allow_expired=False):
+        return await call_blocking(self.cache, self.cache.get, key, allow_expired)
+
+    async def lookup(self, key):
+        return await call_blocking(self.cache, self.cache.lookup, key)
+
+    async def is_fresh(self, key):
+        return await call_blocking(self.cache, self.cache.is_fresh, key)
+
+    async def set(self, key, value, **kwargs):
+        return await call_blocking(self.cache, self.cache.set, key, value, **kwargs)
+
+    async def load_store(self):
+        """在线程池中预加载进程内缓存关联的持久化存储（共享缓存没有持久化存储）"""
+        if hasattr(self.cache, 'load_store'):
+            await asyncio.to_thread(self.cache.load_store)
+
+    def describe(self):
+        return self.cache.describe()
+
+    def stats(self):
+        return self.cache.stats()
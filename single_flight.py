@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求合并(single-flight) - 相同key的并发请求只调用一次上游，其余请求等待并共享结果
+同步版本用于Flask(多线程)，异步版本用于Quart(asyncio)
+
+指定lock_backend（shared_backend.SharedBackend）时，进程内的调用方还要先获取共享后端中的锁，
+多个进程中同一key同时只有一个在调用上游；其他进程等锁释放后再执行，
+fn应先检查缓存，直接使用持锁进程刚写入的结果。
+等锁最多到锁的TTL或请求的截止时间（deadline），超时或共享后端不可用时不加锁直接调用fn，
+与共享缓存不可用时按未命中处理一致
+"""
+
+import time
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+def lock_wait_limit(lock_ttl, deadline=None):
+    """等待其他进程释放共享锁的最长秒数：不超过锁的TTL和请求截止时间的剩余时间"""
+    if deadline is None:
+        return lock_ttl
+    return min(lock_ttl, deadline.remaining())
+
+from shared_backend import BACKEND_ERRORS, SHARED_LOCK_POLL, SHARED_LOCK_TTL, call_blocking
+
+
+class SingleFlight:
+    """线程版请求合并"""
+
+    def __init__(self, lock_backend=None, lock_ttl=SHARED_LOCK_TTL):
+        self._calls = {}  # key -> Future
+        self._lock = threading.Lock()
+        self.lock_backend = lock_backend
+        self.lock_ttl = lock_ttl
+        self.leaders = 0
+        self.shared = 0
+        self.background = 0
+        self.remote_waits = 0
+        self.lock_timeouts = 0
+        self.lock_errors = 0
+
+    def do(self, key, fn, deadline=None):
+        """执行fn()并返回(结果, 是否共享了其他请求的结果)
+
+        同一key已有请求在执行时，当前线程阻塞等待该请求完成；
+        执行失败时异常会传递给所有等待者。deadline为请求的截止时间，限制等待共享锁的时长
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.shared += 1
+                leader = False
+            else:
+                future = Future()
+                self._calls[key] = future
+                self.leaders += 1
+                leader = True
+
+        if not leader:
+            return future.result(), True
+        return self._run(key, future, fn, deadline), False
+
+    def do_background(self, key, fn):
+        """在后台线程执行fn()，返回是否发起了新的调用
+
+        同一key已有请求在执行时不重复发起；期间的do()调用会共享后台调用的结果
+        """
+        with self._lock:
+            if key in self._calls:
+                return False
+            future = Future()
+            self._calls[key] = future
+            self.leaders += 1
+            self.background += 1
+
+        def run():
+            try:
+                self._run(key, future, fn)
+            except Exception as e:
+                print(f"✗ 后台调用失败 ({key[:12]}): {e}")
+
+        threading.Thread(target=run, name='single-flight-bg', daemon=True).start()
+        return True
+
+    def _run(self, key, future, fn, deadline=None):
+        try:
+            result = self._call_locked(key, fn, deadline) if self.lock_backend is not None else fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+        return result
+
+    def _call_locked(self, key, fn, deadline=None):
+        lock_key = f'flight:{key}'
+        try:
+            token = self._acquire(lock_key, deadline)
+        except BACKEND_ERRORS as e:
+            with self._lock:
+                self.lock_errors += 1
+            print(f"⚠ 共享锁不可用，不合并直接调用 ({key[:12]}): {e}")
+            return fn()
+        if token is None:
+            print(f"⚠ 等待共享锁超时，不合并直接调用 ({key[:12]})")
+            return fn()
+        try:
+            return fn()
+        finally:
+            try:
+                self.lock_backend.unlock(lock_key, token)
+            except BACKEND_ERRORS as e:
+                # 未释放的锁在TTL后自动过期
+                print(f"⚠ 共享锁释放失败 ({key[:12]}): {e}")
+
+    def _acquire(self, lock_key, deadline):
+        """获取共享锁并返回令牌，等待超过lock_wait_limit时返回None"""
+        token = self.lock_backend.try_lock(lock_key, self.lock_ttl)
+        if token is not None:
+            return token
+        with self._lock:
+            self.remote_waits += 1
+        wait_until = time.monotonic() + lock_wait_limit(self.lock_ttl, deadline)
+        while time.monotonic() + SHARED_LOCK_POLL <= wait_until:
+            time.sleep(SHARED_LOCK_POLL)
+            token = self.lock_backend.try_lock(lock_key, self.lock_ttl)
+            if token is not None:
+                return token
+        with self._lock:
+            self.lock_timeouts += 1
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'shared': self.shared,
+                'background': self.background,
+                'remote_waits': self.remote_waits,
+                'lock_timeouts': self.lock_timeouts,
+                'lock_errors': self.lock_errors
+            }
+
+
+class AsyncSingleFlight:
+    """asyncio版请求合并
+
+    上游调用在独立的Task中执行，发起请求的客户端断开不会取消其他等待者共享的调用。
+    """
+
+    def __init__(self, lock_backend=None, lock_ttl=SHARED_LOCK_TTL):
+        self._calls = {}  # key -> Task
+        self.lock_backend = lock_backend
+        self.lock_ttl = lock_ttl
+        self.leaders = 0
+        self.shared = 0
+        self.background = 0
+        self.remote_waits = 0
+        self.lock_timeouts = 0
+        self.lock_errors = 0
+
+    async def do(self, key, coro_fn, deadline=None):
+        """执行await coro_fn()并返回(结果, 是否共享了其他请求的结果)"""
+        task = self._calls.get(key)
+        shared = task is not None
+        if shared:
+            self.shared += 1
+        else:
+            self.leaders += 1
+            task = asyncio.ensure_future(self._call(key, coro_fn, deadline))
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+
+        return await asyncio.shield(task), shared
+
+    def do_background(self, key, coro_fn):
+        """在后台Task中执行coro_fn()，返回是否发起了新的调用（语义同SingleFlight.do_background）"""
+        if key in self._calls:
+            return False
+        self.leaders += 1
+        self.background += 1
+        task = asyncio.ensure_future(self._call(key, coro_fn))
+        self._calls[key] = task
+        task.add_done_callback(lambda t: self._forget(key, t))
+        task.add_done_callback(self._report_background)
+        return True
+
+    async def _call(self, key, coro_fn, deadline=None):
+        if self.lock_backend is None:
+            return await coro_fn()
+
+        # 共享后端的请求在线程池中执行，等待其他进程释放锁时让出事件循环
+        lock_key = f'flight:{key}'
+        backend = self.lock_backend
+        try:
+            token = await self._acquire(lock_key, deadline)
+        except BACKEND_ERRORS as e:
+            self.lock_errors += 1
+            print(f"⚠ 共享锁不可用，不合并直接调用 ({key[:12]}): {e}")
+            return await coro_fn()
+        if token is None:
+            print(f"⚠ 等待共享锁超时，不合并直接调用 ({key[:12]})")
+            return await coro_fn()
+        try:
+            return await coro_fn()
+        finally:
+            try:
+                await call_blocking(backend, backend.unlock, lock_key, token)
+            except BACKEND_ERRORS as e:
+                print(f"⚠ 共享锁释放失败 ({key[:12]}): {e}")
+
+    async def _acquire(self, lock_key, deadline):
+        backend = self.lock_backend
+        token = await call_blocking(backend, backend.try_lock, lock_key, self.lock_ttl)
+        if token is not None:
+            return token
+        self.remote_waits += 1
+        wait_until = time.monotonic() + lock_wait_limit(self.lock_ttl, deadline)
+        while time.monotonic() + SHARED_LOCK_POLL <= wait_until:
+            await asyncio.sleep(SHARED_LOCK_POLL)
+            token = await call_blocking(backend, backend.try_lock, lock_key, self.lock_ttl)
+            if token is not None:
+                return token
+        self.lock_timeouts += 1
+        return None
+
+    @staticmethod
+    def _report_background(task):
+        if not task.cancelled() and task.exception() is not None:
+            print(f"✗ 后台调用失败: {task.exception()}")
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # 等待者都已取消（如批量请求超时）时读取一次异常，避免"Task exception was never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        return {
+            'in_flight': len(self._calls),
+            'leaders': self.leaders,
+            'shared': self.shared,
+            'background': self.background,
+            'remote_waits': self.remote_waits,
+            'lock_timeouts': self.lock_timeouts,
+            'lock_errors': self.lock_errors
+        }
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+节气与季节 - app.js中getSolarTermDayRelation、getSeason、getSeasonName的Python版本
+服务端预生成推荐时用来构造与前端完全相同的参数，保证缓存键一致
+"""
+
+# 与app.js中ChineseCalendar.solarTerms相同的顺序和日期范围
+SOLAR_TERMS = [
+    ('立春', 2, (3, 5)), ('雨水', 2, (18, 20)), ('惊蛰', 3, (5, 7)), ('春分', 3, (20, 22)),
+    ('清明', 4, (4, 6)), ('谷雨', 4, (19, 21)), ('立夏', 5, (5, 7)), ('小满', 5, (20, 22)),
+    ('芒种', 6, (5, 7)), ('夏至', 6, (21, 22)), ('小暑', 7, (6, 8)), ('大暑', 7, (22, 24)),
+    ('立秋', 8, (7, 9)), ('处暑', 8, (22, 24)), ('白露', 9, (7, 9)), ('秋分', 9, (22, 24)),
+    ('寒露', 10, (8, 10)), ('霜降', 10, (23, 25)), ('立冬', 11, (7, 8)), ('小雪', 11, (22, 23)),
+    ('大雪', 12, (6, 8)), ('冬至', 12, (21, 23)), ('小寒', 1, (5, 7)), ('大寒', 1, (19, 21)),
+]
+
+# 找不到节气时app.js使用的默认值
+DEFAULT_SOLAR_TERM = '小寒'
+
+_RELATION_PREFIX = {-2: '后日', -1: '明日', 0: '今日', 1: '昨日', 2: '前日'}
+
+
+def solar_term_description(date):
+    """返回app.js generateRecommendation中的节气描述，如"今日小寒"、"前日立春"、"冬至"
+
+    逐条对照app.js的getSolarTermDayRelation，包括遇到月份更晚的节气就停止查找的行为
+    （1月份的日期因此总是使用默认值），这样服务端生成的prompt与前端请求一致
+    """
+    month = date.month
+    day = date.day
+    current = None
+
+    for name, term_month, (start_day, end_day) in SOLAR_TERMS:
+        if term_month == month and start_day - 2 <= day <= end_day + 2:
+            diff = day - start_day
+            if diff in _RELATION_PREFIX:
+                return _RELATION_PREFIX[diff] + name
+
+        if term_month == month and day >= start_day:
+            if current is None or start_day > current[1]:
+                current = (name, start_day)
+        elif term_month > month or (term_month == month and day < start_day):
+            break
+
+    if current is not None:
+        return current[0]
+    return DEFAULT_SOLAR_TERM
+
+
+def season_name(date):
+    """返回季节名称（春季/夏季/秋季/冬季），与app.js的getSeason + getSeasonName一致"""
+    month = date.month
+    day = date.day
+    if (month == 3 and day >= 21) or month == 4 or (month == 5 and day <= 20):
+        return '春季'
+    if (month == 5 and day >= 21) or month in (6, 7) or (month == 8 and day <= 22):
+        return '夏季'
+    if (month == 8 and day >= 23) or month in (9, 10) or (month == 11 and day <= 22):
+        return '秋季'
+    return '冬季'
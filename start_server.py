@@ -5,30 +5,23 @@ Food Recommendation App - HTTP Server Starter
 启动养生饮食推荐应用服务器
 """
 
-import http.server
-import socketserver
 import webbrowser
 import os
 import sys
 
+from static_server import StaticFileHandler, create_server
+
 PORT = 8000
 DIRECTORY = os.path.dirname(os.path.abspath(__file__))
 
-class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, directory=DIRECTORY, **kwargs)
-
-    def end_headers(self):
-        # Enable CORS
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        super().end_headers()
+class MyHTTPRequestHandler(StaticFileHandler):
+    directory = DIRECTORY
 
 def start_server():
     os.chdir(DIRECTORY)
 
-    with socketserver.TCPServer(("", PORT), MyHTTPRequestHandler) as httpd:
+    # 线程池并发处理连接
+    with create_server(("", PORT), MyHTTPRequestHandler) as httpd:
         print("=" * 50)
         print("  养生饮食推荐应用 - Food Recommendation App")
         print("=" * 50)
@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+静态文件服务器公共部分 - app_server.py、server_with_env.py、start_server.py共用
+socketserver.TCPServer一次只能处理一个连接，慢速客户端下载大图时其他用户的页面和接口都会卡住；
+这里用固定数量的工作线程并发处理连接，等待队列有上限，队列满时直接返回503；
+处理器使用HTTP/1.1长连接，同一浏览器的多个静态资源复用连接
+
+静态文件经StaticFileCache读取：常用文件保存在内存中（按字节数限制），每个文件版本(mtime)
+只计算一次强ETag，浏览器带If-None-Match / If-Modified-Since重新验证时返回304；
+文本资源存在预压缩文件（python compression.py生成的.br/.gz）时按Accept-Encoding发送压缩版本；
+大文件（背景图片等）不放入内存，用socket.sendfile(os.sendfile)从磁盘直接发送，支持Range断点续传；
+背景图有python image_variants.py生成的WebP/AVIF版本时，按Accept和宽度提示发送最合适的版本
+"""
+
+import io
+import os
+import html
+import json
+import queue
+import hashlib
+import datetime
+import threading
+import http.server
+import email.utils
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlsplit
+
+from compression import ENCODING_SUFFIXES, choose_encoding, compress_body, precompressed_path
+from image_variants import ImageVariants
+
+STATIC_WORKERS = int(os.environ.get('STATIC_WORKERS', 32))
+STATIC_MAX_PENDING = int(os.environ.get('STATIC_MAX_PENDING', 256))
+# 处理请求时单次读写阻塞超过该秒数时关闭连接
+STATIC_KEEPALIVE_TIMEOUT = float(os.environ.get('STATIC_KEEPALIVE_TIMEOUT', 10))
+# 等待（下一个）请求的空闲秒数：空闲连接也占用一个工作线程，超过后关闭连接释放线程
+STATIC_KEEPALIVE_IDLE = float(os.environ.get('STATIC_KEEPALIVE_IDLE', 2))
+# 每个长连接最多处理的请求数；有连接在排队时，处理完当前请求就关闭长连接
+STATIC_KEEPALIVE_MAX_REQUESTS = int(os.environ.get('STATIC_KEEPALIVE_MAX_REQUESTS', 100))
+
+# 内存缓存总字节数上限；超过单文件上限的文件不缓存内容，只缓存ETag等元数据，
+# 内容用sendfile由内核从磁盘（页缓存）直接发送到socket，不经过Python读写
+STATIC_CACHE_MAX_BYTES = int(os.environ.get('STATIC_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+STATIC_CACHE_MAX_FILE = int(os.environ.get('STATIC_CACHE_MAX_FILE', 256 * 1024))
+STATIC_SENDFILE = os.environ.get('STATIC_SENDFILE', '1') == '1'
+# 图片等不常变化的资源允许浏览器直接使用本地副本的秒数；页面、脚本和样式每次都重新验证（304）
+STATIC_IMAGE_MAX_AGE = int(os.environ.get('STATIC_IMAGE_MAX_AGE', 7 * 24 * 3600))
+
+_BUSY_RESPONSE = (b'HTTP/1.1 503 Service Unavailable\r\n'
+                  b'Retry-After: 1\r\n'
+                  b'Content-Length: 0\r\n'
+                  b'Connection: close\r\n\r\n')
+
+
+class PooledHTTPServer(http.server.HTTPServer):
+    """固定线程池的HTTP服务器：连接放入有界队列，由workers个工作线程处理"""
+
+    # listen队列（socketserver默认5）：连接突增时监听线程来不及accept，队列满的SYN要等1秒后重传
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, workers=STATIC_WORKERS,
+                 max_pending=STATIC_MAX_PENDING):
+        super().__init__(server_address, handler_class)
+        self.workers = workers
+        self.rejected = 0
+        self._queue = queue.Queue(max_pending)
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work, name=f'static-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def process_request(self, request, client_address):
+        """由监听线程调用：只把连接放入队列，不在监听线程中处理"""
+        try:
+            self._queue.put_nowait((request, client_address))
+        except queue.Full:
+            self.rejected += 1
+            try:
+                request.sendall(_BUSY_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def has_pending(self):
+        """是否有连接在等待工作线程"""
+        return not self._queue.empty()
+
+    def server_close(self):
+        super().server_close()
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'pending': self._queue.qsize(),
+            'rejected': self.rejected
+        }
+
+
+class StaticEntry:
+    """一个文件版本的元数据和（可选的）内容"""
+
+    __slots__ = ('path', 'mtime_ns', 'size', 'etag', 'last_modified', 'mtime', 'body')
+
+    def __init__(self, path, stat, etag, body):
+        self.path = path
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.etag = etag
+        self.last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        self.body = body
+
+    def open(self, start=0, end=None):
+        """返回第start到end字节（含）的可读对象：已缓存内容时从内存读取，否则为磁盘文件的FileRange"""
+        end = self.size - 1 if end is None else end
+        if self.body is not None:
+            return io.BytesIO(self.body[start:end + 1])
+        return FileRange(self.path, start, end - start + 1)
+
+
+class FileRange:
+    """磁盘文件中要发送的一段，StaticFileHandler.copyfile用sendfile发送"""
+
+    def __init__(self, path, offset, count):
+        self.file = open(path, 'rb')
+        self.offset = offset
+        self.count = count
+        self._remaining = count
+        self.file.seek(offset)
+
+    def read(self, size=-1):
+        """不支持sendfile时由shutil.copyfileobj逐块读取"""
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self.file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def parse_byte_range(header, size):
+    """解析Range请求头（只支持单段：bytes=a-b / bytes=a- / bytes=-n），返回(start, end)；
+    格式不支持时返回None（按整个文件响应），start >= size表示无法满足（416）"""
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, sep, last = spec.strip().partition('-')
+    if not sep or (first and not first.isdigit()) or (last and not last.isdigit()) or not (first or last):
+        return None
+    if first:
+        start = int(first)
+        end = int(last) if last else size - 1
+        if last and end < start:
+            return None
+    else:
+        # bytes=-n：最后n个字节，n为0时无法满足
+        suffix = int(last)
+        start = max(size - suffix, 0) if suffix else size
+        end = size - 1
+    return start, min(end, size - 1)
+
+
+class StaticFileCache:
+    """静态文件缓存（LRU，按内容字节数限制）
+
+    每次请求stat一次文件，mtime或大小变化时重新读取并计算ETag
+    """
+
+    def __init__(self, max_bytes=STATIC_CACHE_MAX_BYTES, max_file=STATIC_CACHE_MAX_FILE):
+        self.max_bytes = max_bytes
+        self.max_file = max_file
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """返回path当前版本的StaticEntry；不是普通文件或无法读取时返回None"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path):
+            return None
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.mtime_ns == stat.st_mtime_ns and entry.size == stat.st_size:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry
+
+        try:
+            entry = self._load(path, stat)
+        except OSError:
+            return None
+        with self._lock:
+            self.misses += 1
+            old = self._entries.pop(path, None)
+            if old is not None and old.body is not None:
+                self.bytes -= len(old.body)
+            self._entries[path] = entry
+            if entry.body is not None:
+                self.bytes += len(entry.body)
+            while self.bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                if evicted.body is not None:
+                    self.bytes -= len(evicted.body)
+        return entry
+
+    def _load(self, path, stat):
+        digest = hashlib.sha1()
+        body = None
+        with open(path, 'rb') as f:
+            if stat.st_size <= self.max_file:
+                body = f.read()
+                digest.update(body)
+            else:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+        return StaticEntry(path, stat, f'"{digest.hexdigest()[:20]}"', body)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified
+            }
+
+
+# 所有处理器共用的静态文件缓存和背景图版本清单
+static_cache = StaticFileCache()
+image_variants = ImageVariants()
+
+# 按背景图版本选择时，响应随这些请求头变化
+IMAGE_VARY = ('Accept', 'Sec-CH-Width', 'Sec-CH-Viewport-Width', 'Sec-CH-DPR')
+
+
+def create_server(server_address, handler_class):
+    """创建静态文件服务器；STATIC_WORKERS=0时使用原来的单连接TCPServer"""
+    if STATIC_WORKERS <= 0:
+        return http.server.HTTPServer(server_address, handler_class)
+    return PooledHTTPServer(server_address, handler_class)
+
+
+class StaticFileHandler(http.server.SimpleHTTPRequestHandler):
+    """静态文件处理器基类：HTTP/1.1长连接、CORS、OPTIONS预检、静态文件缓存和304
+
+    长连接下每个响应都必须带Content-Length，自定义接口用send_json / send_text返回
+    """
+
+    protocol_version = 'HTTP/1.1'
+    timeout = STATIC_KEEPALIVE_TIMEOUT
+    # 响应头和响应体分两次写入，开启Nagle算法时长连接上的第二次写入要等客户端的延迟ACK（约40ms）
+    disable_nagle_algorithm = True
+    keepalive_idle = STATIC_KEEPALIVE_IDLE
+    keepalive_max_requests = STATIC_KEEPALIVE_MAX_REQUESTS
+    requests_served = 0
+    directory = os.path.dirname(os.path.abspath(__file__))
+    cache = static_cache
+    image_variants = image_variants
+    use_sendfile = STATIC_SENDFILE
+    # 较早的Python版本的mimetypes不认识.avif/.webp
+    extensions_map = {
+        **http.server.SimpleHTTPRequestHandler.extensions_map,
+        '.avif': 'image/avif',
+        '.webp': 'image/webp'
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=self.directory, **kwargs)
+
+    def handle(self):
+        """处理长连接上的请求；空闲超过keepalive_idle、达到请求数上限或有连接排队时关闭，释放工作线程"""
+        self.close_connection = False
+        self.requests_served = 0
+        while not self.close_connection:
+            if not self.wait_for_request():
+                break
+            self.handle_one_request()
+            self.requests_served += 1
+
+    def wait_for_request(self):
+        """等待请求数据到达（最多keepalive_idle秒），连接关闭或超时返回False"""
+        self.connection.settimeout(self.keepalive_idle)
+        try:
+            # peek在缓冲区已有数据（管线化请求）时直接返回，否则阻塞到数据到达
+            if not self.rfile.peek(1):
+                return False
+        except OSError:
+            return False
+        self.connection.settimeout(self.timeout)
+        return True
+
+    def server_busy(self):
+        has_pending = getattr(self.server, 'has_pending', None)
+        return has_pending is not None and has_pending()
+
+    def end_headers(self):
+        # 本连接的最后一个响应告知客户端关闭（send_header会设置close_connection）
+        if not self.close_connection and (self.requests_served + 1 >= self.keepalive_max_requests
+                                          or self.server_busy()):
+            self.send_header('Connection', 'close')
+        # Enable CORS
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        super().end_headers()
+
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def send_head(self):
+        """GET/HEAD的静态文件响应头；目录重定向、目录列表和404仍由SimpleHTTPRequestHandler处理"""
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            if not urlsplit(self.path).path.endswith('/'):
+                return super().send_head()
+            for index in ('index.html', 'index.htm'):
+                if os.path.isfile(os.path.join(path, index)):
+                    path = os.path.join(path, index)
+                    break
+            else:
+                return super().send_head()
+        entry = None if path.endswith('/') else self.cache.get(path)
+        if entry is None:
+            return super().send_head()
+
+        if self.image_variants.covers(path):
+            variant = self.image_variants.select(path, self.headers.get('Accept'), self.width_hint())
+            variant_entry = self.cache.get(variant) if variant else None
+            return self.send_entry(variant_entry or entry, vary=IMAGE_VARY)
+        return self.send_entry(entry)
+
+    def width_hint(self):
+        """背景图的显示宽度（物理像素）：?w=参数，或Client Hints（Sec-CH-Width，Sec-CH-Viewport-Width × DPR）"""
+        width = parse_qs(urlsplit(self.path).query).get('w', [None])[0] or self.headers.get('Sec-CH-Width')
+        dpr = 1
+        if not width:
+            width = self.headers.get('Sec-CH-Viewport-Width')
+            dpr = self.headers.get('Sec-CH-DPR') or 1
+        try:
+            return int(float(width) * float(dpr)) if width else None
+        except ValueError:
+            return None
+
+    def send_entry(self, entry, content_type=None, vary=()):
+        """发送缓存文件的响应头（200或304），返回响应体文件对象（304时为None）"""
+        content_type = content_type or self.guess_type(entry.path)
+        # 有预压缩文件时响应随Accept-Encoding变化，ETag按实际发送的文件计算
+        variants = {}
+        for e in ENCODING_SUFFIXES:
+            variant = precompressed_path(entry.path, e)
+            if variant is not None:
+                variants[e] = variant
+        encoding = choose_encoding(self.headers.get('Accept-Encoding'), variants) if variants else None
+        if encoding is not None:
+            compressed = self.cache.get(variants[encoding])
+            if compressed is None:
+                encoding = None
+            else:
+                entry = compressed
+        if variants:
+            vary = (*vary, 'Accept-Encoding')
+
+        if self.not_modified(entry):
+            self.cache.not_modified += 1
+            self.send_response(304)
+            self.send_validators(entry, content_type, vary)
+            self.end_headers()
+            return None
+
+        byte_range = None
+        if 'Range' in self.headers and self.if_range(entry):
+            byte_range = parse_byte_range(self.headers['Range'], entry.size)
+        if byte_range is not None and byte_range[0] >= entry.size:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{entry.size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+
+        start, end = byte_range or (0, entry.size - 1)
+        self.send_response(206 if byte_range else 200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(end - start + 1))
+        if byte_range:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{entry.size}')
+        self.send_header('Accept-Ranges', 'bytes')
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+        self.send_validators(entry, content_type, vary)
+        self.end_headers()
+        return entry.open(start, end)
+
+    def if_range(self, entry):
+        """If-Range（ETag或Last-Modified）与当前版本不一致时忽略Range，返回整个文件"""
+        if_range = self.headers.get('If-Range')
+        if if_range is None:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith(('"', 'W/')):
+            return if_range == entry.etag
+        return if_range == entry.last_modified
+
+    def copyfile(self, source, outputfile):
+        if isinstance(source, FileRange) and self.use_sendfile:
+            # socket.sendfile使用os.sendfile（不支持时自动改为普通send），可以处理连接的超时设置
+            self.connection.sendfile(source.file, source.offset, source.count)
+            return
+        super().copyfile(source, outputfile)
+
+    def send_file(self, path, content_type=None):
+        """自定义接口发送文件（同样支持304和预压缩），文件不存在时返回False"""
+        entry = self.cache.get(path)
+        if entry is None:
+            return False
+        f = self.send_entry(entry, content_type)
+        if f is not None:
+            try:
+                if self.command != 'HEAD':
+                    self.copyfile(f, self.wfile)
+            finally:
+                f.close()
+        return True
+
+    def not_modified(self, entry):
+        """按If-None-Match（优先）或If-Modified-Since判断浏览器的副本是否仍然有效"""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            # 弱比较：W/前缀的ETag也视为匹配
+            return '*' in tags or any(tag.removeprefix('W/') == entry.etag for tag in tags)
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, IndexError, OverflowError, ValueError):
+                return False
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=datetime.timezone.utc)
+            modified = datetime.datetime.fromtimestamp(int(entry.mtime), datetime.timezone.utc)
+            return modified <= since
+        return False
+
+    def send_validators(self, entry, content_type, vary=()):
+        self.send_header('ETag', entry.etag)
+        self.send_header('Last-Modified', entry.last_modified)
+        self.send_header('Cache-Control', self.cache_control(content_type))
+        if vary:
+            self.send_header('Vary', ', '.join(vary))
+
+    def cache_control(self, content_type):
+        """图片缓存STATIC_IMAGE_MAX_AGE秒；页面、脚本、样式等可能随版本更新，每次重新验证"""
+        if content_type.startswith('image/'):
+            return f'public, max-age={STATIC_IMAGE_MAX_AGE}'
+        return 'no-cache'
+
+    def send_error(self, code, message=None, explain=None):
+        """GET/HEAD的404等错误保持长连接（http.server的send_error总是关闭连接）；
+        请求格式错误、超时和5xx仍按原来的方式关闭"""
+        if (getattr(self, 'command', None) not in ('GET', 'HEAD') or not 400 <= code < 500
+                or code in (400, 408, 414, 431)):
+            return super().send_error(code, message, explain)
+        short, long = self.responses.get(code, ('???', '???'))
+        self.log_error("code %d, message %s", code, message or short)
+        body = self.error_message_format % {
+            'code': code,
+            'message': html.escape(message or short, quote=False),
+            'explain': html.escape(explain or long, quote=False)
+        }
+        self.send_body(code, body.encode('utf-8', 'replace'), self.error_content_type)
+
+    def send_body(self, status, body, content_type):
+        """发送接口响应，超过COMPRESS_MIN_SIZE的文本按Accept-Encoding即时压缩"""
+        body, encoding = compress_body(body, content_type, self.headers.get('Accept-Encoding'))
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+            self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_body(status, body, 'application/json; charset=utf-8')
+
+    def send_text(self, status, text):
+        self.send_body(status, text.encode('utf-8'), 'text/plain; charset=utf-8')
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+准入控制测试 - 并发名额、有界等待队列、令牌桶限速，队列已满、等待超时和限速时的拒绝，
+以及拒绝对应的503响应和Retry-After
+
+用法:
+    python -m pytest test_admission.py
+"""
+
+import types
+import asyncio
+import threading
+
+import pytest
+
+import admission
+from admission import AdmissionController, AsyncAdmissionController, Overloaded, TokenBucket
+from recommend_service import error_response
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """替换admission中的time.monotonic，令牌桶按clock[0]计时"""
+    now = [1000.0]
+    monkeypatch.setattr(admission, 'time', types.SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def rejection(controller):
+    """在已占满的控制器上再申请一个名额，返回抛出的Overloaded"""
+    with pytest.raises(Overloaded) as info:
+        with controller.slot():
+            pass
+    return info.value
+
+
+# ---------- 令牌桶 ----------
+
+def test_token_bucket_burst_then_rate(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.reserve() == 0.5
+    assert bucket.reserve() == 1.0
+    clock[0] += 1
+    # 1秒补充2个令牌，刚好还清预订
+    assert bucket.reserve() == 0.5
+
+
+def test_token_bucket_cancel_and_cap(clock):
+    bucket = TokenBucket(rate=1, burst=2)
+    bucket.reserve()
+    bucket.reserve()
+    bucket.cancel()
+    assert bucket.reserve() == 0.0
+    clock[0] += 100
+    # 空闲再久也最多积累burst个令牌
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 1.0]
+
+
+# ---------- 同步版本 ----------
+
+def test_retry_after_rounds_up():
+    assert Overloaded('queue_full', 0.2).retry_after == 1
+    assert Overloaded('rate_limited', 2.1).retry_after == 3
+
+
+def test_queue_full_rejected_immediately():
+    controller = AdmissionController(max_concurrent=1, max_queue=0, queue_timeout=5, rpm=6000)
+    with controller.slot():
+        error = rejection(controller)
+    assert error.reason == 'queue_full' and error.retry_after == 5
+    assert controller.stats()['rejected']['queue_full'] == 1
+
+
+def test_queue_timeout():
+    controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=0.05, rpm=6000)
+    with controller.slot():
+        error = rejection(controller)
+    assert error.reason == 'queue_timeout' and error.retry_after == 1
+    stats = controller.stats()
+    assert stats['rejected']['queue_timeout'] == 1 and stats['queued'] == 0 and stats['peak_queued'] == 1
+
+
+def test_rate_limited_returns_token():
+    # 每秒1个令牌，第二个请求需要等1秒，超过排队时限
+    controller = AdmissionController(max_concurrent=4, queue_timeout=0.5, rpm=60, burst=1)
+    with controller.slot():
+        pass
+    error = rejection(controller)
+    assert error.reason == 'rate_limited' and error.retry_after == 1
+    # 被拒绝的请求归还预订的令牌，不会推迟后续请求
+    assert controller.bucket.reserve() == pytest.approx(1.0, abs=0.05)
+
+
+def test_queued_request_admitted_when_slot_frees():
+    controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=5, rpm=6000)
+    admitted = threading.Event()
+
+    def queued():
+        with controller.slot():
+            admitted.set()
+
+    with controller.slot():
+        thread = threading.Thread(target=queued)
+        thread.start()
+        assert not admitted.wait(0.1)
+        assert controller.stats()['queued'] == 1
+    thread.join(5)
+    assert admitted.is_set()
+    stats = controller.stats()
+    assert stats['admitted'] == 2 and stats['in_flight'] == 0 and stats['queued'] == 0
+
+
+def test_slot_released_on_error():
+    controller = AdmissionController(max_concurrent=1, max_queue=0, rpm=6000)
+    with pytest.raises(ValueError):
+        with controller.slot():
+            raise ValueError('upstream')
+    with controller.slot():
+        assert controller.stats()['in_flight'] == 1
+
+
+def test_try_acquire_needs_free_slot():
+    controller = AdmissionController(max_concurrent=2, rpm=6000)
+    with controller.slot():
+        assert controller.try_acquire() is True
+        assert controller.stats()['in_flight'] == 2
+        assert controller.try_acquire() is False
+        controller.release()
+    stats = controller.stats()
+    assert stats['in_flight'] == 0 and stats['extra_admitted'] == 1 and stats['extra_denied'] == 1
+
+
+# ---------- 503响应 ----------
+
+@pytest.mark.parametrize('reason, retry_after', [('queue_full', 10), ('queue_timeout', 10),
+                                                 ('rate_limited', 3)])
+def test_overloaded_response(reason, retry_after):
+    payload, status, headers = error_response(Overloaded(reason, retry_after), '生成推荐')
+    assert status == 503
+    assert headers == {'Retry-After': str(retry_after)}
+    assert payload == {'error': 'Server busy, please retry later', 'reason': reason,
+                       'retry_after': retry_after}
+
+
+# ---------- 异步版本 ----------
+
+def test_async_queue_full_and_timeout():
+    async def main():
+        controller = AsyncAdmissionController(max_concurrent=1, max_queue=1, queue_timeout=0.05, rpm=6000)
+        reasons = []
+
+        async def request():
+            try:
+                async with controller.slot():
+                    await asyncio.sleep(0.2)
+            except Overloaded as e:
+                reasons.append(e.reason)
+
+        await asyncio.gather(request(), request(), request())
+        return reasons, controller.stats()
+
+    reasons, stats = asyncio.run(main())
+    # 第一个请求执行，第二个排队超时，第三个遇到队列已满
+    assert sorted(reasons) == ['queue_full', 'queue_timeout']
+    assert stats['admitted'] == 1 and stats['in_flight'] == 0
+
+
+def test_async_rate_limited():
+    async def main():
+        controller = AsyncAdmissionController(max_concurrent=4, queue_timeout=0.5, rpm=60, burst=1)
+        async with controller.slot():
+            pass
+        with pytest.raises(Overloaded, match='rate_limited'):
+            async with controller.slot():
+                pass
+        return controller.stats()
+
+    stats = asyncio.run(main())
+    assert stats['rejected']['rate_limited'] == 1 and stats['admitted'] == 1
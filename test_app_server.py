@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+统一服务器测试 - POST /api/recommend从离线数据集返回推荐，检查请求体长度、JSON和参数类型的校验
+
+用法:
+    python -m pytest test_app_server.py
+"""
+
+import json
+import socket
+import http.client
+
+import pytest
+
+import app_server
+from recommendation_dataset import (INDEX_FILE, SHARDS_DIR, RecommendationDataset, dataset_key,
+                                    shard_name)
+from test_static_server import make_handler, running_server
+
+FIELDS = {
+    'solarTerm': '小寒', 'season': '冬季', 'mealPeriod': '晚餐', 'dietType': '正餐推荐',
+    'healthGoal': '温补', 'location': '北京', 'weather': '雪', 'language': 'zh'
+}
+CONTENT = '```json\n{"dishes": [{"name": "羊肉汤"}]}\n```'
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    key = dataset_key(FIELDS)
+    (tmp_path / SHARDS_DIR).mkdir()
+    (tmp_path / INDEX_FILE).write_text(json.dumps({'total': 1}), encoding='utf-8')
+    (tmp_path / SHARDS_DIR / f'{shard_name(key)}.json').write_text(json.dumps({key: {
+        'content': CONTENT, 'model': 'glm-4-flash', 'fields': FIELDS
+    }}, ensure_ascii=False), encoding='utf-8')
+    monkeypatch.setattr(app_server, 'dataset', RecommendationDataset(str(tmp_path)))
+
+    handler = type('TestUnifiedHandler', (app_server.UnifiedHTTPRequestHandler, make_handler(tmp_path)), {
+        'log_message': lambda self, format, *args: None
+    })
+    with running_server(handler) as server:
+        yield server
+
+
+def post(server, body, headers=None):
+    conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+    if not isinstance(body, bytes):
+        body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+    conn.request('POST', '/api/recommend', body=body, headers=headers or {})
+    response = conn.getresponse()
+    return conn, response, json.loads(response.read())
+
+
+def raw_post(server, content_length):
+    """发送带指定Content-Length的请求头（不发送请求体），返回响应"""
+    with socket.create_connection(server.server_address, timeout=5) as sock:
+        sock.sendall(f'POST /api/recommend HTTP/1.1\r\nHost: localhost\r\n'
+                     f'Content-Length: {content_length}\r\n\r\n'.encode())
+        received = b''
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return received
+            received += chunk
+
+
+def test_dataset_hit(server):
+    conn, response, payload = post(server, FIELDS)
+    assert response.status == 200
+    assert payload['source'] == 'dataset' and payload['recommendation']['dishes'][0]['name'] == '羊肉汤'
+    conn.close()
+
+
+def test_dataset_miss_keeps_connection(server):
+    conn, response, payload = post(server, dict(FIELDS, location='上海'))
+    assert response.status == 404 and payload['error'] == 'Not in dataset'
+    _, response, _ = post(server, FIELDS)
+    assert response.status == 200
+    conn.close()
+
+
+@pytest.mark.parametrize('body, error', [
+    (b'{not json', 'Invalid JSON'),
+    (b'[1, 2]', 'Request body must be a JSON object'),
+    (dict(FIELDS, location=123), 'location must be a string'),
+    (dict(FIELDS, weather=['雪']), 'weather must be a string'),
+    ({'date': 20260105, 'location': '北京'}, 'date must be a string'),
+])
+def test_invalid_body_returns_400(server, body, error):
+    conn, response, payload = post(server, body)
+    assert response.status == 400 and payload['error'] == error
+    conn.close()
+
+
+@pytest.mark.parametrize('content_length', ['-1', 'abc', str(app_server.API_MAX_BODY + 1)])
+def test_invalid_content_length_returns_400(server, content_length):
+    # 不读取请求体：负数或超过上限的长度不会阻塞到客户端断开
+    received = raw_post(server, content_length)
+    assert received.startswith(b'HTTP/1.1 400')
+    assert b'Invalid Content-Length' in received
+
+
+def test_unknown_post_path_drains_body(server):
+    conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+    conn.request('POST', '/api/other', body=b'{"a": 1}')
+    response = conn.getresponse()
+    assert response.status == 404
+    response.read()
+    conn.request('POST', '/api/recommend', body=json.dumps(FIELDS).encode('utf-8'))
+    assert conn.getresponse().status == 200
+    conn.close()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推荐参数规范化测试 - 地点按行政区划表归并、天气归并为8类、时间按餐次归并，以及非字符串参数的拒绝
+
+用法:
+    python -m pytest test_canonicalize.py
+"""
+
+import pytest
+
+from canonicalize import FieldCanonicalizer, Gazetteer, canonical_weather, meal_period_for
+
+
+@pytest.fixture(scope='module')
+def gazetteer():
+    return Gazetteer()
+
+
+@pytest.mark.parametrize('location, expected', [
+    ('广东省广州市天河区', ('广东', '广州')),
+    ('北京市海淀区', ('北京', '北京')),
+    ('天河', ('广东', '广州')),
+    ('Guangzhou', ('广东', '广州')),
+    ('深圳南山区科技园', ('广东', '深圳')),
+    ('浙江杭州西湖', ('浙江', '杭州')),
+    ('广东省', ('广东', None)),
+    # 多个城市都有的区县名无法确定归属
+    ('鼓楼', None),
+    ('火星', None),
+])
+def test_gazetteer_lookup(gazetteer, location, expected):
+    assert gazetteer.lookup(location) == expected
+
+
+def test_gazetteer_region_granularity(gazetteer):
+    assert gazetteer.region('广东省广州市天河区') == '广州'
+    assert gazetteer.region('广东省广州市天河区', 'province') == '广东'
+    assert gazetteer.region('广东省') == '广东'
+    assert gazetteer.region('火星') is None
+
+
+@pytest.mark.parametrize('weather, expected', [
+    ('小雨转阴', '雨'),
+    ('Light Rain', '雨'),
+    ('雷阵雨', '雨'),
+    ('晴转多云', '多云'),
+    ('Sunny', '晴'),
+    ('霾', '雾'),
+    ('  未知  ', '未知'),
+    (None, ''),
+])
+def test_canonical_weather(weather, expected):
+    assert canonical_weather(weather) == expected
+
+
+@pytest.mark.parametrize('time_text, expected', [
+    ('07:30', '早餐'),
+    ('12:00', '午餐'),
+    ('18', '晚餐'),
+    ('23:15', '晚餐'),
+    ('03:00', '晚餐'),
+    ('abc', None),
+    (None, None),
+])
+def test_meal_period_for(time_text, expected):
+    assert meal_period_for(time_text) == expected
+
+
+def test_canonicalize_merges_nearby_requests(gazetteer):
+    canonicalizer = FieldCanonicalizer(gazetteer, enabled=True)
+    requests = [
+        {'location': '广东省广州市天河区', 'weather': '小雨', 'time': '18:05', 'mealPeriod': None},
+        {'location': '广州市越秀区', 'weather': '中雨转大雨', 'time': '19:40', 'mealPeriod': None},
+        {'location': 'Guangzhou', 'weather': 'Light Rain', 'time': None, 'mealPeriod': '晚餐'},
+    ]
+    results = [canonicalizer.canonicalize(fields) for fields in requests]
+    assert results[0] == {'location': '广州', 'weather': '雨', 'time': '16:00-22:00', 'mealPeriod': '晚餐'}
+    assert results[1] == results[2] == results[0]
+    # 不修改传入的参数
+    assert requests[0]['location'] == '广东省广州市天河区'
+
+    stats = canonicalizer.stats()
+    assert stats['requests'] == 3 and stats['rewritten'] == 3
+    assert stats['distinct_raw'] == 3 and stats['distinct_canonical'] == 1
+    assert stats['key_reduction'] == pytest.approx(2 / 3, abs=1e-4)
+
+
+def test_canonicalize_keeps_unknown_location(gazetteer):
+    canonicalizer = FieldCanonicalizer(gazetteer, enabled=True)
+    result = canonicalizer.canonicalize({'location': '火星基地', 'weather': '', 'time': ''})
+    assert result['location'] == '火星基地'
+    assert canonicalizer.stats()['unknown_locations'] == 1
+
+
+def test_canonicalize_disabled_returns_fields(gazetteer):
+    fields = {'location': '广东省广州市天河区', 'weather': '小雨'}
+    assert FieldCanonicalizer(gazetteer, enabled=False).canonicalize(fields) is fields
+
+
+@pytest.mark.parametrize('enabled', [True, False])
+@pytest.mark.parametrize('fields', [
+    {'location': 123},
+    {'weather': ['雨']},
+    {'time': 1800},
+    {'mealPeriod': {'name': '晚餐'}},
+])
+def test_canonicalize_rejects_non_string_fields(gazetteer, fields, enabled):
+    with pytest.raises(ValueError, match='must be a string'):
+        FieldCanonicalizer(gazetteer, enabled=enabled).canonicalize(fields)
+
+
+def test_lookup_rejects_non_string(gazetteer):
+    with pytest.raises(ValueError):
+        gazetteer.lookup(123)
+    with pytest.raises(ValueError):
+        canonical_weather(1)
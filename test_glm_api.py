@@ -46,16 +46,16 @@ def get_solar_term(month, day):
 
 def load_prompt():
     """加载prompt文件"""
-    prompt_path = os.path.join(os.path.dirname(__file__), 'prompts', 'food_recommendation_prompt.txt')
+    from prompt_templates import FOOD_TEMPLATE, PromptTemplateStore
+
+    store = PromptTemplateStore()
+    prompt_path = os.path.join(store.directory, FOOD_TEMPLATE)
 
     if not os.path.exists(prompt_path):
         print(f"[ERROR] Prompt文件不存在: {prompt_path}")
         return None
 
-    with open(prompt_path, 'r', encoding='utf-8') as f:
-        prompt = f.read()
-
-    # 替换变量
+    # 替换变量（模板预解析为占位符片段，一次渲染完成）
     now = datetime.now()
     params = {
         'date': now.strftime('%Y-%m-%d'),
@@ -67,8 +67,7 @@ def load_prompt():
         'season': get_season(now.month)
     }
 
-    for key, value in params.items():
-        prompt = prompt.replace(f'{{{key}}}', value)
+    prompt = store.get(FOOD_TEMPLATE).render(params)
 
     return prompt, params
 
@@ -106,29 +105,19 @@ def parse_json_response(content):
     print("解析JSON响应")
     print("="*60)
 
-    # 方法1: 提取```json```代码块
-    import re
-    json_match = re.search(r'```json\s*([\s\S]*?)\s*```', content)
-    if json_match:
-        print("[INFO] 使用方法1: 提取```json```代码块")
-        try:
-            return json.loads(json_match.group(1))
-        except json.JSONDecodeError as e:
-            print(f"[ERROR] 方法1解析失败: {e}")
-
-    # 方法2: 提取第一个{和最后一个}之间的内容
-    first_brace = content.find('{')
-    last_brace = content.rfind('}')
-    if first_brace != -1 and last_brace != -1 and last_brace > first_brace:
-        print("[INFO] 使用方法2: 提取{{}}之间的内容")
-        try:
-            json_str = content[first_brace:last_brace + 1]
-            return json.loads(json_str)
-        except json.JSONDecodeError as e:
-            print(f"[ERROR] 方法2解析失败: {e}")
-
-    print("[ERROR] 所有JSON解析方法都失败")
-    return None
+    # 单次扫描提取```json```代码块或最外层对象，被截断时补全已完整的部分
+    from recommendation_parser import RecommendationJSONScanner
+
+    scanner = RecommendationJSONScanner()
+    scanner.feed(content)
+    data, truncated = scanner.finish()
+    if data is None:
+        print("[ERROR] 所有JSON解析方法都失败")
+        return None
+
+    if truncated:
+        print("[WARN] 返回内容被截断，已补全未闭合的数组和对象")
+    return data
 
 def check_json_structure(data):
     """检查JSON结构"""
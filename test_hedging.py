@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+对冲请求测试 - 主模型超过等待时间未返回首字时切换到备用模型，备用请求额外占用一个准入名额，
+没有空闲名额时不对冲；主模型失败时改用备用模型
+
+用法:
+    python -m pytest test_hedging.py
+"""
+
+import types
+import asyncio
+import threading
+
+import pytest
+
+from admission import AdmissionController, AsyncAdmissionController
+from hedging import HedgePolicy, LatencyTracker
+
+PRIMARY = 'glm-4-plus'
+BACKUP = 'glm-4-flash'
+USAGE = types.SimpleNamespace(input_tokens=10, output_tokens=20)
+
+
+class FakeStream:
+    """client.messages.stream()返回的流：slow为True时在被关闭前不返回任何内容"""
+
+    def __init__(self, text, slow=False, error=None):
+        self.text = text
+        self.slow = slow
+        self.error = error
+        self.closed = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @property
+    def text_stream(self):
+        if self.error is not None:
+            raise self.error
+        if self.slow:
+            self.closed.wait(5)
+            yield ''
+            return
+        yield from self.text
+
+    def get_final_message(self):
+        return types.SimpleNamespace(usage=USAGE)
+
+    def close(self):
+        self.closed.set()
+
+
+class AsyncFakeStream(FakeStream):
+    """异步版本的流；gate为asyncio.Event时等到它被设置后才返回内容"""
+
+    def __init__(self, text, slow=False, error=None, gate=None):
+        super().__init__(text, slow, error)
+        self.gate = gate
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    @property
+    async def text_stream(self):
+        if self.error is not None:
+            raise self.error
+        if self.slow:
+            await asyncio.sleep(5)
+        if self.gate is not None:
+            await self.gate.wait()
+        for text in self.text:
+            yield text
+
+    async def get_final_message(self):
+        return types.SimpleNamespace(usage=USAGE)
+
+
+class FakeClient:
+    """按模型返回预设的流，并记录调用过的模型"""
+
+    def __init__(self, streams, stream_class=FakeStream):
+        self.streams = streams
+        self.stream_class = stream_class
+        self.calls = []
+        self.messages = self
+
+    def stream(self, model, **kwargs):
+        self.calls.append(model)
+        return self.stream_class(**self.streams[model])
+
+
+def make_policy():
+    return HedgePolicy(LatencyTracker(), backup_model=BACKUP, default_delay=0.05)
+
+
+SLOW_PRIMARY = {PRIMARY: {'text': ['主模型'], 'slow': True}, BACKUP: {'text': ['备用', '模型']}}
+
+
+# ---------- 同步版本 ----------
+
+def test_primary_answers_before_delay():
+    policy = make_policy()
+    client = FakeClient({PRIMARY: {'text': ['主', '模型']}, BACKUP: {'text': ['备用']}})
+    assert policy.call(client, PRIMARY, max_tokens=100) == ('主模型', PRIMARY)
+    assert client.calls == [PRIMARY]
+    assert policy.stats()['hedged'] == 0 and policy.stats()['primary_wins'] == 1
+
+
+def test_slow_primary_cuts_over_to_backup():
+    policy = make_policy()
+    client = FakeClient(SLOW_PRIMARY)
+    controller = AdmissionController(max_concurrent=2, rpm=6000, burst=10)
+    with controller.slot():
+        assert policy.call(client, PRIMARY, admission=controller) == ('备用模型', BACKUP)
+        # 备用请求的名额在返回前已释放
+        assert controller.stats()['in_flight'] == 1
+    assert client.calls == [PRIMARY, BACKUP]
+    assert policy.stats()['hedged'] == 1 and policy.stats()['backup_wins'] == 1
+    assert controller.stats()['extra_admitted'] == 1 and controller.stats()['in_flight'] == 0
+
+
+def test_no_free_slot_skips_hedge():
+    policy = make_policy()
+    controller = AdmissionController(max_concurrent=1, rpm=6000, burst=10)
+    skipped = threading.Event()
+    skip = policy._skip
+    policy._skip = lambda *args: (skip(*args), skipped.set())
+
+    class GatedClient(FakeClient):
+        def stream(self, model, **kwargs):
+            # 主模型在决定不对冲之后才返回首字
+            skipped.wait(5)
+            return super().stream(model, **kwargs)
+
+    client = GatedClient({PRIMARY: {'text': ['主模型']}})
+    with controller.slot():
+        assert policy.call(client, PRIMARY, admission=controller) == ('主模型', PRIMARY)
+    assert client.calls == [PRIMARY]
+    assert policy.stats()['skipped'] == 1 and policy.stats()['hedged'] == 0
+    assert controller.stats()['extra_denied'] == 1
+
+
+def test_primary_failure_falls_back_to_backup():
+    policy = make_policy()
+    client = FakeClient({PRIMARY: {'text': [], 'error': ConnectionError('reset')},
+                         BACKUP: {'text': ['备用']}})
+    controller = AdmissionController(max_concurrent=1, rpm=6000, burst=10)
+    with controller.slot():
+        # 主模型已结束，备用模型沿用调用方的名额
+        assert policy.call(client, PRIMARY, admission=controller) == ('备用', BACKUP)
+    assert controller.stats()['extra_admitted'] == 0
+
+
+def test_all_failures_raise_primary_error():
+    policy = make_policy()
+    client = FakeClient({PRIMARY: {'text': [], 'error': ConnectionError('primary')},
+                         BACKUP: {'text': [], 'error': ConnectionError('backup')}})
+    with pytest.raises(ConnectionError, match='primary'):
+        policy.call(client, PRIMARY)
+
+
+# ---------- 异步版本 ----------
+
+def test_async_slow_primary_cuts_over_to_backup():
+    async def main():
+        policy = make_policy()
+        client = FakeClient(SLOW_PRIMARY, AsyncFakeStream)
+        controller = AsyncAdmissionController(max_concurrent=2, rpm=6000, burst=10)
+        async with controller.slot():
+            result = await policy.acall(client, PRIMARY, admission=controller)
+            assert controller.stats()['in_flight'] == 1
+        return result, client, policy, controller
+
+    result, client, policy, controller = asyncio.run(main())
+    assert result == ('备用模型', BACKUP)
+    assert client.calls == [PRIMARY, BACKUP]
+    assert policy.stats()['backup_wins'] == 1
+    assert controller.stats()['extra_admitted'] == 1 and controller.stats()['in_flight'] == 0
+
+
+def test_async_no_free_slot_skips_hedge():
+    async def main():
+        policy = make_policy()
+        skipped = asyncio.Event()
+        skip = policy._skip
+        policy._skip = lambda *args: (skip(*args), skipped.set())
+        # 主模型在决定不对冲之后才返回首字
+        client = FakeClient({PRIMARY: {'text': ['主模型'], 'gate': skipped}}, AsyncFakeStream)
+        controller = AsyncAdmissionController(max_concurrent=1, rpm=6000, burst=10)
+        async with controller.slot():
+            result = await policy.acall(client, PRIMARY, admission=controller)
+        return result, client, policy, controller
+
+    result, client, policy, controller = asyncio.run(main())
+    assert result == ('主模型', PRIMARY)
+    assert client.calls == [PRIMARY]
+    assert policy.stats()['skipped'] == 1
+    assert controller.stats()['extra_denied'] == 1
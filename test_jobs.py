@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+任务队列测试 - 进程内、SQLite和共享后端三种任务存储的提交、领取、完成、重新排队和过期领取，
+以及JobWorkerPool对成功、失败和服务繁忙的处理
+
+用法:
+    python -m pytest test_jobs.py
+"""
+
+import time
+import threading
+
+import pytest
+
+from admission import Overloaded
+from jobs import (JobWorkerPool, MemoryJobStore, SharedJobStore, SQLiteJobStore, job_response,
+                  job_submitted_response)
+from shared_backend import LocalBackend, RedisBackend, RespClient
+from test_shared_backend import resp_server
+
+PARAMS = {'prompt': '小寒 北京 晚餐', 'model': 'glm-4-flash'}
+RESULT = {'success': True, 'content': '{"dishes": []}'}
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'shared-local', 'shared-redis'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        yield MemoryJobStore()
+    elif request.param == 'sqlite':
+        yield SQLiteJobStore(str(tmp_path / 'jobs.db'))
+    elif request.param == 'shared-local':
+        yield SharedJobStore(LocalBackend())
+    else:
+        with resp_server() as server:
+            yield SharedJobStore(RedisBackend(RespClient('127.0.0.1', server.server_address[1])))
+
+
+@pytest.fixture(params=['sqlite', 'shared'])
+def shared_stores(request, tmp_path):
+    """同一存储的两个实例，模拟两个节点"""
+    if request.param == 'sqlite':
+        path = str(tmp_path / 'jobs.db')
+        return SQLiteJobStore(path), SQLiteJobStore(path)
+    backend = LocalBackend()
+    return SharedJobStore(backend), SharedJobStore(backend)
+
+
+# ---------- 任务存储 ----------
+
+def test_job_lifecycle(store):
+    job = store.create(PARAMS)
+    assert job['status'] == 'queued' and job['attempts'] == 0
+    assert store.get(job['id'])['params'] == PARAMS
+    assert store.pending() == 1
+
+    claimed = store.claim(timeout=0)
+    assert claimed['id'] == job['id']
+    assert claimed['status'] == 'running' and claimed['attempts'] == 1
+    assert store.get(job['id'])['status'] == 'running'
+    assert store.claim(timeout=0) is None
+    assert store.pending() == 1
+
+    store.finish(job['id'], result=RESULT)
+    done = store.get(job['id'])
+    assert done['status'] == 'done' and done['result'] == RESULT
+    assert done['finished_at'] >= done['started_at'] >= done['created_at']
+    assert store.pending() == 0
+
+
+def test_job_failure(store):
+    job = store.create(PARAMS)
+    store.claim(timeout=0)
+    store.finish(job['id'], error='Empty response from API')
+    failed = store.get(job['id'])
+    assert failed['status'] == 'failed' and failed['error'] == 'Empty response from API'
+    assert failed['result'] is None
+
+
+def test_claim_in_submission_order(store):
+    jobs = [store.create({'prompt': str(i)}) for i in range(3)]
+    assert [store.claim(timeout=0)['id'] for _ in range(3)] == [job['id'] for job in jobs]
+
+
+def test_requeue_delays_next_claim(store):
+    job = store.create(PARAMS)
+    store.claim(timeout=0)
+    store.requeue(job['id'], 0.3)
+    assert store.get(job['id'])['status'] == 'queued'
+    assert store.claim(timeout=0) is None
+
+    start = time.time()
+    claimed = store.claim(timeout=2)
+    assert claimed['id'] == job['id'] and claimed['attempts'] == 2
+    assert time.time() - start >= 0.2
+
+
+def test_get_missing_job(store):
+    assert store.get('0' * 32) is None
+
+
+def test_wait_returns_when_finished(store):
+    job = store.create(PARAMS)
+    store.claim(timeout=0)
+    threading.Timer(0.1, store.finish, args=(job['id'],), kwargs={'result': RESULT}).start()
+    assert store.wait(job['id'], timeout=5)['status'] == 'done'
+
+
+def test_cleanup_removes_finished_jobs(tmp_path):
+    for store in (MemoryJobStore(), SQLiteJobStore(str(tmp_path / 'jobs.db'))):
+        finished, pending = store.create(PARAMS), store.create(PARAMS)
+        store.claim(timeout=0)
+        store.finish(finished['id'], result=RESULT)
+        time.sleep(0.01)
+        assert store.cleanup(ttl=0) == 1
+        assert store.get(finished['id']) is None
+        assert store.get(pending['id'])['status'] == 'queued'
+
+
+def test_job_claimed_by_one_node(shared_stores):
+    first, second = shared_stores
+    job = first.create(PARAMS)
+    assert second.get(job['id'])['status'] == 'queued'
+    claims = [second.claim(timeout=0), first.claim(timeout=0)]
+    assert [claim['id'] if claim else None for claim in claims] == [job['id'], None]
+    second.finish(job['id'], result=RESULT)
+    assert first.get(job['id'])['result'] == RESULT
+
+
+def test_stale_running_job_reclaimed(shared_stores):
+    first, second = shared_stores
+    job = first.create(PARAMS)
+    first.claim(timeout=0)
+    # 领取任务的节点退出：超过running_timeout后其他节点重新领取
+    second.running_timeout = 0
+    time.sleep(0.01)
+    claimed = second.claim(timeout=0)
+    assert claimed['id'] == job['id'] and claimed['attempts'] == 2
+
+
+def test_shared_store_blocking_follows_backend():
+    assert SharedJobStore(LocalBackend()).blocking is False
+    assert SharedJobStore(RedisBackend(RespClient())).blocking is True
+    assert MemoryJobStore.blocking is False and SQLiteJobStore.blocking is True
+
+
+# ---------- JobWorkerPool ----------
+
+def run_one(store, handler):
+    pool = JobWorkerPool(store, handler, workers=1)
+    job = store.create(PARAMS)
+    pool._run(store.claim(timeout=0))
+    return pool, store.get(job['id'])
+
+
+def test_worker_completes_job():
+    pool, job = run_one(MemoryJobStore(), lambda params: dict(RESULT, prompt=params['prompt']))
+    assert job['status'] == 'done' and job['result']['prompt'] == PARAMS['prompt']
+    assert pool.stats()['completed'] == 1
+
+
+def test_worker_records_failure():
+    def handler(params):
+        raise ValueError('Empty response from API')
+
+    pool, job = run_one(MemoryJobStore(), handler)
+    assert job['status'] == 'failed' and job['error'] == 'Empty response from API'
+    assert pool.stats()['failed'] == 1
+
+
+def test_worker_requeues_when_overloaded():
+    def handler(params):
+        raise Overloaded('queue_full', 3)
+
+    pool, job = run_one(MemoryJobStore(), handler)
+    assert job['status'] == 'queued'
+    assert job['available_at'] >= time.time() + 2
+    assert pool.stats()['requeued'] == 1
+
+
+def test_worker_fails_after_max_attempts(monkeypatch):
+    monkeypatch.setattr('jobs.JOB_MAX_ATTEMPTS', 1)
+
+    def handler(params):
+        raise Overloaded('rate_limited', 1)
+
+    pool, job = run_one(MemoryJobStore(), handler)
+    assert job['status'] == 'failed' and job['error'] == 'Server busy (rate_limited)'
+
+
+def test_worker_pool_threads_run_jobs():
+    store = MemoryJobStore()
+    pool = JobWorkerPool(store, lambda params: RESULT, workers=2)
+    pool.start()
+    try:
+        jobs = [store.create(PARAMS) for _ in range(4)]
+        assert all(store.wait(job['id'], timeout=5)['status'] == 'done' for job in jobs)
+    finally:
+        pool.stop()
+
+
+# ---------- 响应内容 ----------
+
+def test_job_responses():
+    store = MemoryJobStore()
+    job = store.create(PARAMS)
+    submitted = job_submitted_response(job)
+    assert submitted['status_url'] == f"/api/jobs/{job['id']}"
+    assert submitted['events_url'] == f"/api/jobs/{job['id']}/events"
+    assert 'result' not in job_response(job)
+
+    store.claim(timeout=0)
+    store.finish(job['id'], result=RESULT)
+    assert job_response(store.get(job['id']))['result'] == RESULT
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+API Key池测试 - Key的读取顺序和去重、按负载选择Key、每分钟调用数上限，
+429/401后的冷却，以及调用失败时立即换用其他Key
+
+用法:
+    python -m pytest test_key_pool.py
+"""
+
+import types
+import asyncio
+
+import anthropic
+import httpx
+import pytest
+
+import key_pool
+from key_pool import AsyncPooledClient, KeyPool, PooledClient, load_api_keys
+from retry_policy import RetryPolicy
+
+REQUEST = httpx.Request('POST', 'https://open.bigmodel.cn/api/anthropic/v1/messages')
+
+
+def api_error(cls, status, headers=None):
+    return cls('upstream error', response=httpx.Response(status, headers=headers or {}, request=REQUEST),
+               body=None)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """替换key_pool中的时钟，冷却和每分钟调用数按clock[0]计时；sleep只推进时钟"""
+    now = [1000.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    monkeypatch.setattr(key_pool, 'time', types.SimpleNamespace(monotonic=lambda: now[0], sleep=sleep))
+    return now
+
+
+class FakeMessages:
+    """按顺序返回预设的结果，异常则抛出"""
+
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+class AsyncFakeMessages(FakeMessages):
+    async def create(self, **kwargs):
+        return super().create(**kwargs)
+
+
+def make_pool(outcomes=None, messages_class=FakeMessages, **options):
+    """每个Key一个FakeMessages，outcomes为{api_key: [结果...]}"""
+    outcomes = outcomes or {'sk-aaaa': [], 'sk-bbbb': []}
+    clients = {key: types.SimpleNamespace(messages=messages_class(list(results)))
+               for key, results in outcomes.items()}
+    pool = KeyPool(list(outcomes), lambda api_key, **kwargs: clients[api_key], **options)
+    return pool, clients
+
+
+# ---------- 读取Key ----------
+
+def test_load_api_keys_order_and_dedup(tmp_path):
+    key_file = tmp_path / 'keys.txt'
+    key_file.write_text('# 备用Key\nsk-file\n\nsk-one\n', encoding='utf-8')
+    environ = {
+        'ZHIPU_API_KEY': 'sk-one',
+        'ZHIPU_API_KEYS': 'sk-two, sk-three,,',
+        'ZHIPU_API_KEY_10': 'sk-ten',
+        'ZHIPU_API_KEY_2': 'sk-second',
+        'ZHIPU_API_KEY_FILE': str(key_file),
+    }
+    assert load_api_keys(environ) == ['sk-one', 'sk-two', 'sk-three', 'sk-second', 'sk-ten', 'sk-file']
+    assert load_api_keys({}) == []
+
+
+def test_pool_requires_a_key():
+    with pytest.raises(ValueError):
+        KeyPool([], lambda **kwargs: None)
+
+
+# ---------- 选择Key ----------
+
+def test_acquire_least_loaded(clock):
+    pool, _ = make_pool(max_concurrent=2, rpm=0)
+    first = pool.acquire()
+    second = pool.acquire()
+    assert first is not second
+    # 释放后按调用次数轮换
+    pool.release(first)
+    pool.release(second)
+    assert pool.acquire() is first
+    assert pool.acquire() is second
+    assert [k['in_flight'] for k in pool.stats()['keys']] == [1, 1]
+
+
+def test_rpm_limit_makes_key_unavailable(clock):
+    pool, _ = make_pool({'sk-aaaa': []}, rpm=2, max_concurrent=0)
+    key = pool.acquire()
+    pool.release(key)
+    pool.acquire()
+    assert pool.stats()['available'] == 0
+    clock[0] += 60
+    assert pool.stats()['keys'][0]['requests_last_minute'] == 0
+    assert pool.stats()['available'] == 1
+
+
+# ---------- 冷却 ----------
+
+def test_rate_limit_cooldown_uses_retry_after(clock):
+    pool, _ = make_pool(cooldown=30, rpm=0)
+    key = pool.acquire()
+    pool.release(key, api_error(anthropic.RateLimitError, 429, {'retry-after': '12'}))
+    stats = pool.stats()['keys'][0]
+    assert stats['rate_limited'] == 1 and stats['cooldown_remaining'] == 12 and not stats['available']
+
+    # 冷却中的Key不再被选中
+    assert all(pool.acquire() is not key for _ in range(3))
+    clock[0] += 12
+    assert pool.stats()['keys'][0]['available']
+
+
+def test_rate_limit_cooldown_default(clock):
+    pool, _ = make_pool(cooldown=30, rpm=0)
+    key = pool.acquire()
+    pool.release(key, api_error(anthropic.RateLimitError, 429))
+    assert pool.stats()['keys'][0]['cooldown_remaining'] == 30
+
+
+def test_auth_error_cooldown(clock):
+    pool, _ = make_pool(auth_cooldown=600, rpm=0)
+    key = pool.acquire()
+    pool.release(key, api_error(anthropic.AuthenticationError, 401))
+    assert pool.stats()['keys'][0]['cooldown_remaining'] == 600
+
+
+def test_server_error_no_cooldown(clock):
+    pool, _ = make_pool(rpm=0)
+    key = pool.acquire()
+    pool.release(key, api_error(anthropic.InternalServerError, 500))
+    stats = pool.stats()['keys'][0]
+    assert stats['errors'] == 1 and stats['available']
+
+
+def test_all_cooling_picks_earliest(clock):
+    pool, _ = make_pool(rpm=0)
+    first, second = pool.acquire(), pool.acquire()
+    pool.release(first, api_error(anthropic.RateLimitError, 429, {'retry-after': '50'}))
+    pool.release(second, api_error(anthropic.RateLimitError, 429, {'retry-after': '10'}))
+    assert pool.stats()['available'] == 0
+    assert pool.acquire() is second
+
+
+# ---------- 换Key重试 ----------
+
+def test_rate_limited_key_fails_over_immediately(clock):
+    pool, clients = make_pool({
+        'sk-aaaa': [api_error(anthropic.RateLimitError, 429, {'retry-after': '20'})],
+        'sk-bbbb': ['ok'],
+    }, rpm=0)
+    client = PooledClient(pool, RetryPolicy(max_attempts=3))
+    assert client.messages.create(model='glm-4-flash', max_tokens=10) == 'ok'
+    assert clock[0] == 1000.0  # 换Key不等待
+    stats = pool.stats()
+    assert stats['failovers'] == 1
+    assert [k['in_flight'] for k in stats['keys']] == [0, 0]
+    assert stats['keys'][0]['cooldown_remaining'] == 20
+
+
+def test_single_key_429_backs_off(clock):
+    pool, clients = make_pool({'sk-aaaa': [api_error(anthropic.RateLimitError, 429, {'retry-after': '2'}),
+                                           'ok']}, rpm=0)
+    client = PooledClient(pool, RetryPolicy(max_attempts=3, base_delay=0.1))
+    assert client.messages.create(model='glm-4-flash', max_tokens=10) == 'ok'
+    # 只有一个Key：按Retry-After退避后重试同一个Key
+    assert clock[0] >= 1002.0
+    assert pool.stats()['failovers'] == 0
+
+
+def test_async_fails_over(clock):
+    pool, clients = make_pool({
+        'sk-aaaa': [api_error(anthropic.AuthenticationError, 401)],
+        'sk-bbbb': ['ok'],
+    }, messages_class=AsyncFakeMessages, rpm=0)
+    client = AsyncPooledClient(pool, RetryPolicy(max_attempts=3))
+    assert asyncio.run(client.messages.create(model='glm-4-flash', max_tokens=10)) == 'ok'
+    assert pool.stats()['failovers'] == 1
+    assert clients['sk-aaaa'].messages.calls == 1
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推荐结果缓存测试 - 缓存键的规范化、TTL过期、LRU淘汰和按字节数限制的总容量，
+以及软/硬TTL：超过软TTL返回过期结果并在后台只刷新一次，繁忙时降级返回硬TTL内的过期结果
+
+用法:
+    python -m pytest test_recommendation_cache.py
+"""
+
+import time
+import types
+
+import pytest
+
+import recommendation_cache
+from recommend_service import cached_result, degraded_result
+from recommendation_cache import RecommendationCache, make_cache_key
+from single_flight import SingleFlight
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """替换recommendation_cache中的time.time，缓存按clock[0]计时"""
+    now = [1000.0]
+    monkeypatch.setattr(recommendation_cache, 'time', types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+# ---------- 缓存键 ----------
+
+def test_cache_key_normalizes_prompt():
+    key = make_cache_key('小寒 北京\n晚餐', 'glm-4-flash', 0.7, 'v1', 2000)
+    assert make_cache_key('  小寒 北京\r\n晚餐\n', 'glm-4-flash', 0.70001, 'v1', 2000) == key
+    assert len(key) == 64
+
+
+@pytest.mark.parametrize('changed', [
+    {'model': 'glm-4-plus'}, {'temperature': 0.9}, {'prompt_version': 'v2'}, {'max_tokens': 4000},
+])
+def test_cache_key_depends_on_parameters(changed):
+    params = {'prompt': '小寒 北京 晚餐', 'model': 'glm-4-flash', 'temperature': 0.7,
+              'prompt_version': 'v1', 'max_tokens': 2000}
+    assert make_cache_key(**dict(params, **changed)) != make_cache_key(**params)
+
+
+# ---------- TTL ----------
+
+def test_entry_expires_after_ttl(clock):
+    cache = RecommendationCache(ttl=60)
+    cache.set('a', '羊肉汤')
+    clock[0] += 59
+    assert cache.get('a') == '羊肉汤'
+    clock[0] += 1
+    assert cache.get('a') is None
+
+    stats = cache.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1 and stats['expirations'] == 1
+    assert stats['hit_ratio'] == 0.5
+
+
+def test_per_entry_ttl(clock):
+    cache = RecommendationCache(ttl=60)
+    cache.set('short', 'value', ttl=10)
+    cache.set('long', 'value', ttl=600)
+    clock[0] += 100
+    assert cache.get('short') is None
+    assert cache.get('long') == 'value'
+
+
+def test_set_overwrites_entry(clock):
+    cache = RecommendationCache(ttl=60)
+    cache.set('a', 'old')
+    clock[0] += 50
+    cache.set('a', 'new')
+    clock[0] += 50
+    assert cache.get('a') == 'new'
+    assert cache.stats()['entries'] == 1 and cache.stats()['bytes'] == 3
+
+
+def test_delete_and_clear():
+    cache = RecommendationCache()
+    cache.set('a', 'value')
+    cache.set('b', 'value')
+    cache.delete('a')
+    cache.delete('missing')
+    assert cache.get('a') is None and cache.get('b') == 'value'
+    cache.clear()
+    assert cache.stats()['entries'] == 0 and cache.stats()['bytes'] == 0
+
+
+# ---------- 容量和LRU ----------
+
+def test_size_counts_utf8_bytes():
+    cache = RecommendationCache()
+    cache.set('text', '小米粥')
+    cache.set('dict', {'a': 1})
+    assert cache.stats()['bytes'] == 9 + len('{"a": 1}')
+
+
+def test_byte_cap_evicts_least_recently_used():
+    cache = RecommendationCache(max_bytes=30)
+    for key in ('a', 'b', 'c'):
+        cache.set(key, 'x' * 10)
+    # 读取a后，最久未使用的是b
+    assert cache.get('a') is not None
+    cache.set('d', 'x' * 10)
+
+    assert cache.get('b') is None
+    assert all(cache.get(key) is not None for key in ('a', 'c', 'd'))
+    stats = cache.stats()
+    assert stats['evictions'] == 1 and stats['bytes'] == 30
+
+
+def test_large_entry_evicts_several():
+    cache = RecommendationCache(max_bytes=30)
+    for key in ('a', 'b', 'c'):
+        cache.set(key, 'x' * 10)
+    cache.set('big', 'x' * 25)
+    assert [cache.get(key) is not None for key in ('a', 'b', 'c', 'big')] == [False, False, False, True]
+    assert cache.stats()['evictions'] == 3
+
+
+def test_entry_over_cap_not_cached():
+    cache = RecommendationCache(max_bytes=10)
+    cache.set('a', 'x' * 5)
+    assert cache.set('big', 'x' * 11) is False
+    assert cache.get('big') is None
+    # 不因放不下的条目淘汰已有条目
+    assert cache.get('a') == 'x' * 5 and cache.stats()['evictions'] == 0
+
+
+# ---------- 软/硬TTL（stale-while-revalidate） ----------
+
+def test_hard_ttl_not_shorter_than_ttl():
+    assert RecommendationCache(ttl=60).hard_ttl == 60
+    assert RecommendationCache(ttl=60, hard_ttl=10).hard_ttl == 60
+    assert RecommendationCache(ttl=60, hard_ttl=600).hard_ttl == 600
+
+
+def test_lookup_fresh_stale_expired(clock):
+    cache = RecommendationCache(ttl=60, hard_ttl=600)
+    cache.set('a', '羊肉汤')
+    assert cache.lookup('a') == ('羊肉汤', 'fresh')
+    assert cache.is_fresh('a')
+
+    clock[0] += 60
+    assert cache.lookup('a') == ('羊肉汤', 'stale')
+    assert not cache.is_fresh('a')
+    # 普通读取不返回过期结果，降级读取在硬TTL内仍可返回
+    assert cache.get('a') is None
+    assert cache.get('a', allow_expired=True) == '羊肉汤'
+
+    clock[0] += 540
+    assert cache.lookup('a') == (None, None)
+    assert cache.lookup('missing') == (None, None)
+
+    stats = cache.stats()
+    assert stats['hits'] == 1 and stats['stale_hits'] == 2
+    assert stats['expirations'] == 2 and stats['misses'] == 3
+
+
+def test_refresh_makes_entry_fresh(clock):
+    cache = RecommendationCache(ttl=60, hard_ttl=600)
+    cache.set('a', 'old')
+    clock[0] += 100
+    assert cache.lookup('a')[1] == 'stale'
+    cache.set('a', 'new')
+    assert cache.lookup('a') == ('new', 'fresh')
+
+
+def test_per_entry_hard_ttl(clock):
+    cache = RecommendationCache(ttl=60, hard_ttl=600)
+    cache.set('a', 'value', ttl=0, hard_ttl=30)
+    assert cache.lookup('a') == ('value', 'stale')
+    clock[0] += 30
+    assert cache.lookup('a') == (None, None)
+
+
+def test_stale_result_and_degraded_result():
+    params = {'model': 'glm-4-flash'}
+    assert cached_result(params, 'k' * 64, '羊肉汤', 'fresh')['source'] == 'cache'
+    assert cached_result(params, 'k' * 64, '羊肉汤', 'stale') == {
+        'content': '羊肉汤', 'source': 'stale', 'model': 'glm-4-flash'}
+    assert cached_result(params, 'k' * 64, None, None) is None
+    assert degraded_result(params, 'k' * 64, '羊肉汤')['source'] == 'stale'
+    assert degraded_result(params, 'k' * 64, None) is None
+
+
+def test_background_refresh_runs_once_per_key():
+    flight = SingleFlight()
+    calls = []
+
+    def refresh():
+        calls.append(1)
+        # 等到下面的do()加入等待后再完成
+        for _ in range(500):
+            if flight.shared:
+                break
+            time.sleep(0.01)
+        return 'new'
+
+    # 刷新期间再次命中过期结果不会重复刷新，同key的do()共享后台刷新的结果
+    assert flight.do_background('a', refresh) is True
+    assert flight.do_background('a', refresh) is False
+    assert flight.do('a', lambda: 'other') == ('new', True)
+    assert calls == [1]
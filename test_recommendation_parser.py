@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推荐结果解析测试 - ```json代码块优先、逐段feed与一次feed结果一致、截断补全
+
+用法:
+    python -m pytest test_recommendation_parser.py
+"""
+
+import json
+
+import pytest
+
+import recommendation_parser
+from recommendation_parser import RecommendationJSONScanner, parse_recommendation
+
+RECOMMENDATION = {
+    'dishes': [
+        {'name': '山药排骨汤', 'ingredients': ['山药', '排骨'], 'steps': ['焯水', '炖煮 "40" 分钟\\n']},
+        {'name': '小米粥', 'ingredients': ['小米'], 'steps': ['熬煮{30}分钟']}
+    ],
+    'reasoning': '小寒时节宜温补 [健脾]',
+    'tips': ['少食生冷']
+}
+BODY = json.dumps(RECOMMENDATION, ensure_ascii=False, indent=2)
+
+
+def feed_chunks(text, size):
+    scanner = RecommendationJSONScanner()
+    for i in range(0, len(text), size):
+        scanner.feed(text[i:i + size])
+    return scanner
+
+
+@pytest.mark.parametrize('content', [
+    BODY,
+    f'```json\n{BODY}\n```',
+    f'以下是推荐：\n```json\n{BODY}\n```\n祝您用餐愉快',
+    # 代码块之前的说明文字中有花括号时使用代码块中的对象
+    f'格式为{{"dishes": [...]}}，推荐如下：\n```json\n{BODY}\n```',
+    # 代码块出现在一个完整对象之后
+    f'{{"note": "示例"}}\n```json\n{BODY}\n```',
+])
+@pytest.mark.parametrize('size', [1, 3, 7, 64, 100000])
+def test_parse_fenced_and_plain(content, size):
+    recommendation, truncated = feed_chunks(content, size).finish_recommendation()
+    assert truncated is False
+    assert recommendation['dishes'] == RECOMMENDATION['dishes']
+    assert recommendation['items'] == RECOMMENDATION['dishes']
+
+
+def test_parse_recommendation_prefers_fence():
+    content = f'格式为{{"dishes": []}}\n```json\n{BODY}\n```'
+    recommendation, truncated = parse_recommendation(content)
+    assert len(recommendation['dishes']) == 2 and truncated is False
+
+
+def test_complete_flag():
+    scanner = RecommendationJSONScanner()
+    assert scanner.feed('说明 {"a": 1') is False
+    assert scanner.feed('}') is True
+    assert scanner.complete
+    # 之后出现代码块时改用代码块中的对象，需要继续扫描
+    assert scanner.feed('\n```js') is True
+    assert scanner.feed('on\n{"b": ') is False
+    assert scanner.feed('2}\n```') is True
+    assert scanner.finish() == ({'b': 2}, False)
+
+
+def test_escape_split_across_chunks():
+    scanner = RecommendationJSONScanner()
+    for chunk in ['{"a": "x\\', '"', '}"', '}']:
+        scanner.feed(chunk)
+    assert scanner.finish() == ({'a': 'x"}'}, False)
+
+
+@pytest.mark.parametrize('size', [1, 5, 100000])
+def test_truncated_output_keeps_complete_dishes(size):
+    cut = BODY.index('小米粥') + 5
+    content = '```json\n' + BODY[:cut]
+    recommendation, truncated = feed_chunks(content, size).finish_recommendation()
+    assert truncated is True
+    assert [dish['name'] for dish in recommendation['dishes']] == ['山药排骨汤']
+
+
+def test_no_json():
+    assert parse_recommendation('抱歉，无法生成推荐') == (None, False)
+    assert parse_recommendation('```json\n') == (None, False)
+
+
+class CountingPattern:
+    """包装扫描器使用的正则，统计search实际检查过的字符数"""
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.scanned = 0
+
+    def search(self, text, pos=0):
+        match = self.pattern.search(text, pos)
+        self.scanned += (match.end() if match else len(text)) - pos
+        return match
+
+
+@pytest.mark.parametrize('size', [1, 4, 64, 1000000])
+def test_feed_scans_each_char_once(monkeypatch, size):
+    """逐段feed时每个字符只被检查一次（不随已接收长度重复扫描或拼接）"""
+    structural = CountingPattern(recommendation_parser._STRUCTURAL)
+    string_special = CountingPattern(recommendation_parser._STRING_SPECIAL)
+    monkeypatch.setattr(recommendation_parser, '_STRUCTURAL', structural)
+    monkeypatch.setattr(recommendation_parser, '_STRING_SPECIAL', string_special)
+
+    dishes = [{'name': f'菜品{i}', 'steps': ['步骤 "1"\\' * 5]} for i in range(200)]
+    content = '说明 {"a": 1}\n```json\n' + json.dumps({'dishes': dishes}, ensure_ascii=False) + '\n```'
+    scanner = feed_chunks(content, size)
+
+    assert structural.scanned + string_special.scanned <= len(content)
+    # 文本段在finish()之前不拼接
+    assert len(scanner._chunks) == -(-len(content) // size)
+    recommendation, truncated = scanner.finish_recommendation()
+    assert len(recommendation['dishes']) == 200 and truncated is False
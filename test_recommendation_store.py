@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推荐结果持久化测试 - 默认路径在数据目录下、创建存储时不打开数据库、第一次访问缓存时预加载未过期记录，
+以及写入、删除和过期清理
+
+用法:
+    python -m pytest test_recommendation_store.py
+"""
+
+import os
+import sys
+import time
+import importlib
+import subprocess
+
+import pytest
+
+import recommendation_store
+from recommendation_cache import RecommendationCache
+from recommendation_store import RecommendationStore, decode_value, encode_value
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'data' / 'store.db')
+
+
+def reopen(path, table='recommendations'):
+    """关闭写入线程后用新的存储和缓存读取数据库，模拟服务重启"""
+    cache = RecommendationCache(ttl=60, hard_ttl=120)
+    cache.attach_store(RecommendationStore(path, table=table))
+    return cache
+
+
+def test_default_path_under_data_dir(monkeypatch, tmp_path):
+    monkeypatch.delenv('RECOMMEND_STORE_PATH', raising=False)
+    monkeypatch.setenv('DATA_DIR', str(tmp_path / 'runtime'))
+    try:
+        module = importlib.reload(recommendation_store)
+        assert module.RECOMMEND_STORE_PATH == str(tmp_path / 'runtime' / 'recommendation_store.db')
+        monkeypatch.setenv('RECOMMEND_STORE_PATH', str(tmp_path / 'custom.db'))
+        assert importlib.reload(recommendation_store).RECOMMEND_STORE_PATH == str(tmp_path / 'custom.db')
+    finally:
+        monkeypatch.undo()
+        importlib.reload(recommendation_store)
+
+
+def test_import_does_not_create_database(tmp_path):
+    # 导入服务公用模块（创建缓存和存储）时不创建数据库文件
+    env = dict(os.environ, DATA_DIR=str(tmp_path / 'data'))
+    env.pop('RECOMMEND_STORE_PATH', None)
+    subprocess.run([sys.executable, '-c', 'import api_common; api_common.create_recommendation_cache()'],
+                   cwd=os.path.dirname(os.path.abspath(__file__)), env=env, check=True,
+                   capture_output=True)
+    assert not (tmp_path / 'data').exists()
+
+
+def test_store_opens_lazily(path):
+    store = RecommendationStore(path)
+    cache = RecommendationCache()
+    cache.attach_store(store)
+    assert not os.path.exists(path)
+    assert cache.stats()['store']['path'] == path
+
+    assert cache.get('missing') is None
+    assert os.path.exists(path)
+    store.close()
+
+
+def test_records_survive_restart(path):
+    cache = reopen(path)
+    cache.set('a', {'dishes': ['羊肉汤']}, prompt_version='v1')
+    cache.set('b', 'text')
+    cache.delete('b')
+    cache.store.close()
+
+    restarted = reopen(path)
+    assert restarted.load_store() == 1
+    assert restarted.get('a') == {'dishes': ['羊肉汤']}
+    assert restarted.get('b') is None
+    # 预加载的记录不写回数据库
+    assert restarted.store.stats()['writes'] == 0
+    assert restarted.load_store() == 0
+    restarted.store.close()
+
+
+def test_first_access_preloads(path):
+    cache = reopen(path)
+    cache.set('a', 'value', ttl=0, hard_ttl=60)
+    cache.store.close()
+
+    restarted = reopen(path)
+    # 软TTL已过、硬TTL未过的记录按过期结果返回
+    assert restarted.lookup('a') == ('value', 'stale')
+    assert restarted.stats()['store']['loaded'] == 1
+    restarted.store.close()
+
+
+def test_expired_records_not_loaded(path):
+    store = RecommendationStore(path)
+    store.put('old', 'value', fresh_until=time.time() - 2, expires_at=time.time() - 1)
+    store.put('new', 'value', fresh_until=time.time() + 60, expires_at=time.time() + 60)
+    store.close()
+
+    store = RecommendationStore(path)
+    assert [record[0] for record in store.records()] == ['new']
+    assert store._compact() == 1
+
+
+def test_tables_are_separate(path):
+    for table in ('recommendations', 'translations'):
+        store = RecommendationStore(path, table=table)
+        store.put(table, table, time.time() + 60, time.time() + 60)
+        store.close()
+    assert [r[0] for r in RecommendationStore(path, table='translations').records()] == ['translations']
+
+
+def test_value_encoding_roundtrip():
+    value = {'dishes': [{'name': '小米粥'}], 'tips': ['少食生冷']}
+    assert decode_value(encode_value(value)) == value
+    assert decode_value(encode_value('文本')) == '文本'
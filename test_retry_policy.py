@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上游调用重试测试 - 临时错误的判断、Retry-After解析、带抖动的指数退避，
+以及按请求截止时间放弃重试（剩余时间不足以等待并完成一次调用时不再重试）
+
+用法:
+    python -m pytest test_retry_policy.py
+"""
+
+import types
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import anthropic
+import httpx
+import pytest
+
+import key_pool
+import retry_policy
+from key_pool import KeyPool, PooledClient
+from retry_policy import (DEADLINE_HEADER, REQUEST_DEADLINE, REQUEST_DEADLINE_MAX, Deadline,
+                          DeadlineExceeded, RetryPolicy, is_retryable, retry_after_seconds)
+
+REQUEST = httpx.Request('POST', 'https://open.bigmodel.cn/api/anthropic/v1/messages')
+ERRORS = {400: anthropic.BadRequestError, 401: anthropic.AuthenticationError,
+          408: anthropic.APIStatusError, 429: anthropic.RateLimitError, 500: anthropic.InternalServerError,
+          503: anthropic.InternalServerError}
+
+
+def api_error(status, headers=None):
+    response = httpx.Response(status, headers=headers or {}, request=REQUEST)
+    return ERRORS[status]('upstream error', response=response, body=None)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """替换retry_policy和key_pool中的时钟：sleep不真正等待，只把clock[0]向后推，并记录等待时长"""
+    now = [1000.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    fake = types.SimpleNamespace(monotonic=lambda: now[0], time=lambda: now[0], sleep=sleep)
+    monkeypatch.setattr(retry_policy, 'time', fake)
+    monkeypatch.setattr(key_pool, 'time', fake)
+    return types.SimpleNamespace(now=now, sleeps=sleeps)
+
+
+# ---------- 错误判断和Retry-After ----------
+
+@pytest.mark.parametrize('error, expected', [
+    (anthropic.APIConnectionError(request=REQUEST), True),
+    (anthropic.APITimeoutError(request=REQUEST), True),
+    (api_error(408), True),
+    (api_error(429), True),
+    (api_error(500), True),
+    (api_error(503), True),
+    (api_error(400), False),
+    (api_error(401), False),
+    (ValueError('bad'), False),
+])
+def test_is_retryable(error, expected):
+    assert is_retryable(error) is expected
+
+
+def test_retry_after_seconds():
+    assert retry_after_seconds(api_error(429, {'retry-after-ms': '1500'})) == 1.5
+    assert retry_after_seconds(api_error(429, {'retry-after': '7'})) == 7.0
+    assert retry_after_seconds(api_error(429, {'retry-after': '-3'})) == 0.0
+    assert retry_after_seconds(api_error(429, {'retry-after': 'soon'}), 30) == 30
+    assert retry_after_seconds(api_error(429), 30) == 30
+    assert retry_after_seconds(ValueError('bad'), 30) == 30
+
+
+def test_retry_after_http_date():
+    at = datetime.now(timezone.utc) + timedelta(seconds=120)
+    seconds = retry_after_seconds(api_error(503, {'retry-after': format_datetime(at, usegmt=True)}))
+    assert 115 < seconds <= 120
+
+
+# ---------- 退避 ----------
+
+def test_backoff_bounds(monkeypatch):
+    policy = RetryPolicy(base_delay=0.5, max_delay=3)
+    monkeypatch.setattr(retry_policy.random, 'uniform', lambda low, high: high)
+    assert [policy.backoff(attempt) for attempt in range(1, 6)] == [0.5, 1.0, 2.0, 3.0, 3.0]
+    monkeypatch.setattr(retry_policy.random, 'uniform', lambda low, high: low)
+    assert policy.backoff(3) == 0
+
+
+def test_backoff_not_shorter_than_retry_after(monkeypatch):
+    monkeypatch.setattr(retry_policy.random, 'uniform', lambda low, high: high)
+    policy = RetryPolicy(base_delay=0.5)
+    assert policy.backoff(1, api_error(429, {'retry-after': '4'})) == 4.0
+
+
+def test_next_delay_stops_after_max_attempts():
+    policy = RetryPolicy(max_attempts=3, base_delay=0.01)
+    assert policy.next_delay(api_error(500), 1) is not None
+    assert policy.next_delay(api_error(500), 2) is not None
+    assert policy.next_delay(api_error(500), 3) is None
+    assert policy.stats()['retries'] == 2 and policy.stats()['exhausted'] == 1
+
+
+def test_next_delay_within_deadline(clock, monkeypatch):
+    monkeypatch.setattr(retry_policy.random, 'uniform', lambda low, high: high)
+    policy = RetryPolicy(estimate=lambda model: 3.0, base_delay=1)
+    deadline = Deadline(5)
+    # 等待1秒 + 预计3秒 < 剩余5秒
+    assert policy.next_delay(api_error(500), 1, deadline, 'glm-4-flash') == 1
+    clock.now[0] += 1.5
+    # 等待2秒 + 预计3秒 >= 剩余3.5秒
+    assert policy.next_delay(api_error(500), 2, deadline, 'glm-4-flash') is None
+    assert policy.stats()['deadline_skipped'] == 1
+
+
+def test_next_delay_immediate_failover():
+    policy = RetryPolicy()
+    assert policy.next_delay(api_error(429, {'retry-after': '30'}), 1, immediate=True) == 0.0
+
+
+# ---------- 截止时间 ----------
+
+@pytest.mark.parametrize('headers, expected', [
+    ({DEADLINE_HEADER: '30'}, 30),
+    ({DEADLINE_HEADER: '0.5'}, 0.5),
+    ({}, REQUEST_DEADLINE),
+    ({DEADLINE_HEADER: 'abc'}, REQUEST_DEADLINE),
+    ({DEADLINE_HEADER: '-5'}, REQUEST_DEADLINE),
+    ({DEADLINE_HEADER: 'nan'}, REQUEST_DEADLINE),
+    ({DEADLINE_HEADER: '99999'}, REQUEST_DEADLINE_MAX),
+])
+def test_deadline_from_headers(headers, expected):
+    assert Deadline.from_headers(headers).timeout == expected
+
+
+def test_deadline_remaining(clock):
+    deadline = Deadline(10)
+    clock.now[0] += 4
+    assert deadline.remaining() == 6 and not deadline.expired()
+    clock.now[0] += 6
+    assert deadline.remaining() == 0 and deadline.expired()
+
+
+# ---------- 上游调用 ----------
+
+class FakeMessages:
+    """按顺序返回预设的结果，异常则抛出；记录每次调用的超时参数"""
+
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+        self.timeouts = []
+
+    def create(self, **kwargs):
+        self.timeouts.append(kwargs.get('timeout'))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def pooled_client(outcomes, **policy_options):
+    messages = FakeMessages(outcomes)
+    pool = KeyPool(['sk-test-0001'], lambda **options: types.SimpleNamespace(messages=messages),
+                   rpm=0)
+    return PooledClient(pool, RetryPolicy(**policy_options)), messages
+
+
+def test_retries_transient_errors(clock):
+    client, messages = pooled_client([api_error(500), anthropic.APIConnectionError(request=REQUEST), 'ok'],
+                                     max_attempts=3, base_delay=0.5)
+    assert client.messages.create(model='glm-4-flash', max_tokens=10) == 'ok'
+    assert len(clock.sleeps) == 2
+    assert all(0 <= delay <= 0.5 * 2 ** i for i, delay in enumerate(clock.sleeps))
+    assert client.pool.keys[0].in_flight == 0
+
+
+def test_non_retryable_error_raised():
+    client, messages = pooled_client([api_error(400), 'ok'])
+    with pytest.raises(anthropic.BadRequestError):
+        client.messages.create(model='glm-4-flash', max_tokens=10)
+    assert len(messages.outcomes) == 1
+
+
+def test_attempt_timeout_follows_deadline(clock, monkeypatch):
+    monkeypatch.setattr(retry_policy.random, 'uniform', lambda low, high: high)
+    client, messages = pooled_client([api_error(503), 'ok'], base_delay=1)
+    deadline = Deadline(10)
+    assert client.messages.create(model='glm-4-flash', max_tokens=10, deadline=deadline) == 'ok'
+    # 第二次尝试的超时为退避后的剩余时间
+    assert messages.timeouts == [10, 9]
+
+
+def test_gives_up_when_retry_cannot_finish(clock):
+    client, messages = pooled_client([api_error(429, {'retry-after': '20'}), 'ok'])
+    with pytest.raises(anthropic.RateLimitError):
+        client.messages.create(model='glm-4-flash', max_tokens=10, deadline=Deadline(5))
+    assert clock.sleeps == [] and len(messages.outcomes) == 1
+    assert client.retry_policy.stats()['deadline_skipped'] == 1
+
+
+def test_expired_deadline_not_called(clock):
+    client, messages = pooled_client(['ok'])
+    deadline = Deadline(1)
+    clock.now[0] += 2
+    with pytest.raises(DeadlineExceeded):
+        client.messages.create(model='glm-4-flash', max_tokens=10, deadline=deadline)
+    assert messages.timeouts == []
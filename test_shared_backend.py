@@ -0,0 +1,607 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共享后端测试 - 在临时端口启动一个最小的RESP服务器，检查RespClient、RedisBackend和SharedTokenBucket；
+服务器不执行Lua，按脚本内容调用等价的Python实现（与Redis一样在一个锁内完成），
+并记录收到的命令，用于检查每个操作只有一次往返
+
+用法:
+    python -m pytest test_shared_backend.py
+"""
+
+import math
+import time
+import types
+import asyncio
+import threading
+import contextlib
+import socketserver
+
+import pytest
+
+from admission import AsyncAdmissionController, Overloaded
+from recommendation_cache import RecommendationCache
+import shared_backend
+from shared_backend import (INCR_SCRIPT, QUEUE_CLAIM_SCRIPT, TOKEN_BUCKET_SCRIPT, UNLOCK_SCRIPT, AsyncCache, LocalBackend,
+                            RedisBackend, RespClient, RespError, SharedRecommendationCache,
+                            SharedTokenBucket)
+from retry_policy import Deadline
+from single_flight import AsyncSingleFlight, SingleFlight
+
+
+class FakeRedis:
+    """RESP服务器的数据：key -> (value, expires_at)"""
+
+    def __init__(self):
+        self.data = {}
+        self.commands = []
+        self.lock = threading.Lock()
+
+    def _get(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.time():
+            del self.data[key]
+            return None
+        return entry[0]
+
+    def _incr(self, key, amount=1):
+        value = int(self._get(key) or 0) + amount
+        expires_at = self.data[key][1] if key in self.data else None
+        self.data[key] = (str(value).encode(), expires_at)
+        return value
+
+    def _pexpire(self, key, milliseconds):
+        if self._get(key) is None:
+            return 0
+        self.data[key] = (self.data[key][0], time.time() + int(milliseconds) / 1000)
+        return 1
+
+    def pttl(self, key):
+        with self.lock:
+            if self._get(key) is None:
+                return -2
+            expires_at = self.data[key][1]
+            return -1 if expires_at is None else int((expires_at - time.time()) * 1000)
+
+    # 与shared_backend中的Lua脚本等价的实现
+    def _unlock(self, keys, args):
+        if self._get(keys[0]) == args[0]:
+            del self.data[keys[0]]
+            return 1
+        return 0
+
+    def _incr_script(self, keys, args):
+        value = self._incr(keys[0])
+        if value == 1:
+            self._pexpire(keys[0], args[0])
+        return value
+
+    def _token_bucket(self, keys, args):
+        rate, burst, now, cost, max_wait = (float(arg) for arg in args)
+        state = self._get(keys[0]) or {}
+        tokens = float(state.get(b'tokens', burst))
+        updated = float(state.get(b'updated', now))
+        if now > updated:
+            tokens = min(burst, tokens + (now - updated) * rate)
+            updated = now
+        wait = max(0.0, (cost - tokens) / rate)
+        if cost > 0 and wait > max_wait:
+            return [0, math.ceil(wait * 1000)]
+        tokens = min(burst, tokens - cost)
+        self.data[keys[0]] = ({b'tokens': str(tokens).encode(), b'updated': str(updated).encode()}, None)
+        self._pexpire(keys[0], math.ceil((burst - tokens) / rate * 1000) + 1000)
+        return [1, math.ceil(wait * 1000)]
+
+    def _zset(self, key):
+        if self._get(key) is None:
+            self.data[key] = ({}, None)
+        return self.data[key][0]
+
+    def _queue_claim(self, keys, args):
+        now, stale_before = float(args[0]), float(args[1])
+        queue, running = self._zset(keys[0]), self._zset(keys[1])
+        stale = sorted((score, m) for m, score in running.items() if score < stale_before)
+        if stale:
+            member = stale[0][1]
+        else:
+            ready = sorted((score, m) for m, score in queue.items() if score <= now)
+            if not ready:
+                return None
+            member = ready[0][1]
+            del queue[member]
+        running[member] = now
+        return member
+
+    def execute(self, args):
+        name = args[0].upper().decode()
+        self.commands.append(name)
+        with self.lock:
+            if name == 'GET':
+                return self._get(args[1])
+            if name == 'SET':
+                options = [a.upper() for a in args[3:]]
+                if b'NX' in options and self._get(args[1]) is not None:
+                    return None
+                expires_at = None
+                if b'PX' in options:
+                    expires_at = time.time() + int(args[3 + options.index(b'PX') + 1]) / 1000
+                self.data[args[1]] = (args[2], expires_at)
+                return 'OK'
+            if name == 'DEL':
+                return 1 if self.data.pop(args[1], None) is not None else 0
+            if name == 'INCR':
+                return self._incr(args[1])
+            if name == 'DECR':
+                return self._incr(args[1], -1)
+            if name == 'ZADD':
+                zset = self._zset(args[1])
+                for i in range(2, len(args), 2):
+                    zset[args[i + 1]] = float(args[i])
+                return (len(args) - 2) // 2
+            if name == 'ZREM':
+                zset = self._zset(args[1])
+                return sum(1 for member in args[2:] if zset.pop(member, None) is not None)
+            if name == 'ZCARD':
+                return len(self._zset(args[1]))
+            if name == 'EVAL':
+                scripts = {UNLOCK_SCRIPT: self._unlock, INCR_SCRIPT: self._incr_script,
+                           TOKEN_BUCKET_SCRIPT: self._token_bucket, QUEUE_CLAIM_SCRIPT: self._queue_claim}
+                script = scripts.get(args[1].decode())
+                if script is None:
+                    raise RespError('NOSCRIPT unknown script')
+                numkeys = int(args[2])
+                return script(args[3:3 + numkeys], args[3 + numkeys:])
+        raise RespError(f"ERR unknown command '{name}'")
+
+
+def encode(value):
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, str):
+        return f'+{value}\r\n'.encode()
+    if isinstance(value, list):
+        return b'*%d\r\n' % len(value) + b''.join(encode(item) for item in value)
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:-2])):
+                length = int(self.rfile.readline()[1:-2])
+                args.append(self.rfile.read(length + 2)[:-2])
+            try:
+                reply = encode(self.server.fake.execute(args))
+            except RespError as e:
+                reply = f'-{e}\r\n'.encode()
+            self.wfile.write(reply)
+
+
+@contextlib.contextmanager
+def resp_server():
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), RespHandler)
+    server.daemon_threads = True
+    server.fake = FakeRedis()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def fake_redis():
+    with resp_server() as server:
+        yield server
+
+
+@pytest.fixture
+def client(fake_redis):
+    return RespClient('127.0.0.1', fake_redis.server_address[1])
+
+
+@pytest.fixture(params=['local', 'redis'])
+def backend(request):
+    if request.param == 'local':
+        yield LocalBackend()
+        return
+    with resp_server() as server:
+        yield RedisBackend(RespClient('127.0.0.1', server.server_address[1]), prefix='test:')
+
+
+# ---------- RespClient ----------
+
+def test_resp_client_commands(client):
+    assert client.get('missing') is None
+    assert client.set('k', 'v') is True
+    assert client.get('k') == b'v'
+    assert client.set('k', 'other', px=1000, nx=True) is False
+    assert client.get('k') == b'v'
+    assert client.delete('k') == 1
+    assert client.decr('n') == -1
+    assert client.eval(INCR_SCRIPT, 1, 'n', 1000) == 0
+
+
+def test_resp_client_binary_values(client):
+    value = '养生'.encode('utf-8') + b'\r\n\x00'
+    client.set('bin', value)
+    assert client.get('bin') == value
+
+
+def test_resp_client_error_reply(client):
+    with pytest.raises(RespError):
+        client.execute('NOPE')
+    # 错误响应后连接仍可使用
+    assert client.set('k', 'v') is True
+
+
+def test_resp_client_reconnects_after_disconnect(fake_redis, client):
+    client.set('k', 'v')
+    sock, _ = client._local.conn
+    sock.shutdown(2)
+    with pytest.raises((OSError, ConnectionError)):
+        client.get('k')
+    assert client.get('k') == b'v'
+
+
+def test_resp_client_connection_per_thread(client):
+    results = []
+
+    def worker(n):
+        for i in range(20):
+            client.set(f'k{n}', i)
+            results.append(client.get(f'k{n}') == str(i).encode())
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 80 and all(results)
+
+
+# ---------- 锁和计数器 ----------
+
+def test_lock_and_unlock(backend):
+    token = backend.try_lock('lock', 10)
+    assert token is not None
+    assert backend.try_lock('lock', 10) is None
+    backend.unlock('lock', 'not-the-owner')
+    assert backend.try_lock('lock', 10) is None
+    backend.unlock('lock', token)
+    assert backend.try_lock('lock', 10) is not None
+
+
+def test_unlock_after_expiry_keeps_new_owner(backend):
+    token = backend.try_lock('lock', 0.05)
+    time.sleep(0.1)
+    other = backend.try_lock('lock', 10)
+    assert other is not None
+    # 过期锁的原持有者释放时不能删除新持有者的锁
+    backend.unlock('lock', token)
+    assert backend.try_lock('lock', 10) is None
+
+
+def test_redis_unlock_is_single_eval(fake_redis, client):
+    backend = RedisBackend(client)
+    token = backend.try_lock('lock', 10)
+    fake_redis.fake.commands.clear()
+    backend.unlock('lock', token)
+    assert fake_redis.fake.commands == ['EVAL']
+
+
+def test_incr_sets_ttl_on_create(backend):
+    assert backend.incr('counter', 10) == 1
+    assert backend.incr('counter', 10) == 2
+    backend.decr('counter')
+    assert backend.incr('counter', 10) == 2
+
+
+def test_redis_incr_sets_ttl_in_same_command(fake_redis, client):
+    backend = RedisBackend(client, prefix='test:')
+    fake_redis.fake.commands.clear()
+    backend.incr('counter', 5)
+    assert fake_redis.fake.commands == ['EVAL']
+    assert 0 < fake_redis.fake.pttl(b'test:counter') <= 5000
+
+
+def test_take_tokens_refills_at_rate(backend):
+    assert [backend.take_tokens('bucket', 2, 2, 1, 60, 100.0) for _ in range(3)] == [
+        (True, 0.0), (True, 0.0), (True, 0.5)]
+    # 0.5秒后补充的一个令牌已被上面的预订占用
+    assert backend.take_tokens('bucket', 2, 2, 1, 60, 100.5) == (True, 0.5)
+    assert backend.take_tokens('bucket', 2, 2, 1, 60, 102.0) == (True, 0.0)
+
+
+def test_take_tokens_over_max_wait_not_taken(backend):
+    backend.take_tokens('bucket', 1, 1, 1, 60, 100.0)
+    assert backend.take_tokens('bucket', 1, 1, 1, 0.5, 100.0) == (False, 1.0)
+    # 没有扣除：下一次预订仍只需等待1秒
+    assert backend.take_tokens('bucket', 1, 1, 1, 60, 100.0) == (True, 1.0)
+
+
+def test_take_tokens_negative_cost_returns_token(backend):
+    backend.take_tokens('bucket', 1, 1, 1, 60, 100.0)
+    backend.take_tokens('bucket', 1, 1, 1, 60, 100.0)
+    backend.take_tokens('bucket', 1, 1, -1, 0, 100.0)
+    backend.take_tokens('bucket', 1, 1, -1, 0, 100.0)
+    # 归还不超过burst
+    backend.take_tokens('bucket', 1, 1, -1, 0, 100.0)
+    assert backend.take_tokens('bucket', 1, 1, 1, 60, 100.0) == (True, 0.0)
+    assert backend.take_tokens('bucket', 1, 1, 1, 60, 100.0) == (True, 1.0)
+
+
+def test_redis_take_tokens_expires_when_full(fake_redis, client):
+    backend = RedisBackend(client, prefix='test:')
+    backend.take_tokens('bucket', 2, 4, 1, 60, time.time())
+    # 补回一个令牌需要0.5秒，之后键再保留1秒
+    assert 1000 < fake_redis.fake.pttl(b'test:bucket') <= 1500
+
+
+def test_queue_claims_in_score_order(backend):
+    backend.queue_push('queued', 'b', 102.0)
+    backend.queue_push('queued', 'a', 101.0)
+    backend.queue_push('queued', 'later', 200.0)
+    assert backend.queue_claim('queued', 'running', 150.0, 0.0) == 'a'
+    assert backend.queue_claim('queued', 'running', 150.0, 0.0) == 'b'
+    assert backend.queue_claim('queued', 'running', 150.0, 0.0) is None
+    assert backend.queue_size('queued') == 1 and backend.queue_size('running') == 2
+    backend.queue_remove('running', 'a')
+    assert backend.queue_size('running') == 1
+
+
+def test_queue_reclaims_stale_running_member(backend):
+    backend.queue_push('queued', 'a', 100.0)
+    assert backend.queue_claim('queued', 'running', 100.0, 0.0) == 'a'
+    # 领取的节点在stale_before之前领取且未完成：重新领取，score更新为新的领取时间
+    assert backend.queue_claim('queued', 'running', 200.0, 150.0) == 'a'
+    assert backend.queue_claim('queued', 'running', 210.0, 150.0) is None
+
+
+# ---------- SharedTokenBucket ----------
+
+@pytest.fixture
+def clock(monkeypatch):
+    """替换shared_backend中的time.time，令牌桶按clock[0]计时"""
+    now = [1000.0]
+    monkeypatch.setattr(shared_backend, 'time', types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def test_token_bucket_reserves_within_burst(backend, clock):
+    bucket = SharedTokenBucket(backend, 'upstream', rate=1, burst=3)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.reserve() == 1.0
+    assert bucket.reserve() == 2.0
+
+
+def test_token_bucket_no_double_burst(backend, clock):
+    """时间窗口计数在窗口边界两侧各允许burst次；令牌桶在任意时刻最多突发burst次"""
+    bucket = SharedTokenBucket(backend, 'upstream', rate=1, burst=5)
+    clock[0] = 1004.99
+    assert [bucket.reserve() for _ in range(5)] == [0.0] * 5
+    clock[0] = 1005.01
+    waits = [bucket.reserve() for _ in range(5)]
+    # 0.02秒只补充了0.02个令牌
+    assert waits[0] == pytest.approx(0.98, abs=0.002) and waits == sorted(waits)
+
+
+def test_token_bucket_long_run_rate(backend, clock):
+    bucket = SharedTokenBucket(backend, 'upstream', rate=2, burst=3)
+    admitted = 0
+    for i in range(81):
+        clock[0] = 1000 + i * 0.125
+        if bucket.reserve() == 0.0:
+            admitted += 1
+        else:
+            bucket.cancel()
+    # 10秒内: 初始的burst加上按速率补充的令牌
+    assert admitted == 3 + 20
+
+
+def test_token_bucket_cancel_returns_token(backend, clock):
+    bucket = SharedTokenBucket(backend, 'upstream', rate=1, burst=2)
+    bucket.reserve()
+    bucket.reserve()
+    bucket.cancel()
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() > 0
+
+
+def test_token_bucket_shared_between_instances(fake_redis, clock):
+    port = fake_redis.server_address[1]
+    buckets = [SharedTokenBucket(RedisBackend(RespClient('127.0.0.1', port)), 'upstream', rate=1, burst=4)
+               for _ in range(2)]
+    waits = [bucket.reserve() for bucket in buckets for _ in range(3)]
+    assert waits == [0.0, 0.0, 0.0, 0.0, 1.0, 2.0]
+
+
+def test_token_bucket_one_round_trip_per_reserve(fake_redis, client):
+    bucket = SharedTokenBucket(RedisBackend(client), 'upstream', rate=10, burst=2)
+    for _ in range(20):
+        bucket.reserve()
+    assert fake_redis.fake.commands == ['EVAL'] * 20
+
+
+def test_token_bucket_exhausted(backend, clock):
+    bucket = SharedTokenBucket(backend, 'upstream', rate=1, burst=1)
+    for _ in range(61):
+        bucket.reserve()
+    # 需要等待超过60秒时不预订，cancel不归还令牌
+    assert bucket.reserve() == 61.0
+    bucket.cancel()
+    assert bucket.reserve() == 61.0
+
+
+# ---------- SharedRecommendationCache ----------
+
+def test_shared_cache_round_trip(fake_redis, client):
+    cache = SharedRecommendationCache(RedisBackend(client), 'rec', ttl=60)
+    assert cache.lookup('k') == (None, None)
+    assert cache.set('k', {'foods': ['山药']}) is True
+    assert cache.lookup('k') == ({'foods': ['山药']}, 'fresh')
+    assert cache.stats()['hits'] == 1
+
+
+def test_shared_cache_backend_down_is_a_miss():
+    with resp_server() as server:
+        port = server.server_address[1]
+    cache = SharedRecommendationCache(RedisBackend(RespClient('127.0.0.1', port, timeout=1)), 'rec')
+    assert cache.get('k') is None
+    assert cache.set('k', 'v') is False
+    assert cache.stats()['errors'] == 2
+
+
+# ---------- SingleFlight的共享锁 ----------
+
+class DownBackend(LocalBackend):
+    """锁操作总是失败的共享后端"""
+
+    def try_lock(self, key, ttl):
+        raise ConnectionError('backend down')
+
+
+def test_single_flight_lock_wait_bounded_by_deadline(monkeypatch):
+    monkeypatch.setattr('single_flight.SHARED_LOCK_POLL', 0.01)
+    backend = LocalBackend()
+    # 另一个进程持有锁且不会释放
+    backend.try_lock('flight:k', 60)
+    flight = SingleFlight(lock_backend=backend)
+
+    start = time.monotonic()
+    assert flight.do('k', lambda: 'result', Deadline(0.1)) == ('result', False)
+    assert time.monotonic() - start < 0.5
+    assert flight.stats()['lock_timeouts'] == 1
+    # 等锁超时后不加锁调用，不释放其他进程的锁
+    assert backend.try_lock('flight:k', 60) is None
+
+
+def test_single_flight_lock_wait_bounded_by_lock_ttl(monkeypatch):
+    monkeypatch.setattr('single_flight.SHARED_LOCK_POLL', 0.01)
+    backend = LocalBackend()
+    backend.try_lock('flight:k', 60)
+    flight = SingleFlight(lock_backend=backend, lock_ttl=0.1)
+    assert flight.do('k', lambda: 'result') == ('result', False)
+    assert flight.stats()['lock_timeouts'] == 1
+
+
+def test_single_flight_backend_error_calls_without_lock():
+    flight = SingleFlight(lock_backend=DownBackend())
+    assert flight.do('k', lambda: 'result') == ('result', False)
+    assert flight.stats()['lock_errors'] == 1
+
+
+def test_async_single_flight_lock_wait_bounded(monkeypatch):
+    monkeypatch.setattr('single_flight.SHARED_LOCK_POLL', 0.01)
+    backend = LocalBackend()
+    backend.try_lock('flight:k', 60)
+    flight = AsyncSingleFlight(lock_backend=backend)
+
+    async def call():
+        return 'result'
+
+    assert asyncio.run(flight.do('k', call, Deadline(0.1))) == ('result', False)
+    assert flight.stats()['lock_timeouts'] == 1
+    flight = AsyncSingleFlight(lock_backend=DownBackend())
+    assert asyncio.run(flight.do('k', call)) == ('result', False)
+    assert flight.stats()['lock_errors'] == 1
+
+
+# ---------- 异步服务器中的使用 ----------
+
+class SlowClient(RespClient):
+    """每条命令前等待一段时间，模拟较慢的Redis"""
+
+    def execute(self, *args):
+        time.sleep(0.05)
+        return super().execute(*args)
+
+
+async def measure_loop_stall(coro):
+    """执行coro期间事件循环的最长停顿（秒）"""
+    stall = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal stall
+        last = time.monotonic()
+        while not done:
+            await asyncio.sleep(0.005)
+            now = time.monotonic()
+            stall = max(stall, now - last)
+            last = now
+
+    task = asyncio.ensure_future(ticker())
+    result = await coro
+    done = True
+    await task
+    return result, stall
+
+
+def test_async_cache_does_not_block_event_loop(fake_redis):
+    client = SlowClient('127.0.0.1', fake_redis.server_address[1])
+    cache = AsyncCache(SharedRecommendationCache(RedisBackend(client), 'rec', ttl=60))
+
+    async def run():
+        await cache.set('k', 'v')
+        return await cache.lookup('k')
+
+    result, stall = asyncio.run(measure_loop_stall(run()))
+    assert result == ('v', 'fresh')
+    assert stall < 0.04
+
+
+def test_async_cache_local_cache_called_directly():
+    cache = AsyncCache(RecommendationCache(ttl=60))
+
+    async def run():
+        await cache.set('k', 'v')
+        return await cache.get('k'), await cache.is_fresh('k')
+
+    assert asyncio.run(run()) == ('v', True)
+
+
+def test_async_single_flight_shared_lock(fake_redis):
+    client = SlowClient('127.0.0.1', fake_redis.server_address[1])
+    flight = AsyncSingleFlight(lock_backend=RedisBackend(client, prefix='test:'))
+
+    async def call():
+        return 'result'
+
+    (result, shared), stall = asyncio.run(measure_loop_stall(flight.do('k', call)))
+    assert (result, shared) == ('result', False)
+    assert stall < 0.04
+    # 调用结束后锁已释放
+    assert fake_redis.fake.pttl(b'test:flight:k') == -2
+
+
+def test_async_admission_shared_bucket(fake_redis):
+    client = SlowClient('127.0.0.1', fake_redis.server_address[1])
+    # 补充一个令牌需要20秒，第二次预订总是超过queue_timeout
+    bucket = SharedTokenBucket(RedisBackend(client), 'upstream', rate=0.05, burst=1)
+    admission = AsyncAdmissionController(queue_timeout=0.1, bucket=bucket)
+
+    async def run():
+        async with admission.slot():
+            pass
+        with pytest.raises(Overloaded):
+            async with admission.slot():
+                pass
+
+    _, stall = asyncio.run(measure_loop_stall(run()))
+    assert stall < 0.04
+    assert admission.stats()['rejected']['rate_limited'] == 1
+    # 被拒绝的预订已在预订的线程中归还：桶中剩余的令牌不为负
+    state = fake_redis.fake.data[b'food:rate:upstream'][0]
+    assert 0 <= float(state[b'tokens']) < 0.1
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+静态服务器测试 - 在临时端口启动PooledHTTPServer，用http.client检查长连接、304、压缩、Range和背景图版本选择
+
+用法:
+    python -m pytest test_static_server.py
+"""
+
+import os
+import gzip
+import json
+import time
+import socket
+import threading
+import http.client
+import contextlib
+from urllib.parse import quote
+
+import pytest
+
+from compression import choose_encoding
+from static_server import PooledHTTPServer, StaticFileCache, StaticFileHandler, parse_byte_range
+from image_variants import IMAGE_VARIANTS_MANIFEST, ImageVariants, variant_path
+
+INDEX_HTML = ('<!DOCTYPE html>\n<html><body>\n'
+              + '<p>养生饮食推荐 Food Recommendation</p>\n' * 200
+              + '</body></html>\n').encode('utf-8')
+
+
+@pytest.fixture
+def site(tmp_path):
+    (tmp_path / 'index.html').write_bytes(INDEX_HTML)
+    return tmp_path
+
+
+def make_handler(directory, **attrs):
+    """每个测试使用独立的缓存和背景图清单"""
+    attrs.setdefault('cache', StaticFileCache())
+    attrs.setdefault('image_variants', ImageVariants(str(directory)))
+    return type('TestHandler', (StaticFileHandler,), {
+        'directory': str(directory),
+        'log_message': lambda self, format, *args: None,
+        **attrs
+    })
+
+
+@contextlib.contextmanager
+def running_server(handler, workers=4, max_pending=16):
+    server = PooledHTTPServer(('127.0.0.1', 0), handler, workers=workers, max_pending=max_pending)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def request(conn, path, headers=None, method='GET'):
+    conn.request(method, path, headers=headers or {})
+    response = conn.getresponse()
+    return response, response.read()
+
+
+def test_keepalive_reused_after_404(site):
+    with running_server(make_handler(site)) as server:
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+        response, _ = request(conn, '/index.html')
+        assert response.status == 200
+        sock = conn.sock
+
+        response, _ = request(conn, '/missing.js')
+        assert response.status == 404
+        assert not response.will_close
+
+        response, body = request(conn, '/index.html')
+        assert response.status == 200
+        assert body == INDEX_HTML
+        assert conn.sock is sock
+        conn.close()
+
+
+def test_idle_connection_closed(site):
+    with running_server(make_handler(site, keepalive_idle=0.2)) as server:
+        with socket.create_connection(server.server_address, timeout=5) as sock:
+            sock.sendall(b'GET /index.html HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            received = b''
+            start = time.monotonic()
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                received += chunk
+            # 响应之后空闲约0.2秒由服务器关闭，而不是等到STATIC_KEEPALIVE_TIMEOUT
+            assert received.startswith(b'HTTP/1.1 200')
+            assert time.monotonic() - start < 2
+
+
+def test_connection_close_at_max_requests(site):
+    with running_server(make_handler(site, keepalive_max_requests=3)) as server:
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+        closes = []
+        for _ in range(3):
+            response, _ = request(conn, '/index.html')
+            closes.append(response.getheader('Connection'))
+        assert closes == [None, None, 'close']
+        conn.close()
+
+
+def test_queue_full_returns_503(site):
+    with running_server(make_handler(site, keepalive_idle=5), workers=1, max_pending=1) as server:
+        # 第一个连接占住唯一的工作线程，第二个在队列中，第三个被拒绝
+        holders = []
+        for _ in range(2):
+            holders.append(socket.create_connection(server.server_address, timeout=5))
+            time.sleep(0.2)
+        with socket.create_connection(server.server_address, timeout=5) as sock:
+            assert sock.recv(1024).startswith(b'HTTP/1.1 503')
+        for holder in holders:
+            holder.close()
+        assert server.stats()['rejected'] == 1
+
+
+def test_etag_and_not_modified(site):
+    handler = make_handler(site)
+    with running_server(handler) as server:
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+        response, body = request(conn, '/index.html')
+        assert response.status == 200
+        assert body == INDEX_HTML
+        assert response.getheader('Cache-Control') == 'no-cache'
+        etag = response.getheader('ETag')
+        last_modified = response.getheader('Last-Modified')
+        assert etag.startswith('"')
+
+        response, body = request(conn, '/index.html', {'If-None-Match': etag})
+        assert response.status == 304
+        assert body == b''
+        assert response.getheader('ETag') == etag
+
+        response, _ = request(conn, '/index.html', {'If-None-Match': f'"other", W/{etag}'})
+        assert response.status == 304
+        response, _ = request(conn, '/index.html', {'If-Modified-Since': last_modified})
+        assert response.status == 304
+        # If-None-Match优先于If-Modified-Since
+        response, _ = request(conn, '/index.html', {'If-None-Match': '"other"', 'If-Modified-Since': last_modified})
+        assert response.status == 200
+        assert handler.cache.stats()['not_modified'] == 3
+        conn.close()
+
+
+def test_etag_changes_with_file(site):
+    with running_server(make_handler(site)) as server:
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+        response, _ = request(conn, '/index.html')
+        etag = response.getheader('ETag')
+
+        (site / 'index.html').write_bytes(INDEX_HTML + b'<!-- v2 -->\n')
+        response, body = request(conn, '/index.html', {'If-None-Match': etag})
+        assert response.status == 200
+        assert body.endswith(b'<!-- v2 -->\n')
+        assert response.getheader('ETag') != etag
+        conn.close()
+
+
+def test_image_cache_control(site):
+    (site / 'bg.png').write_bytes(b'\x89PNG\r\n\x1a\n' + b'\0' * 100)
+    with running_server(make_handler(site)) as server:
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+        response, _ = request(conn, '/bg.png')
+        assert response.getheader('Content-Type') == 'image/png'
+        assert response.getheader('Cache-Control').startswith('public, max-age=')
+        conn.close()
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('gzip, deflate, br', 'br'),
+    ('gzip', 'gzip'),
+    ('br;q=0, gzip', 'gzip'),
+    ('gzip;q=0, *', 'br'),
+    ('gzip;q=0, br;q=0, *', None),
+    ('identity', None),
+    ('', None),
+])
+def test_choose_encoding(header, expected):
+    assert choose_encoding(header, ['br', 'gzip']) == expected
+
+
+def test_precompressed_variants(site):
+    (site / 'index.html.gz').write_bytes(gzip.compress(INDEX_HTML))
+    (site / 'index.html.br').write_bytes(b'brotli-bytes')
+    with running_server(make_handler(site)) as server:
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+        etags = set()
+        for accept, encoding in (('gzip, br', 'br'), ('gzip', 'gzip'), ('gzip;q=0, *', 'br'), ('', None)):
+            response, body = request(conn, '/index.html', {'Accept-Encoding': accept})
+            assert response.status == 200
+            assert response.getheader('Content-Encoding') == encoding
+            assert response.getheader('Content-Type') == 'text/html'
+            assert 'Accept-Encoding' in response.getheader('Vary')
+            etags.add(response.getheader('ETag'))
+            if encoding == 'gzip':
+                assert gzip.decompress(body) == INDEX_HTML
+            elif encoding is None:
+                assert body == INDEX_HTML
+        # 每种表示有自己的ETag
+        assert len(etags) == 3
+        conn.close()
+
+
+def test_stale_precompressed_ignored(site):
+    (site / 'index.html.gz').write_bytes(gzip.compress(b'old'))
+    past = time.time() - 60
+    os.utime(site / 'index.html.gz', (past, past))
+    with running_server(make_handler(site)) as server:
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+        response, body = request(conn, '/index.html', {'Accept-Encoding': 'gzip'})
+        assert response.getheader('Content-Encoding') is None
+        assert body == INDEX_HTML
+        conn.close()
+
+
+def test_send_json_compressed(site):
+    class Handler(make_handler(site)):
+        def do_GET(self):
+            if self.path == '/api/big':
+                return self.send_json(200, {'text': '节气' * 2000})
+            if self.path == '/api/small':
+                return self.send_json(200, {'ok': True})
+            super().do_GET()
+
+    with running_server(Handler) as server:
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+        response, body = request(conn, '/api/big', {'Accept-Encoding': 'gzip'})
+        assert response.getheader('Content-Encoding') == 'gzip'
+        assert json.loads(gzip.decompress(body))['text'] == '节气' * 2000
+        response, body = request(conn, '/api/small', {'Accept-Encoding': 'gzip'})
+        assert response.getheader('Content-Encoding') is None
+        assert json.loads(body) == {'ok': True}
+        conn.close()
+
+
+@pytest.fixture
+def large_file(site):
+    data = bytes(range(256)) * 2048  # 512KB，超过STATIC_CACHE_MAX_FILE，用sendfile发送
+    (site / 'bg.png').write_bytes(data)
+    return data
+
+
+@pytest.mark.parametrize('use_sendfile', [True, False])
+def test_range_requests(site, large_file, use_sendfile):
+    handler = make_handler(site, use_sendfile=use_sendfile)
+    size = len(large_file)
+    with running_server(handler) as server:
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+        response, body = request(conn, '/bg.png')
+        assert response.status == 200
+        assert response.getheader('Accept-Ranges') == 'bytes'
+        assert body == large_file
+        etag = response.getheader('ETag')
+
+        for header, start, end in (('bytes=100-199', 100, 199), ('bytes=-50', size - 50, size - 1),
+                                   (f'bytes={size - 10}-', size - 10, size - 1), ('bytes=0-99999999', 0, size - 1)):
+            response, body = request(conn, '/bg.png', {'Range': header})
+            assert response.status == 206
+            assert response.getheader('Content-Range') == f'bytes {start}-{end}/{size}'
+            assert body == large_file[start:end + 1]
+
+        response, body = request(conn, '/bg.png', {'Range': f'bytes={size}-'})
+        assert response.status == 416
+        assert response.getheader('Content-Range') == f'bytes */{size}'
+        assert body == b''
+
+        # If-Range不匹配或多段Range时返回整个文件
+        response, body = request(conn, '/bg.png', {'Range': 'bytes=0-9', 'If-Range': '"old"'})
+        assert response.status == 200 and body == large_file
+        response, _ = request(conn, '/bg.png', {'Range': 'bytes=0-9', 'If-Range': etag})
+        assert response.status == 206
+        response, body = request(conn, '/bg.png', {'Range': 'bytes=0-1,5-6'})
+        assert response.status == 200 and body == large_file
+
+        # 416之后连接仍可继续使用
+        response, body = request(conn, '/bg.png', {'Range': 'bytes=0-3'})
+        assert body == large_file[:4]
+        conn.close()
+
+
+def test_range_on_cached_file(site):
+    with running_server(make_handler(site)) as server:
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+        response, body = request(conn, '/index.html', {'Range': 'bytes=10-19'})
+        assert response.status == 206
+        assert body == INDEX_HTML[10:20]
+        conn.close()
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-0', (0, 0)),
+    ('bytes=5-', (5, 999)),
+    ('bytes=-0', (1000, 999)),
+    ('bytes=2000-', (2000, 999)),
+    ('bytes=9-3', None),
+    ('bytes=a-5', None),
+    ('bytes=-', None),
+    ('items=0-1', None),
+])
+def test_parse_byte_range(header, expected):
+    assert parse_byte_range(header, 1000) == expected
+
+
+@pytest.fixture
+def variant_site(site):
+    """手写的背景图版本清单（不需要Pillow）"""
+    source = site / 'images' / 'festival_art' / '立春.png'
+    source.parent.mkdir(parents=True)
+    source.write_bytes(b'\x89PNG original' * 1000)
+    variants = []
+    for fmt in ('avif', 'webp'):
+        for width in (480, 1080):
+            path = variant_path('images/festival_art/立春.png', width, fmt)
+            (site / path).parent.mkdir(parents=True, exist_ok=True)
+            (site / path).write_bytes(f'{fmt}-{width}'.encode())
+            variants.append({'path': path, 'format': fmt, 'type': f'image/{fmt}', 'width': width,
+                             'height': width * 4 // 3, 'bytes': len(f'{fmt}-{width}')})
+    manifest = {'version': 1, 'images': {'images/festival_art/立春.png': {
+        'width': 1773, 'height': 2364, 'bytes': source.stat().st_size, 'mtime_ns': source.stat().st_mtime_ns,
+        'widths': [480, 1080], 'formats': ['avif', 'webp'], 'variants': variants
+    }}}
+    (site / IMAGE_VARIANTS_MANIFEST).write_text(json.dumps(manifest, ensure_ascii=False), encoding='utf-8')
+    return site
+
+
+CHROME_ACCEPT = 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8'
+
+
+@pytest.mark.parametrize('query, headers, content_type, body', [
+    ('', {'Accept': CHROME_ACCEPT}, 'image/avif', b'avif-1080'),
+    ('?w=400', {'Accept': CHROME_ACCEPT}, 'image/avif', b'avif-480'),
+    ('?w=600', {'Accept': 'image/webp,*/*'}, 'image/webp', b'webp-1080'),
+    ('?w=5000', {'Accept': 'image/webp,*/*'}, 'image/webp', b'webp-1080'),
+    ('', {'Accept': 'image/webp,*/*', 'Sec-CH-Viewport-Width': '390', 'Sec-CH-DPR': '1'}, 'image/webp', b'webp-480'),
+    ('', {'Accept': 'image/webp,*/*', 'Sec-CH-Viewport-Width': '390', 'Sec-CH-DPR': '3'}, 'image/webp', b'webp-1080'),
+    ('?w=400', {'Accept': 'image/avif;q=0, image/webp'}, 'image/webp', b'webp-480'),
+    ('?w=abc', {'Accept': 'image/webp'}, 'image/webp', b'webp-1080'),
+])
+def test_image_variant_selection(variant_site, query, headers, content_type, body):
+    with running_server(make_handler(variant_site)) as server:
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+        response, received = request(conn, quote('/images/festival_art/立春.png') + query, headers)
+        assert response.status == 200
+        assert response.getheader('Content-Type') == content_type
+        assert received == body
+        assert 'Accept' in response.getheader('Vary').split(', ')
+        conn.close()
+
+
+def test_image_variant_fallbacks(variant_site):
+    path = quote('/images/festival_art/立春.png')
+    original = (variant_site / 'images' / 'festival_art' / '立春.png').read_bytes()
+    with running_server(make_handler(variant_site)) as server:
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+        # 浏览器只发送image/*时不能假定支持WebP/AVIF
+        response, body = request(conn, path, {'Accept': 'image/png,image/*;q=0.8'})
+        assert response.getheader('Content-Type') == 'image/png'
+        assert body == original
+        assert 'Accept' in response.getheader('Vary')
+
+        response, _ = request(conn, path + '?w=400', {'Accept': CHROME_ACCEPT})
+        etag = response.getheader('ETag')
+        response, _ = request(conn, path + '?w=400', {'Accept': CHROME_ACCEPT, 'If-None-Match': etag})
+        assert response.status == 304
+
+        # 原图修改后（还没有重新生成版本）发送原图
+        (variant_site / 'images' / 'festival_art' / '立春.png').write_bytes(b'\x89PNG edited')
+        response, body = request(conn, path, {'Accept': CHROME_ACCEPT})
+        assert response.getheader('Content-Type') == 'image/png'
+        assert body == b'\x89PNG edited'
+        conn.close()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推荐结果翻译测试 - 目标语言校验、缓存键、文本提取分块和译文写回
+
+用法:
+    python -m pytest test_translation.py
+"""
+
+import pytest
+
+from translation import (apply_translations, build_translation_prompt, chunk_texts, collect_texts,
+                         make_translation_key, parse_translation, read_translate_request,
+                         target_language_name)
+
+RECOMMENDATION = {
+    'dishes': [
+        {'name': '山药排骨汤', 'ingredients': ['山药 200g', '排骨'], 'image': 'soup.png',
+         'calories': 320},
+        {'name': '小米粥', 'ingredients': ['小米'], 'steps': ['熬煮30分钟', '30']}
+    ],
+    'reasoning': '小寒时节宜温补',
+    'tips': ['少食生冷', '小米']
+}
+
+
+@pytest.mark.parametrize('language, expected', [
+    ('en', '英语'), ('EN-us', '英语'), ('English', '英语'), ('英语', '英语'),
+    ('zh', '中文'), ('zh-CN', '中文'), (' 中文 ', '中文'),
+])
+def test_target_language_name(language, expected):
+    assert target_language_name(language) == expected
+
+
+@pytest.mark.parametrize('language', ['ja', 'fr', 'de-DE', '日语', 123, ['en']])
+def test_unsupported_language_rejected(language):
+    with pytest.raises(ValueError, match='Unsupported targetLang'):
+        target_language_name(language)
+    with pytest.raises(ValueError, match='Unsupported targetLang'):
+        read_translate_request({'recommendation': RECOMMENDATION, 'targetLang': language})
+
+
+def test_read_translate_request():
+    assert read_translate_request({'recommendation': RECOMMENDATION, 'language': 'en'}) == (
+        RECOMMENDATION, '英语')
+    with pytest.raises(ValueError, match='Missing targetLang'):
+        read_translate_request({'recommendation': RECOMMENDATION})
+    with pytest.raises(ValueError, match='Missing recommendation'):
+        read_translate_request({'recommendation': 'text', 'targetLang': 'en'})
+
+
+def test_translation_key_per_language():
+    assert make_translation_key(RECOMMENDATION, 'en') == make_translation_key(RECOMMENDATION, 'English')
+    assert make_translation_key(RECOMMENDATION, 'en') != make_translation_key(RECOMMENDATION, 'zh')
+    # items是dishes的别名，不影响缓存键
+    with_items = dict(RECOMMENDATION, items=RECOMMENDATION['dishes'])
+    assert make_translation_key(with_items, 'en') == make_translation_key(RECOMMENDATION, 'en')
+
+
+def test_collect_texts_skips_numbers_and_ids():
+    texts = collect_texts(RECOMMENDATION)
+    assert texts == ['山药排骨汤', '山药 200g', '排骨', '小米粥', '小米', '熬煮30分钟', '小寒时节宜温补',
+                     '少食生冷']
+
+
+def test_chunk_texts():
+    chunks = chunk_texts(['aaaa', 'bbbb', 'cc', 'dddddddd'], max_chars=6)
+    assert chunks == [['aaaa'], ['bbbb', 'cc'], ['dddddddd']]
+
+
+def test_build_prompt_names_language():
+    assert '翻译成英语' in build_translation_prompt(['小米'], 'en')
+
+
+def test_parse_and_apply_translations():
+    texts = ['山药排骨汤', '小米', '少食生冷']
+    content = '```json\n{"0": "Yam and Pork Rib Soup", "1": "Millet", "2": ""}\n```'
+    translations = parse_translation(content, texts)
+    assert translations == {'山药排骨汤': 'Yam and Pork Rib Soup', '小米': 'Millet'}
+
+    result = apply_translations(RECOMMENDATION, translations)
+    assert result['dishes'][0]['name'] == 'Yam and Pork Rib Soup'
+    assert result['dishes'][0]['image'] == 'soup.png' and result['dishes'][0]['calories'] == 320
+    assert result['tips'] == ['少食生冷', 'Millet']
+    assert result['items'] == result['dishes']
+
+
+def test_parse_translation_invalid_output():
+    assert parse_translation('抱歉，无法翻译', ['小米']) == {}
+    assert parse_translation(None, ['小米']) == {}
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推荐结果翻译 - /api/translate使用
+只提取推荐JSON中的文本叶子（菜名、食材、步骤、reasoning、tips等）分块并发翻译，
+再按原路径写回，JSON结构、数字和字段名保持不变；结果按内容哈希 + 目标语言缓存
+"""
+
+import os
+import re
+import json
+import hashlib
+
+from recommendation_parser import RecommendationJSONScanner, normalize_recommendation
+
+TRANSLATE_MODEL = os.environ.get('TRANSLATE_MODEL', 'glm-4-flash')
+TRANSLATE_MAX_TOKENS = int(os.environ.get('TRANSLATE_MAX_TOKENS', 2048))
+TRANSLATE_CHUNK_CHARS = int(os.environ.get('TRANSLATE_CHUNK_CHARS', 600))
+TRANSLATE_MAX_CONCURRENCY = int(os.environ.get('TRANSLATE_MAX_CONCURRENCY', 4))
+
+# 翻译prompt变化时修改，使旧的翻译缓存失效
+TRANSLATE_PROMPT_VERSION = 't1'
+
+# 不翻译的字段（标识、链接、颜色等）
+_SKIP_KEYS = {'id', 'type', 'url', 'image', 'icon', 'color', 'emoji'}
+
+# 含有文字（而不只是数字、单位符号、标点）的字符串才需要翻译
+_HAS_WORDS = re.compile(r'[^\W\d_]{2,}|[一-鿿]')
+
+# 支持的目标语言（与前端i18n.js一致）：语言代码或名称（不区分大小写） -> prompt中的语言名称
+TRANSLATE_LANGUAGES = {
+    'zh': '中文', 'zh-cn': '中文', 'zh-hans': '中文', 'chinese': '中文', '中文': '中文',
+    'en': '英语', 'en-us': '英语', 'en-gb': '英语', 'english': '英语', '英语': '英语'
+}
+
+
+def target_language_name(target_language):
+    """目标语言在prompt中的名称，不支持的语言抛出ValueError"""
+    name = None
+    if isinstance(target_language, str):
+        name = TRANSLATE_LANGUAGES.get(target_language.strip().lower())
+    if name is None:
+        raise ValueError(f'Unsupported targetLang: {target_language} (supported: zh, en)')
+    return name
+
+
+def make_translation_key(recommendation, target_language):
+    """根据推荐内容和目标语言生成翻译缓存键（sha256）"""
+    content = _without_items(recommendation)
+    payload = json.dumps({
+        'content': content,
+        'language': target_language_name(target_language),
+        'version': TRANSLATE_PROMPT_VERSION
+    }, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _without_items(recommendation):
+    # items只是dishes/teas的别名，翻译后由normalize_recommendation重新生成
+    return {k: v for k, v in recommendation.items() if k != 'items'}
+
+
+def collect_texts(recommendation):
+    """返回需要翻译的文本列表（去重，按首次出现顺序）"""
+    texts = {}
+
+    def walk(value):
+        if isinstance(value, dict):
+            for k, v in value.items():
+                if k not in _SKIP_KEYS:
+                    walk(v)
+        elif isinstance(value, list):
+            for v in value:
+                walk(v)
+        elif isinstance(value, str) and _HAS_WORDS.search(value):
+            texts.setdefault(value.strip(), None)
+
+    walk(_without_items(recommendation))
+    return list(texts)
+
+
+def chunk_texts(texts, max_chars=TRANSLATE_CHUNK_CHARS):
+    """按字符数把文本分成若干块，每块单独请求翻译"""
+    chunks = []
+    current = []
+    size = 0
+    for text in texts:
+        if current and size + len(text) > max_chars:
+            chunks.append(current)
+            current = []
+            size = 0
+        current.append(text)
+        size += len(text)
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def build_translation_prompt(texts, target_language):
+    """构造一块文本的翻译prompt，输入输出都是以序号为键的JSON对象"""
+    numbered = {str(i): text for i, text in enumerate(texts)}
+    return f"""请将以下饮食推荐中的文本翻译成{target_language_name(target_language)}。
+要求:
+1. 返回JSON对象，键与输入完全相同，值为对应的译文
+2. 数字、单位保持不变，菜名翻译为通用的名称
+3. 直接返回JSON,不要有其他说明文字
+
+待翻译内容:
+```json
+{json.dumps(numbered, ensure_ascii=False, indent=2)}
+```"""
+
+
+def parse_translation(content, texts):
+    """解析一块翻译结果，返回{原文: 译文}；缺失或无法解析的条目不在结果中"""
+    scanner = RecommendationJSONScanner()
+    scanner.feed(content or '')
+    translated, _ = scanner.finish()
+    if not isinstance(translated, dict):
+        return {}
+
+    result = {}
+    for i, text in enumerate(texts):
+        value = translated.get(str(i))
+        if isinstance(value, str) and value.strip():
+            result[text] = value.strip()
+    return result
+
+
+def apply_translations(recommendation, translations):
+    """按原结构写回译文，返回新的推荐对象（未翻译的文本保留原文）"""
+
+    def walk(value):
+        if isinstance(value, dict):
+            return {k: (v if k in _SKIP_KEYS else walk(v)) for k, v in value.items()}
+        if isinstance(value, list):
+            return [walk(v) for v in value]
+        if isinstance(value, str):
+            return translations.get(value.strip(), value)
+        return value
+
+    return normalize_recommendation(walk(_without_items(recommendation)))
+
+
+def read_translate_request(data):
+    """解析翻译请求，返回(推荐对象, 目标语言名称)；参数不合法或不支持目标语言时抛出ValueError"""
+    recommendation = data.get('recommendation')
+    if not isinstance(recommendation, dict) or normalize_recommendation(dict(recommendation)) is None:
+        raise ValueError('Missing recommendation')
+    target_language = data.get('targetLang') or data.get('language')
+    if not target_language:
+        raise ValueError('Missing targetLang')
+    return recommendation, target_language_name(target_language)
+
+
+def translate_kwargs(texts, target_language):
+    """一块文本的上游调用参数"""
+    return {
+        'model': TRANSLATE_MODEL,
+        'max_tokens': TRANSLATE_MAX_TOKENS,
+        'temperature': 0.3,
+        'messages': [
+            {"role": "user", "content": build_translation_prompt(texts, target_language)}
+        ]
+    }
+
+
+def translate_response(result, source):
+    """翻译接口的成功响应，result为{'recommendation', 'translated', 'total'}
+
+    partial表示有文本块翻译失败、保留了原文
+    """
+    return {
+        'success': True,
+        **result,
+        'partial': result['translated'] < result['total'],
+        'cached': source == 'cache',
+        'shared': source == 'shared'
+    }